@@ -0,0 +1,21 @@
+import hashlib
+import sys
+from blake3 import blake3
+
+# Writes <artifact>.blake2b and <artifact>.blake3 next to the artifact, in the same
+# "<hex digest>  <file name>" format as sha256sum
+
+def main(path):
+    blake2b_hash = hashlib.blake2b()
+    blake3_hash = blake3()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            blake2b_hash.update(chunk)
+            blake3_hash.update(chunk)
+
+    for algorithm, digest in (("blake2b", blake2b_hash), ("blake3", blake3_hash)):
+        with open(f"{path}.{algorithm}", 'w') as file:
+            file.write(f"{digest.hexdigest()}  {path}\n")
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Compares the client's old asset handling (images loaded as-is, the button
+# smoothscaled at startup, one Font object per widget) with the atlas from
+# build_assets.py converted to the display format by AssetManager.
+#
+#   python client/build_assets.py && python bench/asset_bench.py --blits 20000
+#
+# Reports startup asset-load time and the cost of blitting each image to the screen.
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(ROOT_DIR, "client")
+ASSETS_DIR = os.path.join(CLIENT_DIR, "assets")
+sys.path.insert(0, CLIENT_DIR)
+
+import pygame
+from asset_manager import IMAGES, AssetManager
+
+FONT_FILE = "ArialRoundedMTBold.ttf"
+# Font sizes the client's widgets use: the timer, four buttons and the version box
+FONT_SIZES = [120, 20, 20, 20, 20, 20]
+
+def load_legacy():
+    images = {}
+    for name, (filename, size) in IMAGES.items():
+        image = pygame.image.load(os.path.join(ASSETS_DIR, filename))
+        if size is not None:
+            image = pygame.transform.smoothscale(image, size)
+        images[name] = image
+    fonts = [pygame.font.Font(os.path.join(ASSETS_DIR, FONT_FILE), size) for size in FONT_SIZES]
+    return images, fonts
+
+def load_atlas():
+    assets = AssetManager(ASSETS_DIR)
+    images = {name: assets.image(name) for name in IMAGES}
+    fonts = [assets.font(FONT_FILE, size) for size in FONT_SIZES]
+    return images, fonts
+
+def time_load(loader, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        loader()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def time_blits(screen, image, blits):
+    screen.blit(image, (0, 0))
+    start = time.perf_counter()
+    for _ in range(blits):
+        screen.blit(image, (0, 0))
+    return (time.perf_counter() - start) / blits
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client asset loading and blitting")
+    parser.add_argument("--runs", type=int, default=20, help="Load repetitions, the best one is reported")
+    parser.add_argument("--blits", type=int, default=10000, help="Blits per image and path")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    pygame.init()
+    screen = pygame.display.set_mode((900, 600))
+
+    results = {
+        "load_ms": {
+            "legacy": round(time_load(load_legacy, args.runs) * 1000, 3),
+            "atlas": round(time_load(load_atlas, args.runs) * 1000, 3),
+        },
+        "blit_us": {},
+    }
+    legacy_images, _ = load_legacy()
+    atlas_images, _ = load_atlas()
+    for name in IMAGES:
+        results["blit_us"][name] = {
+            "legacy": round(time_blits(screen, legacy_images[name], args.blits) * 1e6, 3),
+            "atlas": round(time_blits(screen, atlas_images[name], args.blits) * 1e6, 3),
+        }
+
+    print(f"{'':>16} {'legacy':>10} {'atlas':>10}")
+    print(f"{'load ms':>16} {results['load_ms']['legacy']:>10} {results['load_ms']['atlas']:>10}")
+    for name, result in results["blit_us"].items():
+        print(f"{name + ' blit us':>16} {result['legacy']:>10} {result['atlas']:>10}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
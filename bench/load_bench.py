@@ -0,0 +1,497 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+
+# Load test for the update server.
+#
+# Runs server/server.py against a local stand-in for the GitHub releases API that
+# serves fake releases with zip assets of configurable size. Clients first download
+# the base release, then the target release is published through the webhook and
+# the bench drives the polling endpoints (/check-version, /get-update, /negotiate)
+# and the download paths (/download with and without Range, /delta, /chunks) with
+# many concurrent clients. Downloads over MAX_CONCURRENT_DOWNLOADS get the
+# admission limiter's 503, which is counted and must carry a Retry-After.
+#
+#   python bench/load_bench.py --clients 1000 --requests 20000 --zip-size 50
+#   python bench/load_bench.py --workers 1 4
+#
+# Reports latency percentiles, throughput, server RSS and how many calls reached
+# the fake upstream, optionally as JSON so runs can be compared between versions.
+# Fails when an upstream asset was fetched more than once.
+# With several --workers counts the whole run is repeated for each, against a cold
+# artifact store, and throughput is compared between them.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+OWNER = "bench"
+REPO = "app"
+BASE_VERSION = "v9.9.8"
+VERSION = "v9.9.9"
+OS_VERSIONS = ["linux", "macos", "windows"]
+
+WEBHOOK_SECRET = "bench"
+
+# Size of the byte ranges requested by the /download-range scenario, like a resumed download
+RANGE_SIZE = 256 * 1024
+
+POLLING_ENDPOINTS = ["/check-version", "/get-update", "/negotiate"]
+# Admission limited, a 503 with Retry-After is an expected answer
+DOWNLOAD_ENDPOINTS = ["/download", "/download-range", "/delta", "/chunks"]
+
+class FakeGitHub:
+    # Just enough of the releases API for server.py: the latest release and asset downloads.
+    # Starts out with BASE_VERSION as the latest release until publish() is called
+    def __init__(self, work_dir, zip_size_mb):
+        self.assets = {}
+        self.digests = {}
+        self.calls = {}
+        self.asset_calls = {}
+        self.calls_lock = threading.Lock()
+        for os_version in OS_VERSIONS:
+            paths = {tag: os.path.join(work_dir, f"app-{os_version}-{tag}.zip") for tag in (BASE_VERSION, VERSION)}
+            make_zips(paths[BASE_VERSION], paths[VERSION], zip_size_mb)
+            for tag, zip_path in paths.items():
+                digest = hashlib.sha256()
+                with open(zip_path, 'rb') as file:
+                    for block in iter(lambda: file.read(MB), b""):
+                        digest.update(block)
+                sha256 = digest.hexdigest()
+                self.digests[tag, os_version] = sha256
+                self.assets[f"{tag}/app-{os_version}.zip"] = ("file", zip_path)
+                # The server looks checksums up as "<zip name>.sha256", like the release workflow names them
+                self.assets[f"{tag}/app-{os_version}.zip.sha256"] = ("bytes", f"{sha256}  app-{os_version}.zip\n".encode())
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.publish(BASE_VERSION)
+
+    def publish(self, tag):
+        release = {
+            "tag_name": tag,
+            "assets": [
+                {"name": key.partition("/")[2], "url": f"{self.base_url}/assets/{key}", "size": self.asset_size(key)}
+                for key in self.assets if key.startswith(f"{tag}/")
+            ],
+        }
+        body = json.dumps(release).encode()
+        self.release_body = body
+        self.release_etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+    def asset_size(self, key):
+        kind, value = self.assets[key]
+        return os.path.getsize(value) if kind == "file" else len(value)
+
+    def count(self, call, asset=None):
+        with self.calls_lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+            if asset is not None:
+                self.asset_calls[asset] = self.asset_calls.get(asset, 0) + 1
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == f"/repos/{OWNER}/{REPO}/releases/latest":
+                    release_body, release_etag = fake.release_body, fake.release_etag
+                    if self.headers.get("If-None-Match") == release_etag:
+                        fake.count("latest_release_not_modified")
+                        self.send_response(304)
+                        self.send_header("ETag", release_etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    fake.count("latest_release")
+                    self.send_body(release_body, "application/json", {"ETag": release_etag})
+                    return
+
+                key = self.path[len("/assets/"):]
+                if self.path.startswith("/assets/") and key in fake.assets:
+                    fake.count("asset_zip" if key.endswith(".zip") else "asset_checksum", key)
+                    kind, value = fake.assets[key]
+                    if kind == "bytes":
+                        self.send_body(value, "application/octet-stream")
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(os.path.getsize(value)))
+                    self.end_headers()
+                    with open(value, 'rb') as file:
+                        shutil.copyfileobj(file, self.wfile, MB)
+                    return
+
+                fake.count("not_found")
+                self.send_body(b'{"message": "Not Found"}', "application/json", status=404)
+
+            def send_body(self, body, content_type, headers=None, status=200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+def make_zips(base_path, target_path, size_mb):
+    # Random payload stored uncompressed, so the assets really are size_mb large. The
+    # target release only changes the start of it, the rest is a delta's copy from the base
+    with zipfile.ZipFile(base_path, 'w', zipfile.ZIP_STORED) as base_zip, \
+            zipfile.ZipFile(target_path, 'w', zipfile.ZIP_STORED) as target_zip:
+        with base_zip.open("client", 'w') as base_member, target_zip.open("client", 'w') as target_member:
+            for index in range(size_mb):
+                block = os.urandom(MB)
+                base_member.write(block)
+                target_member.write(os.urandom(64 * 1024) + block[64 * 1024:] if index == 0 else block)
+
+def rss_mb(pid):
+    # The server plus, with several workers, the worker processes it started
+    total = None
+    for selector in (["-p", str(pid)], ["--ppid", str(pid)]):
+        completed = subprocess.run(["ps", "-o", "rss=", *selector], capture_output=True, text=True)
+        for line in completed.stdout.split():
+            total = (total or 0) + int(line)
+    return total / 1024 if total is not None else None
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            rss = rss_mb(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+def start_server(port, upstream_url, artifact_dir, workers, release_ttl, max_downloads):
+    env = dict(
+        os.environ,
+        GITHUB_API_BASE_URL=upstream_url,
+        GITHUB_OWNER=OWNER,
+        GITHUB_REPO=REPO,
+        GITHUB_TOKEN="bench",
+        GITHUB_WEBHOOK_SECRET=WEBHOOK_SECRET,
+        ARTIFACT_STORE_DIR=artifact_dir,
+        PREFETCH_INTERVAL="0",
+        RELEASE_CACHE_TTL=str(release_ttl),
+    )
+    if max_downloads is not None:
+        env["MAX_CONCURRENT_DOWNLOADS"] = str(max_downloads)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:api", "--app-dir", os.path.join(ROOT_DIR, "server"),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--workers", str(workers)],
+        env=env,
+    )
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/health_check").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {base_url} did not start within {timeout}s")
+
+def poll_until(url, params, accept, timeout=60):
+    # New connections land on any worker, wait until several answers in a row agree
+    deadline = time.monotonic() + timeout
+    agreed = 0
+    while agreed < 10:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not give the expected answer within {timeout}s")
+        response = httpx.get(url, params=params, timeout=60)
+        if response.status_code == 200 and accept(response.json()):
+            agreed += 1
+            answer = response.json()
+        else:
+            agreed = 0
+            time.sleep(0.2)
+    return answer
+
+def prepare_releases(base_url, fake):
+    # Clients download the base release, then the target release is published the way
+    # GitHub announces it. Returns what the download scenarios request: artifact sizes,
+    # delta URLs (once the deltas are built) and the target's chunk digests
+    with httpx.Client(base_url=base_url, timeout=120) as http:
+        for os_version in OS_VERSIONS:
+            http.get(f"/download/{BASE_VERSION}/{os_version}").raise_for_status()
+
+    fake.publish(VERSION)
+    body = json.dumps({"action": "published"}).encode()
+    signature = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    httpx.post(f"{base_url}/webhooks/github", content=body,
+               headers={"X-GitHub-Event": "release", "X-Hub-Signature-256": signature}).raise_for_status()
+
+    targets = {"sizes": {}, "deltas": {}, "chunks": []}
+    for os_version in OS_VERSIONS:
+        params = {
+            "os_version": os_version,
+            "current_version": BASE_VERSION,
+            "base_sha256": fake.digests[BASE_VERSION, os_version],
+            "capabilities": ["delta"],
+        }
+        negotiation = poll_until(f"{base_url}/negotiate", params, lambda answer: answer["delivery"] == "delta")
+        targets["sizes"][os_version] = negotiation["update"]["size"]
+        targets["deltas"][os_version] = negotiation["update"]["delta"]["download_url"]
+
+        manifest = poll_until(f"{base_url}/manifest/{VERSION}/{os_version}", None, lambda answer: True)
+        targets["chunks"] += [sha256 for entry in manifest["files"] for sha256, _ in entry["chunks"]]
+    return targets
+
+def scenario_request(endpoint, targets, index, sequence):
+    # (path, params, headers) for a request of client `index`. A client's platform is
+    # fixed, so its /negotiate answer repeats and polls revalidate
+    os_version = OS_VERSIONS[index % len(OS_VERSIONS)]
+    if endpoint == "/get-update":
+        return endpoint, {"os_version": OS_VERSIONS[sequence % len(OS_VERSIONS)]}, {}
+    if endpoint == "/negotiate":
+        return endpoint, {"os_version": os_version, "current_version": "v0.0.0"}, {}
+    if endpoint == "/download":
+        return f"/download/{VERSION}/{os_version}", None, {}
+    if endpoint == "/download-range":
+        start = random.randrange(targets["sizes"][os_version])
+        return f"/download/{VERSION}/{os_version}", None, {"Range": f"bytes={start}-{start + RANGE_SIZE - 1}"}
+    if endpoint == "/delta":
+        return targets["deltas"][os_version], None, {}
+    if endpoint == "/chunks":
+        return f"/chunks/{targets['chunks'][sequence % len(targets['chunks'])]}", None, {}
+    return endpoint, None, {}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def drive(base_url, endpoint, targets, clients, total_requests):
+    # Every simulated client polls like the updaters do: it remembers the ETag of
+    # /check-version or /negotiate and revalidates with If-None-Match on the next poll.
+    # Download bodies are read to the end, as a client would
+    latencies = []
+    statuses = {}
+    errors = 0
+    received = 0
+    missing_retry_after = 0
+    remaining = total_requests
+
+    async def client(http, index):
+        nonlocal remaining, errors, received, missing_retry_after
+        etag = None
+        while remaining > 0:
+            remaining -= 1
+            path, params, headers = scenario_request(endpoint, targets, index, remaining)
+            if etag and endpoint in ("/check-version", "/negotiate"):
+                headers = {**headers, "If-None-Match": etag}
+            start = time.perf_counter()
+            try:
+                async with http.stream("GET", path, headers=headers, params=params) as response:
+                    async for block in response.aiter_raw():
+                        received += len(block)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 503 and "Retry-After" not in response.headers:
+                missing_retry_after += 1
+            etag = response.headers.get("ETag", etag)
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http, index) for index in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "clients": clients,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "throughput_mb_s": round(received / MB / elapsed, 1),
+        "missing_retry_after": missing_retry_after,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+def unexpected_statuses(result):
+    # Anything but 2xx, 304 and the admission limiter's 503 means the numbers describe error responses
+    expected = {"304", "503"} if result["endpoint"] in DOWNLOAD_ENDPOINTS else {"304"}
+    return {status: count for status, count in result["status_codes"].items()
+            if not (200 <= int(status) < 300 or status in expected)}
+
+def run_failures(run, workers):
+    failures = {}
+    for result in run["results"]:
+        failure = unexpected_statuses(result)
+        if result["errors"]:
+            failure["errors"] = result["errors"]
+        if result["missing_retry_after"]:
+            failure["503 without Retry-After"] = result["missing_retry_after"]
+        if failure:
+            failures[f"{result['endpoint']} ({workers} workers)"] = failure
+    if run["release_fills"]["count"] > run["release_fills"]["allowed"]:
+        failures[f"release fills ({workers} workers)"] = run["release_fills"]
+    # Every artifact and checksum is fetched from GitHub once, however many workers and clients ask
+    refetched = {asset: count for asset, count in run["upstream_asset_calls"].items() if count > 1}
+    if refetched:
+        failures[f"upstream calls per asset ({workers} workers)"] = refetched
+    return failures
+
+def release_fills_allowed(seconds, release_ttl):
+    # The workers share the release document, so across all of them it is fetched
+    # once, refreshed once for the webhook and otherwise revalidated at most once per TTL
+    return 2 + int(seconds // release_ttl)
+
+def run_workers(args, fake, work_dir, workers):
+    fake.publish(BASE_VERSION)
+    fake.calls = {}
+    fake.asset_calls = {}
+    base_url = f"http://127.0.0.1:{args.port}"
+    started_at = time.monotonic()
+    server = start_server(args.port, fake.base_url, os.path.join(work_dir, f"artifacts-{workers}"), workers,
+                          args.release_ttl, args.max_downloads)
+    try:
+        wait_for_server(base_url)
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        rss_start = rss_mb(server.pid)
+        targets = prepare_releases(base_url, fake)
+
+        results = []
+        print(f"Workers: {workers}")
+        print(f"{'endpoint':>16} {'requests':>9} {'errors':>7} {'503':>6} {'req/s':>9} {'MB/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint in args.endpoints:
+            requests = args.download_requests if endpoint in DOWNLOAD_ENDPOINTS else args.requests
+            result = asyncio.run(drive(base_url, endpoint, targets, args.clients, requests))
+            results.append(result)
+            print(f"{endpoint:>16} {result['requests']:>9} {result['errors']:>7} "
+                  f"{result['status_codes'].get('503', 0):>6} {result['throughput_rps']:>9} "
+                  f"{result['throughput_mb_s']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8}")
+
+        sampler.stop()
+        run = {
+            "workers": workers,
+            "results": results,
+            "server_rss_mb": {"start": rss_start, "end": rss_mb(server.pid), "peak": sampler.peak},
+            "upstream_calls": dict(sorted(fake.calls.items())),
+            "upstream_asset_calls": dict(sorted(fake.asset_calls.items())),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+    seconds = time.monotonic() - started_at
+    release_fills = fake.calls.get("latest_release", 0) + fake.calls.get("latest_release_not_modified", 0)
+    run["release_fills"] = {"count": release_fills, "allowed": release_fills_allowed(seconds, args.release_ttl)}
+    print(f"Server RSS: {run['server_rss_mb']}")
+    print(f"Upstream calls: {run['upstream_calls']}")
+    print(f"Release fills: {release_fills} in {seconds:.1f}s (at most {run['release_fills']['allowed']} "
+          f"with a {args.release_ttl}s TTL)")
+    run["failures"] = run_failures(run, workers)
+    return run
+
+def print_scaling(runs):
+    # Throughput of every run relative to the first worker count
+    print("Scaling:")
+    print(f"{'endpoint':>16} " + " ".join(f"{str(run['workers']) + ' workers':>18}" for run in runs))
+    for index, result in enumerate(runs[0]["results"]):
+        baseline = result["throughput_rps"]
+        cells = []
+        for run in runs:
+            rps = run["results"][index]["throughput_rps"]
+            cells.append(f"{rps:>9} ({rps / baseline if baseline else 0:4.2f}x)")
+        print(f"{result['endpoint']:>16} " + " ".join(f"{cell:>18}" for cell in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the update server endpoints")
+    parser.add_argument("--clients", type=int, default=500, help="Concurrent polling clients")
+    parser.add_argument("--requests", type=int, default=10000, help="Requests per endpoint")
+    parser.add_argument("--zip-size", type=int, default=50, help="Size of the fake release zips in MB")
+    parser.add_argument("--download-requests", type=int, default=200,
+                        help="Requests per download scenario (/download, /download-range, /delta, /chunks)")
+    parser.add_argument("--endpoints", nargs="+", default=POLLING_ENDPOINTS + DOWNLOAD_ENDPOINTS,
+                        choices=POLLING_ENDPOINTS + DOWNLOAD_ENDPOINTS)
+    parser.add_argument("--max-downloads", type=int,
+                        help="MAX_CONCURRENT_DOWNLOADS per worker, below --clients to exercise the 503 path")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="Server worker counts to run the bench with, e.g. --workers 1 4")
+    parser.add_argument("--release-ttl", type=float, default=60, help="RELEASE_CACHE_TTL for the server in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--work-dir", help="Directory for the fake assets and artifact store (default: temporary)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="load-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    fake = FakeGitHub(work_dir, args.zip_size)
+    fake.start()
+    try:
+        runs = [run_workers(args, fake, work_dir, workers) for workers in args.workers]
+    finally:
+        fake.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if len(runs) > 1:
+        print_scaling(runs)
+
+    report = {
+        "config": {"clients": args.clients, "requests": args.requests, "download_requests": args.download_requests,
+                   "zip_size_mb": args.zip_size, "release_ttl": args.release_ttl, "max_downloads": args.max_downloads},
+        "runs": runs,
+        "failures": {key: value for run in runs for key, value in run["failures"].items()},
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if report["failures"]:
+        print(f"ERROR: requests failed or got unexpected status codes, the results above are not valid: {report['failures']}",
+              file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
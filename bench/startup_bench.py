@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# Startup benchmark for the client.
+#
+# Launches the client repeatedly in each packaging mode and measures the time from
+# process start to the "First frame drawn" line it prints. The client's own number
+# only starts once client.py runs, so the difference between the two is what the
+# launcher costs before Python gets going (for onefile, unpacking the bundle).
+#
+#   make bench-startup
+#   python bench/startup_bench.py --onefile client/dist/dist/client --runs 10
+#
+# The window is opened on SDL's dummy video driver unless --display is given.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_FRAME_PATTERN = re.compile(r"First frame drawn ([\d.]+) ms after startup")
+
+def launch_once(command, env, timeout):
+    # Returns (ms from process start to first frame, ms reported by the client itself)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    watchdog = threading.Timer(timeout, process.kill)
+    watchdog.start()
+    try:
+        for line in process.stdout:
+            match = FIRST_FRAME_PATTERN.search(line)
+            if match:
+                return (time.perf_counter() - start) * 1000, float(match.group(1))
+        raise RuntimeError(f"{command[0]} exited without drawing a frame (status {process.wait()})")
+    finally:
+        watchdog.cancel()
+        process.kill()
+        process.wait()
+
+def summarize(mode, samples):
+    wall = sorted(sample[0] for sample in samples)
+    in_process = sorted(sample[1] for sample in samples)
+    return {
+        "mode": mode,
+        "runs": len(samples),
+        "first_frame_p50_ms": round(statistics.median(wall), 1),
+        "first_frame_min_ms": round(wall[0], 1),
+        "first_frame_max_ms": round(wall[-1], 1),
+        "in_process_p50_ms": round(statistics.median(in_process), 1),
+        "launcher_overhead_p50_ms": round(statistics.median(wall) - statistics.median(in_process), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client process-start-to-first-frame time per packaging mode")
+    parser.add_argument("--onefile", help="Path to a client executable built with --onefile")
+    parser.add_argument("--onedir", help="Path to the executable inside a client built with --onedir")
+    parser.add_argument("--no-source", action="store_true", help="Skip running client/client.py with this interpreter")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the first frame")
+    parser.add_argument("--display", action="store_true", help="Open a real window instead of using SDL's dummy driver")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    modes = []
+    if not args.no_source:
+        modes.append(("source", [sys.executable, os.path.join(ROOT_DIR, "client", "client.py")]))
+    for mode, path in (("onefile", args.onefile), ("onedir", args.onedir)):
+        if path:
+            modes.append((mode, [os.path.abspath(path)]))
+    if not modes:
+        parser.error("Nothing to benchmark")
+
+    env = dict(os.environ)
+    if not args.display:
+        env.setdefault("SDL_VIDEODRIVER", "dummy")
+        env.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    results = []
+    print(f"{'mode':>8} {'runs':>5} {'p50 ms':>8} {'min ms':>8} {'max ms':>8} {'in-process p50':>15} {'launcher p50':>13}")
+    for mode, command in modes:
+        try:
+            samples = [launch_once(command, env, args.timeout) for _ in range(args.runs)]
+        except (OSError, RuntimeError) as e:
+            print(f"{mode:>8} failed: {e}")
+            continue
+        result = summarize(mode, samples)
+        results.append(result)
+        print(f"{mode:>8} {result['runs']:>5} {result['first_frame_p50_ms']:>8} {result['first_frame_min_ms']:>8} "
+              f"{result['first_frame_max_ms']:>8} {result['in_process_p50_ms']:>15} {result['launcher_overhead_p50_ms']:>13}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
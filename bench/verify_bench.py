@@ -0,0 +1,113 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Compares the legacy verification path (base64 payload decoded in memory, then
+# hashed in 4 KB reads) with the streaming path used by the updaters (bytes hashed
+# once as they are written to disk through a reusable buffer).
+#
+#   python bench/verify_bench.py --sizes 50 200 1024 --digests sha256 blake2b blake3
+#
+# Every case runs in its own process so peak RSS is measured independently.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MB = 1024 * 1024
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+def make_artifact(path, size_mb):
+    if os.path.exists(path) and os.path.getsize(path) == size_mb * MB:
+        return
+    with open(path, 'wb') as file:
+        for _ in range(size_mb):
+            file.write(os.urandom(MB))
+
+def run_legacy(artifact_path, digest_name):
+    # What the server used to send: the whole zip base64-encoded inside a JSON body
+    with open(artifact_path, 'rb') as file:
+        payload = base64.b64encode(file.read()).decode('utf-8')
+
+    start = time.perf_counter()
+    file_data = base64.b64decode(payload)
+    digest = hashlib.new(digest_name)
+    buffer = io.BytesIO(file_data)
+    for byte_block in iter(lambda: buffer.read(4096), b""):
+        digest.update(byte_block)
+    digest.hexdigest()
+    return time.perf_counter() - start
+
+def run_streaming(artifact_path, digest_name):
+    from client.update_common import DOWNLOAD_CHUNK_SIZE, copy_and_hash, new_digest
+
+    digest = new_digest(digest_name)
+    view = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        # The artifact file stands in for the HTTP response body
+        with open(artifact_path, 'rb') as source, open(os.path.join(tmp_dir, "download.zip"), 'wb') as target:
+            copy_and_hash(source, target, digest, view)
+        digest.hexdigest()
+        return time.perf_counter() - start
+
+def run_case(mode, artifact_path, digest_name):
+    runner = run_legacy if mode == "legacy" else run_streaming
+    elapsed = runner(artifact_path, digest_name)
+    size_mb = os.path.getsize(artifact_path) / MB
+    print(json.dumps({
+        "seconds": round(elapsed, 3),
+        "throughput_mb_s": round(size_mb / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark update verification paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1024], help="Artifact sizes in MB")
+    parser.add_argument("--digests", nargs="+", default=["sha256", "blake2b", "blake3"])
+    parser.add_argument("--work-dir", default=tempfile.gettempdir())
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--case", nargs=3, metavar=("MODE", "ARTIFACT", "DIGEST"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(*args.case)
+        return
+
+    results = []
+    print(f"{'size':>8} {'digest':>8} {'path':>10} {'seconds':>8} {'MB/s':>8} {'peak RSS MB':>12}")
+    for size_mb in args.sizes:
+        artifact_path = os.path.join(args.work_dir, f"verify-bench-{size_mb}mb.bin")
+        make_artifact(artifact_path, size_mb)
+        for digest_name in args.digests:
+            for mode in ("legacy", "streaming"):
+                if mode == "legacy" and digest_name == "blake3":
+                    continue  # The legacy path only ever used hashlib
+                completed = subprocess.run(
+                    [sys.executable, __file__, "--case", mode, artifact_path, digest_name],
+                    capture_output=True, text=True)
+                if completed.returncode != 0:
+                    print(f"{size_mb:>6}MB {digest_name:>8} {mode:>10} failed: {completed.stderr.strip().splitlines()[-1]}")
+                    continue
+                result = {"size_mb": size_mb, "digest": digest_name, "path": mode,
+                          **json.loads(completed.stdout.strip().splitlines()[-1])}
+                results.append(result)
+                print(f"{size_mb:>6}MB {digest_name:>8} {mode:>10} {result['seconds']:>8} "
+                      f"{result['throughput_mb_s']:>8} {result['peak_rss_mb']:>12}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+import os
+import pygame
+
+# Images are pre-scaled to the size they are drawn at and packed into one atlas by
+# build_assets.py at build time. At runtime the atlas is loaded and converted to the
+# display's pixel format once, and every image is a subsurface of it, so no scaling
+# happens at startup and blits don't convert pixels on the fly.
+
+ATLAS_IMAGE = "atlas.png"
+ATLAS_INDEX = "atlas.json"
+
+# Transparent gap between packed images so smoothscaled edges don't bleed into each other
+ATLAS_PADDING = 1
+
+# name: (source file in assets/, size it is drawn at or None to keep the source size)
+IMAGES = {
+    "backdrop": ("backdrop.png", None),
+    "button": ("button.png", (170, 60)),
+}
+
+def pack(sizes, padding=ATLAS_PADDING):
+    # Shelf packing: tallest images first, left to right, starting a new row when the
+    # current one is full. Returns ({name: (x, y, width, height)}, atlas size)
+    max_width = max(max(width for width, _ in sizes.values()), 1024)
+    rects = {}
+    x = y = shelf_height = atlas_width = 0
+    for name, (width, height) in sorted(sizes.items(), key=lambda item: item[1][1], reverse=True):
+        if x and x + width > max_width:
+            x, y, shelf_height = 0, y + shelf_height + padding, 0
+        rects[name] = (x, y, width, height)
+        x += width + padding
+        shelf_height = max(shelf_height, height)
+        atlas_width = max(atlas_width, x - padding)
+    return rects, (atlas_width, y + shelf_height)
+
+def build_atlas(assets_dir, images=IMAGES):
+    # Returns the atlas surface and its index, used by build_assets.py and as the
+    # fallback when running from source without a built atlas
+    scaled = {}
+    for name, (filename, size) in images.items():
+        image = pygame.image.load(os.path.join(assets_dir, filename))
+        if size is not None and image.get_size() != tuple(size):
+            image = pygame.transform.smoothscale(image, size)
+        scaled[name] = image
+
+    rects, atlas_size = pack({name: image.get_size() for name, image in scaled.items()})
+    atlas = pygame.Surface(atlas_size, pygame.SRCALPHA)
+    for name, image in scaled.items():
+        atlas.blit(image, rects[name][:2])
+
+    index = {
+        "images": {name: {"source": images[name][0], "rect": list(rects[name])} for name in images},
+    }
+    return atlas, index
+
+def atlas_matches(index, images=IMAGES):
+    # False for an atlas built from another image list or for other sizes
+    if set(index["images"]) != set(images):
+        return False
+    return all(size is None or tuple(index["images"][name]["rect"][2:]) == tuple(size)
+               for name, (_, size) in images.items())
+
+class AssetManager:
+    # Loads the atlas on first use and hands out fonts shared by (path, size)
+    def __init__(self, assets_dir):
+        self.assets_dir = assets_dir
+        self.atlas = None
+        self.rects = {}
+        self.images = {}
+        self.fonts = {}
+
+    def load_atlas(self):
+        try:
+            with open(os.path.join(self.assets_dir, ATLAS_INDEX), 'r') as file:
+                index = json.load(file)
+            atlas = pygame.image.load(os.path.join(self.assets_dir, ATLAS_IMAGE))
+        except (FileNotFoundError, ValueError, pygame.error):
+            index = None
+
+        if index is None or not atlas_matches(index):
+            # Running from source without `make assets`, or the image list changed since
+            atlas, index = build_atlas(self.assets_dir)
+
+        # Needs the display mode to be set; a converted atlas blits without per-pixel format conversion
+        self.atlas = atlas.convert_alpha()
+        self.rects = {name: pygame.Rect(entry["rect"]) for name, entry in index["images"].items()}
+
+    def image(self, name):
+        if self.atlas is None:
+            self.load_atlas()
+        if name not in self.images:
+            self.images[name] = self.atlas.subsurface(self.rects[name])
+        return self.images[name]
+
+    def font(self, filename, size):
+        path = os.path.join(self.assets_dir, filename)
+        if (path, size) not in self.fonts:
+            self.fonts[(path, size)] = pygame.font.Font(path, size)
+        return self.fonts[(path, size)]
@@ -0,0 +1,34 @@
+import argparse
+import json
+import os
+
+# Build-time asset step, run by `make build` and the release workflow before
+# PyInstaller: writes assets/atlas.png and assets/atlas.json from the images listed
+# in asset_manager.IMAGES, pre-scaled to the sizes the client draws them at.
+#
+#   python client/build_assets.py
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from asset_manager import ATLAS_IMAGE, ATLAS_INDEX, build_atlas
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-scale the client's images and pack them into an atlas")
+    parser.add_argument("--assets-dir", default=ASSETS_DIR)
+    args = parser.parse_args()
+
+    pygame.init()
+    atlas, index = build_atlas(args.assets_dir)
+    pygame.image.save(atlas, os.path.join(args.assets_dir, ATLAS_IMAGE))
+    with open(os.path.join(args.assets_dir, ATLAS_INDEX), 'w') as file:
+        json.dump(index, file, indent=2)
+
+    print(f"Packed {len(index['images'])} images into a {atlas.get_width()}x{atlas.get_height()} atlas")
+    for name, entry in index["images"].items():
+        print(f"  {name}: {entry['source']} at {entry['rect']}")
+
+if __name__ == "__main__":
+    main()
@@ -9,30 +9,48 @@ class Button():
         self.height = height
         self.font = font
         self.base_color, self.hovering_color = base_color, hovering_color
-        self.text_input = text_input
-        self.text = self.font.render(self.text_input, True, self.base_color)
+        self.set_text(text_input)
         if self.surface is None:
             self.surface = self.text
-        else:
+        elif self.surface.get_size() != (width, height):
+            # Images from the asset atlas are already pre-scaled to their button size
             self.surface = pygame.transform.smoothscale(self.surface, (width, height))
         self.rect = self.surface.get_rect(center=(self.x_pos, self.y_pos))
+
+    def set_text(self, text_input):
+        # Render the label in both colors once, hovering only swaps between them
+        self.text_input = text_input
+        self.base_text = self.font.render(self.text_input, True, self.base_color)
+        self.hovering_text = self.font.render(self.text_input, True, self.hovering_color)
+        self.text = self.base_text
         self.text_rect = self.text.get_rect(center=(self.x_pos, self.y_pos))
+        self.needs_redraw = True
 
     def update(self, screen, mouse_pos):
         # Update button color based on mouse position
         self.change_color(mouse_pos)
+        self.draw(screen)
+
+    def draw(self, screen):
         # Draw the button surface and text
         if self.surface is not None:
             screen.blit(self.surface, self.rect)
         screen.blit(self.text, self.text_rect)
 
+    def get_dirty_rect(self):
+        # Screen area covered by the button, used for partial redraws
+        return self.rect.union(self.text_rect)
+
     def check_for_input(self, position):
         if position[0] in range(self.rect.left, self.rect.right) and position[1] in range(self.rect.top, self.rect.bottom):
             return True
         return False
 
     def change_color(self, position):
-        if position[0] in range(self.rect.left, self.rect.right) and position[1] in range(self.rect.top, self.rect.bottom):
-            self.text = self.font.render(self.text_input, True, self.hovering_color)
+        # Returns True when the hover state changed and the button needs redrawing
+        previous_text = self.text
+        if self.check_for_input(position):
+            self.text = self.hovering_text
         else:
-            self.text = self.font.render(self.text_input, True, self.base_color)
+            self.text = self.base_text
+        return self.text is not previous_text
@@ -0,0 +1,40 @@
+import mmap
+import re
+
+# Content-defined chunking, used to match chunk manifests published by the server.
+# Must stay identical to server/chunking.py or no local chunk will ever match.
+MIN_CHUNK_SIZE = 2 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+# Eight two-byte anchors: on high-entropy data (compressed zip members) that is one
+# candidate boundary every ~8 KiB
+ANCHOR_PATTERN = re.compile(
+    b"\x9c\x5e|\x3b\xa7|\xd1\x0f|\x6e\xc2|\x25\x8b|\xf4\x39|\x87\x1d|\x4a\xe6"
+)
+
+def chunk_boundaries(data):
+    # Yield (offset, length) pairs covering `data` (bytes or mmap)
+    size = len(data)
+    start = 0
+    for match in ANCHOR_PATTERN.finditer(data):
+        end = match.end()
+        if end - start < MIN_CHUNK_SIZE:
+            continue
+        while end - start > MAX_CHUNK_SIZE:
+            yield start, MAX_CHUNK_SIZE
+            start += MAX_CHUNK_SIZE
+        if end - start >= MIN_CHUNK_SIZE:
+            yield start, end - start
+            start = end
+
+    while size - start > MAX_CHUNK_SIZE:
+        yield start, MAX_CHUNK_SIZE
+        start += MAX_CHUNK_SIZE
+    if start < size:
+        yield start, size - start
+
+def map_file(file):
+    # mmap can't map empty files, fall back to an empty buffer
+    if file.seek(0, 2) == 0:
+        return b""
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -1,8 +1,23 @@
+import time
+
+# Reference point for the startup-to-first-frame measurement
+STARTUP_TIME = time.perf_counter()
+
 import pygame
 import sys
 import os
+import subprocess
+from asset_manager import AssetManager
 from button import Button
-from updater import read_current_version, check_for_updates
+from handover import confirm_handover, current_install_command, hand_over, launch_command, receive_handover
+from telemetry import RECORDER
+
+# Updates are installed next to this version rather than over it. Started from an
+# older install, e.g. through a shortcut to the original one, start the current one
+current_install = current_install_command()
+if current_install is not None:
+    subprocess.Popen(current_install)
+    sys.exit()
 
 pygame.init()
 
@@ -25,6 +40,13 @@ background_color = RED  # Default background color
 # Initialize clock
 CLOCK = pygame.time.Clock()
 
+# Upper bound on frame rate while there is input to react to. When idle the loop
+# blocks on the event queue and only wakes for input or the once-a-second timer.
+MAX_FPS = 30
+
+# Frame, startup and update timings are uploaded to the update server unless this is 0
+TELEMETRY_ENABLED = os.getenv("POMODORO_TELEMETRY", "1") != "0"
+
 # Get the base directory for assets
 if getattr(sys, 'frozen', False):
     # If running from a frozen executable
@@ -36,24 +58,29 @@ else:
 ASSETS_DIR = os.path.join(BASE_DIR, 'assets')
 VERSION_FILE = os.path.join(BASE_DIR, 'version.txt')
 
-# Load assets
-BACKDROP = pygame.image.load(os.path.join(ASSETS_DIR, "backdrop.png"))
-WHITE_BUTTON = pygame.image.load(os.path.join(ASSETS_DIR, "button.png"))
+# Load assets: images come pre-scaled from the atlas in the display's pixel format,
+# fonts are loaded once and shared by every widget using the same size
+ASSETS = AssetManager(ASSETS_DIR)
+BACKDROP = ASSETS.image("backdrop")
+WHITE_BUTTON = ASSETS.image("button")
 
-FONT = pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 120)
-VERSION_FONT = pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20)  # Font for the version box
+FONT = ASSETS.font("ArialRoundedMTBold.ttf", 120)
+SMALL_FONT = ASSETS.font("ArialRoundedMTBold.ttf", 20)
+VERSION_FONT = ASSETS.font("ArialRoundedMTBold.ttf", 20)  # Font for the version box
 
 timer_text = FONT.render("25:00", True, WHITE)
 timer_text_rect = timer_text.get_rect(center=(WIDTH/2, HEIGHT/2-25))
+timer_text_seconds = None  # Value timer_text was last rendered for
+timer_text_blit_rect = timer_text_rect.copy()  # Area covered by the last drawn timer text
 
 START_STOP_BUTTON = Button(WHITE_BUTTON, (WIDTH/2, HEIGHT/2+100), 170, 60, "START", 
-                    pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20), "#c97676", "#9ab034")
+                    SMALL_FONT, "#c97676", "#9ab034")
 POMODORO_BUTTON = Button(None, (WIDTH/2-150, HEIGHT/2-140), 120, 30, "Pomodoro", 
-                    pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20), "#FFFFFF", "#9ab034")
+                    SMALL_FONT, "#FFFFFF", "#9ab034")
 SHORT_BREAK_BUTTON = Button(None, (WIDTH/2, HEIGHT/2-140), 120, 30, "Short Break", 
-                    pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20), "#FFFFFF", "#9ab034")
+                    SMALL_FONT, "#FFFFFF", "#9ab034")
 LONG_BREAK_BUTTON = Button(None, (WIDTH/2+150, HEIGHT/2-140), 120, 30, "Long Break", 
-                    pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20), "#FFFFFF", "#9ab034")
+                    SMALL_FONT, "#FFFFFF", "#9ab034")
 
 POMODORO_LENGTH = 1500  # 1500 secs / 25 mins
 SHORT_BREAK_LENGTH = 300  # 300 secs / 5 mins
@@ -62,13 +89,52 @@ LONG_BREAK_LENGTH = 900  # 900 secs / 15 mins
 current_seconds = POMODORO_LENGTH
 pygame.time.set_timer(pygame.USEREVENT, 1000)
 started = False
+mode = "pomodoro"  # Selected session type: "pomodoro", "short_break" or "long_break"
 
-def draw_version_box():
-    version_text = read_current_version()
+# Carry on the session of the version that started us, if it handed one over
+handover_state, handover_connection = receive_handover()
+if handover_state is not None:
+    current_seconds = handover_state["current_seconds"]
+    started = handover_state["started"]
+    mode = handover_state["mode"]
+    START_STOP_BUTTON.set_text("STOP" if started else "START")
+
+# Set by the background update check when a newer version is published
+available_update = None
+update_checker = None
+release_subscriber = None
+update_prefetcher = None  # Downloads available_update in the background
+prefetched_update = None  # Set once the download is verified and extracted
+update_notice = None  # Pre-rendered (surface, rect) for the update notice
+telemetry_uploader = None
+
+VERSION_RECT = pygame.Rect(WIDTH - 160, HEIGHT - 40, 150, 30)  # Position and size of the version box
+version_text = None
+version_box = None  # Pre-rendered version box, rebuilt only when the version changes
+
+def read_current_version():
+    # Same file the updater writes, read here so the updater isn't needed before the first frame
+    try:
+        with open(VERSION_FILE, 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return "Unknown version"
+
+def refresh_version_box():
+    # Returns True when the version changed and the box needs redrawing
+    global version_text, version_box
+    current_version = read_current_version()
+    if current_version == version_text:
+        return False
+    version_text = current_version
+    version_box = pygame.Surface(VERSION_RECT.size)
+    version_box.fill(WHITE)  # Draw the box
     version_surface = VERSION_FONT.render(version_text, True, BLACK)
-    version_rect = pygame.Rect(WIDTH - 160, HEIGHT - 40, 150, 30)  # Position and size of the box
-    pygame.draw.rect(SCREEN, WHITE, version_rect)  # Draw the box
-    SCREEN.blit(version_surface, version_surface.get_rect(center=version_rect.center))
+    version_box.blit(version_surface, version_surface.get_rect(center=version_box.get_rect().center))
+    return True
+
+def draw_version_box():
+    SCREEN.blit(version_box, VERSION_RECT)
 
 def draw_color_options():
     colors = BACKGROUND_COLORS
@@ -80,68 +146,211 @@ def draw_color_options():
         pygame.draw.rect(SCREEN, color, color_rect)
         pygame.draw.rect(SCREEN, BLACK, color_rect, 2)  # Border around each color box
 
-# Check for updates
-def check_for_and_apply_update():
+def render_update_notice(message):
+    notice_surface = VERSION_FONT.render(message, True, BLACK)
+    notice_rect = notice_surface.get_rect(midtop=(WIDTH/2, 10)).inflate(20, 10)
+    notice = pygame.Surface(notice_rect.size)
+    notice.fill(WHITE)
+    notice.blit(notice_surface, notice_surface.get_rect(center=notice.get_rect().center))
+    return notice, notice_rect
+
+def set_update_notice(message):
+    # Returns the area to redraw, covering the previous notice too
+    global update_notice
+    old_notice = update_notice
+    update_notice = render_update_notice(message)
+    if old_notice is None:
+        return update_notice[1]
+    return update_notice[1].union(old_notice[1])
+
+def install_prefetched_update():
+    # The update was downloaded and extracted in the background, this only swaps it in
+    # and restarts into it. Returns the notice area to redraw if we're still running
+    started_at = time.perf_counter()
     try:
-        update_info = check_for_updates()
-        if update_info != None:
-            print("An update is available. Please run 'make update' to update the application.")
-            pygame.quit()
-            sys.exit()
-    except Exception as e:
-        print(f"An error occurred while checking for updates: {e}")
+        install_dir = apply_prefetched_update(prefetched_update)
+    except (OSError, ValueError) as e:
+        print(f"Installing update failed: {e}")
+        forget_prefetched_update()
+        return set_update_notice(f"Installing update {prefetched_update['version']} failed")
+    print(f"Update {prefetched_update['version']} installed in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+
+    # Keep running until the new version has drawn its first frame with this session
+    state = {"current_seconds": current_seconds, "started": started, "mode": mode}
+    if hand_over(state, launch_command(install_dir)):
+        print(f"Handed over to version {prefetched_update['version']} "
+              f"{(time.perf_counter() - started_at) * 1000:.1f} ms after installing")
+        stop_background_work()
+        try:
+            # Only now that it runs does the new version's artifact become the delta base
+            finish_prefetched_update(prefetched_update)
+        except OSError as e:
+            print(f"Could not keep the update as a delta base: {e}")
         pygame.quit()
         sys.exit()
 
+    try:
+        version = rollback_update(prefetched_update)
+    except OSError as e:
+        print(f"Rollback failed: {e}")
+        return set_update_notice(f"Update {prefetched_update['version']} failed to start")
+    print(f"Rolled back to {version or 'the previous version'}")
+    forget_prefetched_update()
+    return set_update_notice(f"Update {prefetched_update['version']} failed to start - rolled back")
+
+def forget_prefetched_update():
+    # Drop the update that couldn't be installed. update_prefetcher stays set, so the
+    # same release isn't downloaded and tried again in a loop; the next start retries
+    discard_prefetched_update(prefetched_update)
+
+def draw_update_notice():
+    SCREEN.blit(*update_notice)
+
+# Check for updates in the background with one /negotiate request per poll, and listen
+# for releases announced by the server. Either result arrives as an UPDATE_AVAILABLE_EVENT
+def check_for_and_apply_update():
+    # Both stop once they have reported an update; only the finished ones are restarted
+    global update_checker, release_subscriber
+    if update_checker is None or not update_checker.is_alive():
+        update_checker = UpdateChecker()
+        update_checker.start()
+    if release_subscriber is None or not release_subscriber.is_alive():
+        release_subscriber = ReleaseSubscriber()
+        release_subscriber.start()
+
+def stop_background_work():
+    if update_prefetcher is not None:
+        # Pauses the download, it resumes from the partial file next time
+        update_prefetcher.stop()
+    if telemetry_uploader is not None:
+        # Sends what was recorded since the last upload, without holding up exit for long
+        telemetry_uploader.stop()
+        telemetry_uploader.join(timeout=2)
+
+BUTTONS = [START_STOP_BUTTON, POMODORO_BUTTON, SHORT_BREAK_BUTTON, LONG_BREAK_BUTTON]
+
+# Events after which the window contents may have been lost and need a full redraw
+REDRAW_EVENTS = {pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWSHOWN}
+
+def draw_scene():
+    SCREEN.fill(background_color)
+
+    for button in BUTTONS:
+        button.draw(SCREEN)
+
+    SCREEN.blit(timer_text, timer_text_rect)
+
+    draw_version_box()
+    if update_notice is not None:
+        draw_update_notice()
+    # TODO: v1.1
+    # draw_color_options()
+
+def redraw(dirty_rects):
+    # Repaint only the dirty areas and push just those rects to the display
+    for rect in dirty_rects:
+        SCREEN.set_clip(rect)
+        draw_scene()
+    SCREEN.set_clip(None)
+    pygame.display.update(dirty_rects)
+
+refresh_version_box()
+
+# Paint the whole window once so the first frame is on screen immediately
+redraw([SCREEN.get_rect()])
+startup_ms = (time.perf_counter() - STARTUP_TIME) * 1000
+RECORDER.observe("startup_ms", startup_ms)
+print(f"First frame drawn {startup_ms:.1f} ms after startup", flush=True)
+if handover_connection is not None:
+    # Tell the previous version it can exit now
+    confirm_handover(handover_connection)
+
+# The updater pulls in requests, so it is only imported once the first frame is up
+from updater import apply_prefetched_update, discard_prefetched_update, finish_prefetched_update, rollback_update
+from update_worker import (ReleaseSubscriber, TelemetryUploader, UpdateChecker, UpdatePrefetcher,
+                           UPDATE_AVAILABLE_EVENT, UPDATE_READY_EVENT)
+
 # Run the update check
 check_for_and_apply_update()
+if TELEMETRY_ENABLED:
+    telemetry_uploader = TelemetryUploader()
+    telemetry_uploader.start()
+dirty_rects = []
 
 while True:
-    for event in pygame.event.get():
+    # Block until there is something to do instead of polling at a fixed frame rate
+    events = [pygame.event.wait()] + pygame.event.get()
+    frame_started = time.perf_counter()  # Frame time excludes the wait for events
+    for event in events:
+        if event.type in REDRAW_EVENTS:
+            dirty_rects.append(SCREEN.get_rect())
         if event.type == pygame.QUIT:
+            stop_background_work()
             pygame.quit()
             sys.exit()
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_u and prefetched_update is not None:
+            dirty_rects.append(install_prefetched_update())
+            prefetched_update = None
         if event.type == pygame.MOUSEBUTTONDOWN:
             mouse_pos = pygame.mouse.get_pos()
             if START_STOP_BUTTON.check_for_input(mouse_pos):
                 started = not started
-                START_STOP_BUTTON.text_input = "STOP" if started else "START"
-                START_STOP_BUTTON.text = pygame.font.Font(os.path.join(ASSETS_DIR, "ArialRoundedMTBold.ttf"), 20).render(
-                    START_STOP_BUTTON.text_input, True, START_STOP_BUTTON.base_color)
+                START_STOP_BUTTON.set_text("STOP" if started else "START")
 
             if POMODORO_BUTTON.check_for_input(mouse_pos):
                 current_seconds = POMODORO_LENGTH
                 started = False
+                mode = "pomodoro"
             if SHORT_BREAK_BUTTON.check_for_input(mouse_pos):
                 current_seconds = SHORT_BREAK_LENGTH
                 started = False
+                mode = "short_break"
             if LONG_BREAK_BUTTON.check_for_input(mouse_pos):
                 current_seconds = LONG_BREAK_LENGTH
                 started = False
+                mode = "long_break"
 
             # TODO: v1.1
             # new_color = get_color_from_pos(mouse_pos)
             # if new_color:
             #     background_color = new_color
 
-        if event.type == pygame.USEREVENT and started:
-            current_seconds -= 1
+        if event.type == pygame.USEREVENT:
+            if started:
+                current_seconds -= 1
+            # The version file only changes when an update is applied, once a second is plenty
+            if refresh_version_box():
+                dirty_rects.append(VERSION_RECT)
 
-    SCREEN.fill(background_color)
+        if event.type == UPDATE_AVAILABLE_EVENT and update_prefetcher is None:
+            # Both the checker and the release subscriber may report the same update
+            available_update = event.version_info
+            update_prefetcher = UpdatePrefetcher(available_update)
+            update_prefetcher.start()
+            dirty_rects.append(set_update_notice(f"Update {available_update['version']} available - downloading in the background"))
 
-    # Update and draw elements
-    START_STOP_BUTTON.update(SCREEN, pygame.mouse.get_pos())
-    POMODORO_BUTTON.update(SCREEN, pygame.mouse.get_pos())
-    SHORT_BREAK_BUTTON.update(SCREEN, pygame.mouse.get_pos())
-    LONG_BREAK_BUTTON.update(SCREEN, pygame.mouse.get_pos())
+        if event.type == UPDATE_READY_EVENT:
+            prefetched_update = event.update
+            dirty_rects.append(set_update_notice(f"Update {prefetched_update['version']} ready - press U to install and restart"))
 
-    # Draw timer text
-    timer_text = FONT.render(f"{current_seconds//60:02}:{current_seconds%60:02}", True, WHITE)
-    SCREEN.blit(timer_text, timer_text_rect)
+    # Update elements and collect the areas that changed
+    mouse_pos = pygame.mouse.get_pos()
+    for button in BUTTONS:
+        if button.change_color(mouse_pos) or button.needs_redraw:
+            dirty_rects.append(button.get_dirty_rect())
+            button.needs_redraw = False
 
-    draw_version_box()
-    # TODO: v1.1
-    # draw_color_options()
+    # Timer text is re-rendered only when the displayed second changes
+    if current_seconds != timer_text_seconds:
+        timer_text = FONT.render(f"{current_seconds//60:02}:{current_seconds%60:02}", True, WHITE)
+        timer_text_seconds = current_seconds
+        new_blit_rect = timer_text.get_rect(topleft=timer_text_rect.topleft)
+        dirty_rects.append(timer_text_blit_rect.union(new_blit_rect))
+        timer_text_blit_rect = new_blit_rect
+
+    if dirty_rects:
+        redraw(dirty_rects)
+        dirty_rects = []
 
-    pygame.display.flip()
-    CLOCK.tick(30)
+    RECORDER.frame((time.perf_counter() - frame_started) * 1000)
+    CLOCK.tick(MAX_FPS)
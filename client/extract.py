@@ -0,0 +1,181 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Extraction engine for update artifacts.
+#
+# Members are decompressed in parallel (zlib releases the GIL) into a staging
+# directory next to the install directory, with permissions taken from the zip's
+# stored attributes as each file is written. The staged tree is then renamed into
+# place and the old tree is kept as "<install dir>.previous" for rollback, so a
+# crash mid-extraction never leaves a half-written install behind.
+#
+# The running client can't have its own tree renamed (Windows keeps it locked, and
+# elsewhere the process would import modules from the new tree). It installs each
+# version into a directory of its own with install_version and points a small file
+# outside the trees at the one to start (select_install); the old tree is removed
+# by a later run, once nothing runs from it.
+
+COPY_BUFFER_SIZE = 1024 * 1024
+PREVIOUS_SUFFIX = ".previous"
+FAILED_SUFFIX = ".failed"
+
+# Written into the installed tree so a rollback knows which version it restores
+VERSION_MARKER = ".version"
+
+def member_mode(info):
+    # Unix permission bits stored by `zip`; archives built on Windows carry none
+    return info.external_attr >> 16
+
+def staged_path(staging_dir, name):
+    path = os.path.realpath(os.path.join(staging_dir, name))
+    if os.path.commonpath([path, staging_dir]) != staging_dir:
+        raise ValueError(f"Refusing to extract {name!r} outside of the install directory")
+    return path
+
+def extract_members(zip_path, staging_dir, infos, default_mode):
+    # Every worker thread uses its own ZipFile handle, they are not safe to share
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_member(info):
+        if not hasattr(local, "zip_ref"):
+            local.zip_ref = zipfile.ZipFile(zip_path, 'r')
+            with handles_lock:
+                handles.append(local.zip_ref)
+        path = staged_path(staging_dir, info.filename)
+        mode = member_mode(info)
+
+        if stat.S_ISLNK(mode):
+            # macOS .app bundles contain symlinks, recreate them instead of writing the target as a file
+            os.symlink(local.zip_ref.read(info).decode(), path)
+            return
+
+        with local.zip_ref.open(info) as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+            if os.name == "posix":
+                os.fchmod(target.fileno(), stat.S_IMODE(mode) or default_mode)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as pool:
+            list(pool.map(extract_member, infos))
+    finally:
+        for handle in handles:
+            handle.close()
+
+def extract_to_staging(zip_path, install_dir, default_mode=0o755):
+    parent_dir = os.path.dirname(os.path.abspath(install_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    staging_dir = os.path.realpath(tempfile.mkdtemp(prefix=".staging-", dir=parent_dir))
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            infos = zip_ref.infolist()
+
+        # Create the directory tree up front so workers only ever write files
+        files = []
+        for info in infos:
+            if info.is_dir():
+                os.makedirs(staged_path(staging_dir, info.filename), exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(staged_path(staging_dir, info.filename)), exist_ok=True)
+                files.append(info)
+
+        # Largest members first keeps the pool busy until the end
+        files.sort(key=lambda info: info.file_size, reverse=True)
+        extract_members(zip_path, staging_dir, files, default_mode)
+        return staging_dir
+
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+def swap_in(staging_dir, install_dir, version=None):
+    # Move the staged tree into place, keeping the current one for rollback.
+    # Each step is a single rename, so an interrupted swap can be recovered.
+    if version is not None:
+        with open(os.path.join(staging_dir, VERSION_MARKER), 'w') as file:
+            file.write(version)
+
+    previous_dir = install_dir + PREVIOUS_SUFFIX
+    if os.path.isdir(previous_dir):
+        shutil.rmtree(previous_dir)
+    if os.path.isdir(install_dir):
+        os.rename(install_dir, previous_dir)
+    os.rename(staging_dir, install_dir)
+
+def install_zip(zip_path, install_dir, version=None, default_mode=0o755):
+    swap_in(extract_to_staging(zip_path, install_dir, default_mode), install_dir, version)
+
+def recover(install_dir):
+    # Finish a swap that was interrupted between its two renames
+    previous_dir = install_dir + PREVIOUS_SUFFIX
+    if not os.path.isdir(install_dir) and os.path.isdir(previous_dir):
+        os.rename(previous_dir, install_dir)
+
+def rollback(install_dir):
+    # Swap the previous install back in and return its version (None if unknown)
+    previous_dir = install_dir + PREVIOUS_SUFFIX
+    if not os.path.isdir(previous_dir):
+        raise FileNotFoundError(f"No previous version to roll back to ({previous_dir})")
+
+    failed_dir = install_dir + FAILED_SUFFIX
+    if os.path.isdir(failed_dir):
+        shutil.rmtree(failed_dir)
+    if os.path.isdir(install_dir):
+        os.rename(install_dir, failed_dir)
+    os.rename(previous_dir, install_dir)
+    shutil.rmtree(failed_dir, ignore_errors=True)
+
+    try:
+        with open(os.path.join(install_dir, VERSION_MARKER), 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+def install_version(staging_dir, install_dir, version):
+    # Move the staged tree into a directory of its own, leaving the running install alone
+    with open(os.path.join(staging_dir, VERSION_MARKER), 'w') as file:
+        file.write(version)
+    # Left over from an earlier attempt at this version that failed to start
+    if os.path.isdir(install_dir):
+        shutil.rmtree(install_dir)
+    os.rename(staging_dir, install_dir)
+
+def read_current_install(pointer_path):
+    # The install select_install chose, or None when there is none or it has gone missing
+    try:
+        with open(pointer_path, 'r') as file:
+            name = file.read().strip()
+    except FileNotFoundError:
+        return None
+    install_dir = os.path.join(os.path.dirname(os.path.abspath(pointer_path)), name)
+    return install_dir if name and os.path.isdir(install_dir) else None
+
+def select_install(pointer_path, install_dir):
+    # Make `install_dir` the install to start. Stored relative to the pointer, so the
+    # whole directory can be moved, and replaced in one rename so it is never half written
+    parent_dir = os.path.dirname(os.path.abspath(pointer_path))
+    temp_path = pointer_path + ".tmp"
+    with open(temp_path, 'w') as file:
+        file.write(os.path.relpath(os.path.abspath(install_dir), parent_dir))
+    os.replace(temp_path, pointer_path)
+
+def remove_stale_installs(versions_dir, keep):
+    # Remove the installs in `versions_dir` other than `keep`. Staging directories of
+    # prefetched updates are left alone, and anything still locked is retried next time
+    keep = {os.path.realpath(path) for path in keep if path}
+    try:
+        names = os.listdir(versions_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(versions_dir, name)
+        if name.startswith(".") or not os.path.isdir(path) or os.path.realpath(path) in keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,135 @@
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+
+# Hot swap into a freshly installed version without losing the running session.
+#
+# The running client starts the new executable with the address of a local socket
+# and a one-time token in its environment. The new process connects, receives the
+# session state, draws its first frame and answers "ready"; only then does the old
+# process exit. A new process that doesn't answer within HANDOVER_TIMEOUT is
+# killed, and the caller rolls the install back and carries on with the session.
+
+HANDOVER_ADDRESS_ENV = "POMODORO_HANDOVER_ADDRESS"
+HANDOVER_TOKEN_ENV = "POMODORO_HANDOVER_TOKEN"
+
+# Seconds the new version gets to start and draw its first frame
+HANDOVER_TIMEOUT = 10
+
+READY = b"ready\n"
+
+# Updates are installed into their own directory under VERSIONS_DIR_NAME and the file
+# CURRENT_INSTALL_NAME next to it names the one to start. Must match update_common.py
+VERSIONS_DIR_NAME = "versions"
+CURRENT_INSTALL_NAME = "current_install"
+
+def installed_executable(install_dir):
+    # The release zip holds dist/client/client (onedir) or dist/client (onefile)
+    name = "client.exe" if os.name == "nt" else "client"
+    for executable in (os.path.join(install_dir, "dist", "client", name), os.path.join(install_dir, "dist", name)):
+        if os.path.isfile(executable):
+            return executable
+    return None
+
+def launch_command(install_dir):
+    # Fall back to the running script from source
+    executable = installed_executable(install_dir)
+    if executable is not None:
+        return [executable]
+    return [sys.executable, os.path.abspath(sys.argv[0])]
+
+def current_install_command():
+    # The command to start the current install when this frozen build isn't it, e.g.
+    # when started through a shortcut to the originally installed version. The same
+    # lookup as update_common, which isn't imported before the first frame
+    if not getattr(sys, 'frozen', False):
+        return None
+    executable_dir = os.path.dirname(os.path.abspath(sys.executable))
+    if os.path.basename(executable_dir) != "dist":
+        executable_dir = os.path.dirname(executable_dir)
+    install_dir = os.path.dirname(executable_dir)
+    data_dir = os.path.dirname(install_dir)
+    if os.path.basename(data_dir) == VERSIONS_DIR_NAME:
+        data_dir = os.path.dirname(data_dir)
+
+    try:
+        with open(os.path.join(data_dir, CURRENT_INSTALL_NAME), 'r') as file:
+            name = file.read().strip()
+    except OSError:
+        return None
+    executable = installed_executable(os.path.join(data_dir, name)) if name else None
+    if executable is None or os.path.realpath(executable) == os.path.realpath(sys.executable):
+        return None
+    return [executable] + sys.argv[1:]
+
+def hand_over(state, command, timeout=HANDOVER_TIMEOUT):
+    # Start `command` and pass it `state`. Returns True once the new process has
+    # drawn its first frame, False (with the new process stopped) otherwise
+    token = secrets.token_hex(16)
+    deadline = time.monotonic() + timeout
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        server.settimeout(0.1)
+        host, port = server.getsockname()[:2]
+        env = dict(os.environ, **{HANDOVER_ADDRESS_ENV: f"{host}:{port}", HANDOVER_TOKEN_ENV: token})
+        process = subprocess.Popen(command, env=env)
+
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+
+            with connection:
+                try:
+                    connection.settimeout(max(deadline - time.monotonic(), 0.1))
+                    with connection.makefile('rb') as reader:
+                        if reader.readline().strip() != token.encode():
+                            continue
+                        connection.sendall(json.dumps(state).encode() + b"\n")
+                        if reader.readline() == READY:
+                            return True
+                except OSError as e:
+                    print(f"Handover to the new version failed: {e}")
+                break
+
+        if process.poll() is None:
+            print("The new version did not confirm the handover, stopping it")
+            process.kill()
+            process.wait()
+        else:
+            print(f"The new version exited with status {process.returncode}")
+        return False
+
+def receive_handover():
+    # Returns (state, connection) when started by hand_over, (None, None) otherwise.
+    # Call confirm_handover(connection) once the first frame is on screen.
+    address = os.environ.pop(HANDOVER_ADDRESS_ENV, None)
+    token = os.environ.pop(HANDOVER_TOKEN_ENV, None)
+    if not address or not token:
+        return None, None
+
+    host, port = address.rsplit(":", 1)
+    connection = None
+    try:
+        connection = socket.create_connection((host, int(port)), timeout=HANDOVER_TIMEOUT)
+        connection.sendall(token.encode() + b"\n")
+        with connection.makefile('rb') as reader:
+            state = json.loads(reader.readline())
+    except (OSError, ValueError) as e:
+        print(f"Could not receive the previous session: {e}")
+        if connection is not None:
+            connection.close()
+        return None, None
+    return state, connection
+
+def confirm_handover(connection):
+    try:
+        connection.sendall(READY)
+    except OSError as e:
+        print(f"Could not confirm the handover: {e}")
+    finally:
+        connection.close()
@@ -0,0 +1,109 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# In-process performance telemetry.
+#
+# Frame times go into a fixed-size ring buffer, so recording one from the main loop
+# is a single array store. A background thread folds the ring into histograms with
+# fixed buckets, and other timings (startup, update check, download, extract,
+# install) are observed into the histograms directly. Uploads carry only bucket
+# counts and sums, so a batch is the same few hundred bytes however long it covers.
+
+# Bucket upper bounds in milliseconds, must match TELEMETRY_BUCKETS_MS in server/telemetry.py
+TELEMETRY_BUCKETS_MS = (1, 2, 4, 8, 16, 33, 50, 100, 250, 500, 1000, 2500, 5000,
+                        10000, 30000, 60000, 120000, 300000)
+
+# Frames recorded between two folds; at MAX_FPS the fold interval needs far fewer
+FRAME_RING_SIZE = 4096
+
+class RingBuffer:
+    # Fixed-size buffer of floats for one writer thread and one reader thread.
+    # When the reader falls behind by more than `capacity` the oldest values are lost.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array('d', [0.0]) * capacity
+        self.written = 0
+        self.read = 0
+
+    def append(self, value):
+        self.values[self.written % self.capacity] = value
+        self.written += 1
+
+    def drain(self):
+        written = self.written
+        start = max(self.read, written - self.capacity)
+        self.read = written
+        return [self.values[i % self.capacity] for i in range(start, written)]
+
+class Histogram:
+    def __init__(self, bounds=TELEMETRY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket holds values above every bound
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, counts, total):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.total += total
+
+class TelemetryRecorder:
+    def __init__(self):
+        self.frames = RingBuffer(FRAME_RING_SIZE)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def frame(self, milliseconds):
+        # Main loop only
+        self.frames.append(milliseconds)
+
+    def observe(self, metric, milliseconds):
+        with self._lock:
+            if metric not in self.histograms:
+                self.histograms[metric] = Histogram()
+            self.histograms[metric].observe(milliseconds)
+
+    @contextmanager
+    def timed(self, metric):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, (time.perf_counter() - start) * 1000)
+
+    def fold(self):
+        # Move buffered frame times into the frame_ms histogram
+        frames = self.frames.drain()
+        if not frames:
+            return
+        with self._lock:
+            if "frame_ms" not in self.histograms:
+                self.histograms["frame_ms"] = Histogram()
+            histogram = self.histograms["frame_ms"]
+            for value in frames:
+                histogram.observe(value)
+
+    def take(self):
+        # Returns {metric: {"counts": [...], "sum": ms}} recorded since the last take
+        self.fold()
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        return {metric: {"counts": histogram.counts, "sum": round(histogram.total, 3)}
+                for metric, histogram in histograms.items()}
+
+    def restore(self, histograms):
+        # Put back a batch that couldn't be uploaded, so it goes out with the next one
+        with self._lock:
+            for metric, entry in histograms.items():
+                if metric not in self.histograms:
+                    self.histograms[metric] = Histogram()
+                self.histograms[metric].merge(entry["counts"], entry["sum"])
+
+# Shared by the client's main loop, the updater and the upload thread
+RECORDER = TelemetryRecorder()
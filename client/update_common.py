@@ -0,0 +1,421 @@
+import os
+import sys
+import requests
+import hashlib
+import json
+import platform
+import struct
+import time
+import uuid
+import random
+import shutil
+import zlib
+from urllib.parse import urljoin
+
+# Download, verification and negotiation code shared by the in-app updater
+# (client/updater.py) and `make update` (updater.py). It only imports the standard
+# library and requests, so it loads both as `update_common` from inside client/
+# and as `client.update_common` from the repository root.
+
+# Base URL for the API server
+API_BASE_URL = "http://localhost:8000"
+
+# Determine base directory for the updater
+if getattr(sys, 'frozen', False):
+    # If running from a frozen executable
+    BASE_DIR = sys._MEIPASS
+else:
+    # If running from a script
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VERSION_FILE = os.path.join(BASE_DIR, "version.txt")
+
+# Directory the release zip is extracted into. It holds dist/client, which is the
+# executable in onefile builds and the directory containing it in onedir builds
+if getattr(sys, 'frozen', False):
+    EXECUTABLE_DIR = os.path.dirname(os.path.abspath(sys.executable))
+    if os.path.basename(EXECUTABLE_DIR) != "dist":
+        EXECUTABLE_DIR = os.path.dirname(EXECUTABLE_DIR)
+    INSTALL_DIR = os.path.dirname(EXECUTABLE_DIR)
+else:
+    INSTALL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist")
+
+# The in-app updater installs each version into VERSIONS_DIR instead of over the running
+# tree, and CURRENT_INSTALL_PATH names the install to start. Must match VERSIONS_DIR_NAME
+# and CURRENT_INSTALL_NAME in handover.py
+VERSIONS_DIR_NAME = "versions"
+CURRENT_INSTALL_NAME = "current_install"
+
+# Downloads and the delta base live next to the installs, outside the trees an update
+# replaces, so both updaters and every installed version find the same files
+if os.path.basename(os.path.dirname(INSTALL_DIR)) == VERSIONS_DIR_NAME:
+    UPDATE_DATA_DIR = os.path.dirname(os.path.dirname(INSTALL_DIR))
+else:
+    UPDATE_DATA_DIR = os.path.dirname(INSTALL_DIR)
+VERSIONS_DIR = os.path.join(UPDATE_DATA_DIR, VERSIONS_DIR_NAME)
+CURRENT_INSTALL_PATH = os.path.join(UPDATE_DATA_DIR, CURRENT_INSTALL_NAME)
+DOWNLOAD_PATH = os.path.join(UPDATE_DATA_DIR, "new_version.zip")
+
+# Last /negotiate answer and its ETag. Kept on disk so the first poll after a start is
+# conditional too, and the shared caches in front of the server can answer it with a 304
+NEGOTIATION_CACHE_PATH = os.path.join(UPDATE_DATA_DIR, "negotiation.json")
+
+# The last applied artifact is kept so the server can send a delta against it next time
+BASE_ARTIFACT_PATH = os.path.join(UPDATE_DATA_DIR, "base_artifact.zip")
+BASE_ARTIFACT_CHECKSUM_PATH = BASE_ARTIFACT_PATH + ".sha256"
+# Release the base came from. It differs from the installed version after a chunk
+# update, which rebuilds the install without touching the base
+BASE_ARTIFACT_VERSION_PATH = BASE_ARTIFACT_PATH + ".version"
+
+# Must match DELTA_MAGIC in server/delta.py
+DELTA_MAGIC = b"NTDELTA1"
+
+# Size of the reusable buffer downloads are read into, hashed and written from
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Digest used to verify downloads. sha256 is always published; blake2b and blake3
+# are used when the release publishes them (blake3 needs the optional `blake3` package)
+DIGEST_ALGORITHM = os.getenv("UPDATE_DIGEST", "sha256")
+
+# Interrupted downloads are resumed from the partial file this many times before giving up
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 30
+
+# Identifies this install for staged rollouts, shared by the in-app checker and `make update`
+CLIENT_ID_PATH = os.path.join(os.path.expanduser("~"), ".pomodoro", "client_id")
+
+class DownloadPaused(Exception):
+    pass
+
+class Throttle:
+    # Keeps a download's average rate under `bytes_per_second` and stops it with
+    # DownloadPaused once `stop_event` is set. The partial file is left in place,
+    # so the next attempt resumes where this one stopped.
+    def __init__(self, bytes_per_second=0, stop_event=None):
+        self.bytes_per_second = bytes_per_second
+        self.stop_event = stop_event
+        # Small reads when capped, so the rate is smooth instead of 1 MiB bursts
+        if bytes_per_second > 0:
+            self.block_size = min(max(bytes_per_second // 8, 16 * 1024), DOWNLOAD_CHUNK_SIZE)
+        else:
+            self.block_size = DOWNLOAD_CHUNK_SIZE
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.transferred = 0
+
+    def consume(self, count):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise DownloadPaused()
+        if self.bytes_per_second <= 0:
+            return
+
+        self.transferred += count
+        ahead = self.transferred / self.bytes_per_second - (time.monotonic() - self.started)
+        if ahead < -1:
+            # Don't let a stalled connection build up credit for a burst later
+            self.reset()
+        elif ahead > 0:
+            if self.stop_event is None:
+                time.sleep(ahead)
+            elif self.stop_event.wait(ahead):
+                raise DownloadPaused()
+
+def get_os_version():
+    system = platform.system()
+    if system == "Linux":
+        return "linux"
+    elif system == "Darwin":
+        return "macos"
+    elif system == "Windows":
+        return "windows"
+    else:
+        raise ValueError("Unsupported OS. Only Linux, macOS, and Windows are supported.")
+
+def read_current_version():
+    try:
+        with open(VERSION_FILE, 'r') as file:
+            version = file.read().strip()
+            return version
+    except FileNotFoundError:
+        print("Version file not found.")
+        return "Unknown version"
+
+def write_current_version(version):
+    with open(VERSION_FILE, 'w') as file:
+        file.write(version)
+
+def write_installed_version(install_dir, version):
+    # Frozen builds carry version.txt inside the install, record `version` in the one
+    # at `install_dir`. From source it belongs to the checkout, not to an install
+    relative_path = os.path.relpath(VERSION_FILE, INSTALL_DIR)
+    if relative_path.startswith(os.pardir):
+        return
+    with open(os.path.join(install_dir, relative_path), 'w') as file:
+        file.write(version)
+
+def get_client_id():
+    try:
+        with open(CLIENT_ID_PATH, 'r') as file:
+            client_id = file.read().strip()
+        if client_id:
+            return client_id
+    except OSError:
+        pass
+
+    client_id = uuid.uuid4().hex
+    try:
+        os.makedirs(os.path.dirname(CLIENT_ID_PATH), exist_ok=True)
+        with open(CLIENT_ID_PATH, 'w') as file:
+            file.write(client_id)
+    except OSError as e:
+        print(f"Failed to save client ID: {e}")
+    return client_id
+
+def get_capabilities(deliveries):
+    # `deliveries` are the delivery methods the caller can install, digests are added here
+    capabilities = list(deliveries) + ["blake2b"]
+    try:
+        new_digest("blake3")
+        capabilities.append("blake3")
+    except ImportError:
+        pass
+    return capabilities
+
+def negotiation_payload(deliveries):
+    # Query of a GET /negotiate: what is installed and what this updater can use
+    return {
+        "os_version": get_os_version(),
+        "arch": platform.machine().lower() or None,
+        "current_version": read_current_version(),
+        "client_id": get_client_id(),
+        # Lets the server offer a delta against the artifact we already have
+        "base_sha256": read_base_artifact_checksum(),
+        "base_version": read_base_artifact_version(),
+        "capabilities": get_capabilities(deliveries),
+    }
+
+def load_negotiation_cache():
+    try:
+        with open(NEGOTIATION_CACHE_PATH, 'r') as file:
+            cached = json.load(file)
+        return cached['etag'], cached['negotiation']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+def save_negotiation_cache(etag, negotiation):
+    try:
+        with open(NEGOTIATION_CACHE_PATH + ".tmp", 'w') as file:
+            json.dump({"etag": etag, "negotiation": negotiation}, file)
+        os.replace(NEGOTIATION_CACHE_PATH + ".tmp", NEGOTIATION_CACHE_PATH)
+    except OSError as e:
+        print(f"Failed to save the update check: {e}")
+
+def negotiate(url, deliveries, timeout):
+    # Ask the server whether to update and how, revalidating the last answer. Raises
+    # requests exceptions on failure
+    etag, cached = load_negotiation_cache()
+    headers = {"If-None-Match": etag} if etag and cached else {}
+    response = requests.get(url, params=negotiation_payload(deliveries), headers=headers, timeout=timeout)
+    response.raise_for_status()
+    if response.status_code == 304:
+        # Same decision as last time, with a fresh poll hint
+        negotiation = dict(cached)
+        if response.headers.get('Retry-After', '').isdigit():
+            negotiation['retry_after'] = int(response.headers['Retry-After'])
+        return negotiation
+
+    negotiation = response.json()
+    if response.headers.get('ETag'):
+        save_negotiation_cache(response.headers['ETag'], negotiation)
+    return negotiation
+
+def read_base_artifact_checksum():
+    if not os.path.exists(BASE_ARTIFACT_PATH):
+        return None
+    try:
+        with open(BASE_ARTIFACT_CHECKSUM_PATH, 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+def read_base_artifact_version():
+    if not os.path.exists(BASE_ARTIFACT_PATH):
+        return None
+    try:
+        with open(BASE_ARTIFACT_VERSION_PATH, 'r') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_base_artifact_version(version):
+    with open(BASE_ARTIFACT_VERSION_PATH, 'w') as file:
+        file.write(version)
+
+def retain_base_artifact(zip_path, checksum, version):
+    # The download may live on another filesystem, where os.replace fails
+    shutil.move(zip_path, BASE_ARTIFACT_PATH)
+    with open(BASE_ARTIFACT_CHECKSUM_PATH, 'w') as file:
+        file.write(checksum)
+    write_base_artifact_version(version)
+
+def validate_update(computed_checksum, expected_checksum):
+    print(f"Expected checksum: {expected_checksum}")
+    print(f"Computed checksum: {computed_checksum}")
+
+    return computed_checksum == expected_checksum.lower()
+
+def new_digest(algorithm):
+    if algorithm == "blake3":
+        from blake3 import blake3
+        return blake3(max_threads=blake3.AUTO)
+    return hashlib.new(algorithm)
+
+def select_digest(update_info):
+    # Return (algorithm, expected digest), preferring DIGEST_ALGORITHM when it can be used
+    digests = update_info.get('digests') or {}
+    if DIGEST_ALGORITHM in digests:
+        try:
+            new_digest(DIGEST_ALGORITHM)
+            return DIGEST_ALGORITHM, digests[DIGEST_ALGORITHM].lower()
+        except ImportError:
+            print(f"{DIGEST_ALGORITHM} is not installed, verifying with sha256")
+    return "sha256", update_info['sha256'].lower()
+
+def copy_and_hash(source, target, digest, view, throttle=None):
+    # Copy everything from `source` (anything with readinto) to `target`, hashing on
+    # the way, through one reusable buffer so no per-chunk bytes objects are allocated
+    if throttle is not None:
+        view = view[:throttle.block_size]
+    total = 0
+    while True:
+        count = source.readinto(view)
+        if not count:
+            return total
+        if target is not None:
+            target.write(view[:count])
+        digest.update(view[:count])
+        total += count
+        if throttle is not None:
+            throttle.consume(count)
+
+def resume_partial_download(partial_path, algorithm, view):
+    # Re-hash the bytes already on disk so the digest carries on across resumes
+    digest = new_digest(algorithm)
+    size = 0
+    if os.path.exists(partial_path):
+        with open(partial_path, 'rb') as file:
+            size = copy_and_hash(file, None, digest, view)
+    return digest, size
+
+def fetch_to_partial(url, partial_path, expected_checksum, expected_size, algorithm="sha256", throttle=None):
+    view = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+    digest, size = resume_partial_download(partial_path, algorithm, view)
+    if size > expected_size:
+        digest, size = new_digest(algorithm), 0
+
+    if size == expected_size:
+        return digest
+
+    headers = {}
+    if size:
+        print(f"Resuming download at byte {size} of {expected_size} ...")
+        headers["Range"] = f"bytes={size}-"
+        headers["If-Range"] = f'"{expected_checksum}"'
+
+    with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            # The server sent the whole artifact, so start over
+            digest, size = new_digest(algorithm), 0
+
+        response.raw.decode_content = True
+        with open(partial_path, 'ab' if size else 'wb') as file:
+            copy_and_hash(response.raw, file, digest, view, throttle)
+
+    return digest
+
+def retry_delay(error, attempt):
+    # Honor Retry-After when the server is shedding load (503), with jitter so
+    # rejected clients don't all come back at the same moment
+    response = getattr(error, 'response', None)
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return int(response.headers['Retry-After']) * random.uniform(1.0, 1.5)
+    return min(2 ** attempt, 30)
+
+def is_retryable(error):
+    # Dropped connections, timeouts and server errors (including a 503 from a server
+    # shedding load) can pass. Any other HTTP error would be answered the same way again
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500 or response.status_code in (408, 429)
+
+def download_file(url, expected_checksum, expected_size, algorithm="sha256", throttle=None):
+    # Download into a resumable partial file and return (partial path, computed digest).
+    # `expected_checksum` is the artifact's sha256, it names the partial file and is its ETag.
+    partial_path = f"{DOWNLOAD_PATH}.{expected_checksum[:16]}.part"
+
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            # Stream straight to disk, hashing as the bytes arrive
+            digest = fetch_to_partial(url, partial_path, expected_checksum, expected_size, algorithm, throttle)
+            break
+        except (requests.exceptions.RequestException, OSError) as e:
+            print(f"Download interrupted (attempt {attempt}/{DOWNLOAD_RETRIES}): {e}")
+            if attempt == DOWNLOAD_RETRIES or not is_retryable(e):
+                raise
+            time.sleep(retry_delay(e, attempt))
+
+    size = os.path.getsize(partial_path)
+    if size != expected_size:
+        os.remove(partial_path)
+        raise ValueError(f"Downloaded size mismatch: expected {expected_size} bytes, got {size} bytes")
+
+    return partial_path, digest.hexdigest()
+
+def apply_delta(base_path, delta_path, out_path, algorithm="sha256"):
+    # Rebuild the new artifact from the base artifact and a patch, returning its digest
+    digest = new_digest(algorithm)
+    view = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+    with open(base_path, 'rb') as base, open(delta_path, 'rb') as delta, open(out_path, 'wb') as out:
+        if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError("Not a delta patch")
+
+        while True:
+            op = delta.read(1)
+            if not op:
+                break
+            if op == b"C":
+                offset, length = struct.unpack(">QI", delta.read(12))
+                base.seek(offset)
+                while length > 0:
+                    count = base.readinto(view[:min(length, DOWNLOAD_CHUNK_SIZE)])
+                    if not count:
+                        raise ValueError("Delta patch reads past the end of the base artifact")
+                    out.write(view[:count])
+                    digest.update(view[:count])
+                    length -= count
+            elif op == b"D":
+                (length,) = struct.unpack(">I", delta.read(4))
+                chunk = zlib.decompress(delta.read(length))
+                out.write(chunk)
+                digest.update(chunk)
+            else:
+                raise ValueError(f"Unknown delta operation {op!r}")
+
+    return digest.hexdigest()
+
+def download_delta_update(update_info, algorithm, throttle=None):
+    # Rebuild the update at DOWNLOAD_PATH from the base artifact, returning its digest
+    delta_info = update_info['delta']
+    url = urljoin(API_BASE_URL, delta_info['download_url'])
+
+    print(f"Downloading delta update ({delta_info['size']} bytes instead of {update_info['size']}) ...")
+    delta_path, computed_checksum = download_file(url, delta_info['sha256'].lower(), delta_info['size'],
+                                                  throttle=throttle)
+    try:
+        if computed_checksum != delta_info['sha256'].lower():
+            raise ValueError("Delta patch checksum mismatch")
+        return apply_delta(BASE_ARTIFACT_PATH, delta_path, DOWNLOAD_PATH, algorithm)
+    finally:
+        os.remove(delta_path)
@@ -0,0 +1,184 @@
+import os
+import random
+import sys
+import threading
+import time
+import pygame
+import requests
+from telemetry import RECORDER
+from update_common import DownloadPaused, Throttle, read_current_version
+from updater import (PREFETCH_BANDWIDTH_LIMIT, negotiate_update, prefetch_update, subscribe_to_releases,
+                     upload_telemetry)
+
+# Posted to the pygame event queue when the server reports a newer version
+UPDATE_AVAILABLE_EVENT = pygame.USEREVENT + 1
+
+# Posted once a newer version is downloaded, verified and extracted, ready to swap in
+UPDATE_READY_EVENT = pygame.USEREVENT + 2
+
+# Nice value for the prefetch thread, so it yields the CPU to the UI
+PREFETCH_NICENESS = 10
+
+# Seconds between moving buffered frame times into histograms, and between uploads
+TELEMETRY_FOLD_INTERVAL = 10
+TELEMETRY_UPLOAD_INTERVAL = 300
+
+# Retry schedule (seconds) when the update server is slow or unreachable
+INITIAL_BACKOFF = 2
+MAX_BACKOFF = 300
+
+# Seconds between checks when the server doesn't send a poll hint
+DEFAULT_POLL_INTERVAL = 3600
+
+class UpdateChecker(threading.Thread):
+    # Checks for updates off the main thread and reports back through the pygame
+    # event loop, so a slow or dead update server never delays the first frame.
+    # Keeps polling until an update is found, as often as the server's hint allows.
+    def __init__(self):
+        super().__init__(name="update-checker", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        delay = INITIAL_BACKOFF
+        while not self._stop_event.is_set():
+            try:
+                negotiation = negotiate_update()
+            except Exception as e:
+                # Exponential backoff with jitter so clients don't retry in lockstep
+                wait = delay * random.uniform(0.5, 1.5)
+                print(f"Update check failed ({e}), retrying in {wait:.0f}s")
+                if self._stop_event.wait(wait):
+                    return
+                delay = min(delay * 2, MAX_BACKOFF)
+                continue
+
+            if negotiation['update_available']:
+                version_info = negotiation['update']
+                print(f"New version available: {version_info['version']}")
+                pygame.event.post(pygame.event.Event(UPDATE_AVAILABLE_EVENT, version_info=version_info))
+                return
+
+            # Poll again when the server asks to; it spreads clients out during staged rollouts
+            delay = INITIAL_BACKOFF
+            wait = negotiation.get('retry_after', DEFAULT_POLL_INTERVAL) * random.uniform(0.9, 1.1)
+            if self._stop_event.wait(wait):
+                return
+
+class ReleaseSubscriber(threading.Thread):
+    # Keeps a server-sent events connection open so a newly published release shows
+    # up in the app within seconds, instead of on the next poll. UpdateChecker keeps
+    # running as the fallback for servers without /events.
+    def __init__(self):
+        super().__init__(name="release-subscriber", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        delay = INITIAL_BACKOFF
+        while not self._stop_event.is_set():
+            try:
+                for version in subscribe_to_releases():
+                    delay = INITIAL_BACKOFF
+                    if version != read_current_version():
+                        print(f"New version published: {version}")
+                        pygame.event.post(pygame.event.Event(UPDATE_AVAILABLE_EVENT, version_info={"version": version}))
+                        return
+            except Exception as e:
+                print(f"Release event stream failed ({e})")
+
+            # Reconnect with jittered backoff so a server restart isn't met by every client at once
+            wait = delay * random.uniform(0.5, 1.5)
+            if self._stop_event.wait(wait):
+                return
+            delay = min(delay * 2, MAX_BACKOFF)
+
+def lower_thread_priority(niceness):
+    # Best effort, Linux only: there a thread ID is a valid PRIO_PROCESS target and the
+    # nice value applies to that thread. Elsewhere the same number may be another process
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except OSError:
+        pass
+
+class UpdatePrefetcher(threading.Thread):
+    # Downloads, verifies and extracts an update in the background, at low priority
+    # and under PREFETCH_BANDWIDTH_LIMIT, while the app keeps running. Stopping it
+    # pauses the download; the partial file stays on disk and the next start resumes it.
+    def __init__(self, update_info):
+        super().__init__(name="update-prefetcher", daemon=True)
+        self.update_info = update_info
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        lower_thread_priority(PREFETCH_NICENESS)
+        throttle = Throttle(PREFETCH_BANDWIDTH_LIMIT, self._stop_event)
+        delay = INITIAL_BACKOFF
+        while not self._stop_event.is_set():
+            try:
+                if 'download_url' not in self.update_info:
+                    # Releases announced over /events only carry the version, and a
+                    # download that 404'd leaves nothing to go on
+                    negotiation = negotiate_update()
+                    if not negotiation['update_available']:
+                        return
+                    self.update_info = negotiation['update']
+                state = prefetch_update(self.update_info, throttle)
+            except DownloadPaused:
+                return
+            except Exception as e:
+                if (isinstance(e, requests.exceptions.HTTPError) and e.response is not None
+                        and e.response.status_code == 404):
+                    # The server no longer serves this release (a newer one replaced
+                    # it), so the next attempt negotiates what to download now
+                    self.update_info = {}
+                wait = delay * random.uniform(0.5, 1.5)
+                print(f"Background download failed ({e}), retrying in {wait:.0f}s")
+                if self._stop_event.wait(wait):
+                    return
+                delay = min(delay * 2, MAX_BACKOFF)
+                continue
+
+            print(f"Update {state['version']} downloaded and ready to install")
+            pygame.event.post(pygame.event.Event(UPDATE_READY_EVENT, update=state))
+            return
+
+class TelemetryUploader(threading.Thread):
+    # Folds buffered frame times into histograms every few seconds and uploads a
+    # batch every TELEMETRY_UPLOAD_INTERVAL, plus a last one when stopped. A batch
+    # that fails to upload is kept and goes out with the next one.
+    def __init__(self):
+        super().__init__(name="telemetry-uploader", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def upload(self):
+        histograms = RECORDER.take()
+        if not histograms:
+            return
+        try:
+            upload_telemetry(histograms)
+        except Exception as e:
+            print(f"Telemetry upload failed ({e})")
+            RECORDER.restore(histograms)
+
+    def run(self):
+        # Spread uploads out so clients started together don't report together
+        next_upload = time.monotonic() + TELEMETRY_UPLOAD_INTERVAL * random.uniform(0.5, 1.0)
+        while not self._stop_event.wait(TELEMETRY_FOLD_INTERVAL):
+            RECORDER.fold()
+            if time.monotonic() >= next_upload:
+                self.upload()
+                next_upload = time.monotonic() + TELEMETRY_UPLOAD_INTERVAL
+        self.upload()
@@ -1,70 +1,75 @@
 import os
-import sys
+import json
 import requests
-import hashlib
-import base64
-import platform
-
-# Base URL for the API server
-API_BASE_URL = "http://localhost:8000"
+import shutil
+import time
+from urllib.parse import urljoin
+from extract import (extract_to_staging, install_version, read_current_install, remove_stale_installs,
+                     select_install)
+from telemetry import RECORDER
+from update_common import (API_BASE_URL, CURRENT_INSTALL_PATH, DOWNLOAD_PATH, INSTALL_DIR, VERSIONS_DIR,
+                           DownloadPaused, download_delta_update, download_file, get_client_id, get_os_version,
+                           negotiate, read_current_version, retain_base_artifact, select_digest,
+                           validate_update, write_current_version, write_installed_version)
 
 # Endpoints
 API_ENDPOINTS = {
-    "check_version": f"{API_BASE_URL}/check-version",
-    "get_update": f"{API_BASE_URL}/get-update"
+    "negotiate": f"{API_BASE_URL}/negotiate",
+    "events": f"{API_BASE_URL}/events",
+    "telemetry": f"{API_BASE_URL}/telemetry"
 }
 
-# Determine base directory for the updater
-if getattr(sys, 'frozen', False):
-    # If running from a frozen executable
-    BASE_DIR = sys._MEIPASS
-else:
-    # If running from a script
-    BASE_DIR = os.path.dirname(__file__)
-
-VERSION_FILE = os.path.join(BASE_DIR, "version.txt")
-DOWNLOAD_PATH = "/tmp/new_version.zip"
-CHECKSUM_PATH = "/tmp/new_version.zip.sha256"
-
-def get_os_version():
-    system = platform.system()
-    if system == "Linux":
-        return "linux"
-    elif system == "Darwin":
-        return "macos"
-    elif system == "Windows":
-        return "windows"
-    else:
-        raise ValueError("Unsupported OS. Only Linux, macOS, and Windows are supported.")
-
-def read_current_version():
-    try:
-        with open(VERSION_FILE, 'r') as file:
-            version = file.read().strip()
-            return version
-    except FileNotFoundError:
-        print("Version file not found.")
-        return "Unknown version"
-
-def write_current_version(version):
-    with open(VERSION_FILE, 'w') as file:
-        file.write(version)
+# Timeout (seconds) for metadata requests, so a slow server can't hang the caller
+REQUEST_TIMEOUT = 5
+
+# The server sends a keep-alive on /events every 30 seconds, a silent connection is dead
+EVENTS_READ_TIMEOUT = 90
+
+# Bandwidth cap (bytes per second) for updates downloaded in the background while the
+# app runs, so they don't compete with the user's own traffic. 0 disables the cap
+PREFETCH_BANDWIDTH_LIMIT = int(os.getenv("UPDATE_BANDWIDTH_LIMIT", 512 * 1024))
+
+# Describes a downloaded, verified and pre-extracted update waiting to be applied
+PREFETCH_STATE_PATH = DOWNLOAD_PATH + ".prefetch.json"
+
+def negotiate_update():
+    # Ask the server whether to update and how, raising requests exceptions on failure.
+    # No chunk manifests, this updater installs through prefetch_update
+    with RECORDER.timed("update_check_ms"):
+        return negotiate(API_ENDPOINTS['negotiate'], ["delta"], REQUEST_TIMEOUT)
+
+def upload_telemetry(histograms):
+    # Send a batch from telemetry.RECORDER.take(), raising requests exceptions on failure
+    payload = {
+        "version": read_current_version(),
+        "os_version": get_os_version(),
+        "histograms": histograms,
+    }
+    response = requests.post(API_ENDPOINTS['telemetry'], json=payload, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+def subscribe_to_releases():
+    # Yield every version announced on the server's release event stream, blocking in between
+    params = {"client_id": get_client_id(), "current_version": read_current_version()}
+    with requests.get(API_ENDPOINTS['events'], params=params, stream=True,
+                      timeout=(REQUEST_TIMEOUT, EVENTS_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "release":
+                yield json.loads(line[len("data:"):])['version']
+            elif not line:
+                event = None
 
 def check_for_updates():
-    os_version = get_os_version()
-    url = f"{API_ENDPOINTS['check_version']}?os_version={os_version}"
-    
-    print(f"Checking for updates for {os_version} ...")
+    print(f"Checking for updates for {get_os_version()} ...")
     try:
-        # Contact the FastAPI server to get the latest version info
-        response = requests.get(url)
-        response.raise_for_status()
-        version_info = response.json()
-
-        current_version = read_current_version()
-        if version_info['version'] != current_version:
+        negotiation = negotiate_update()
+        if negotiation['update_available']:
             print("New version available.")
-            return version_info
+            return negotiation['update']
         else:
             print("No updates available.")
             return None
@@ -73,77 +78,131 @@ def check_for_updates():
         print(f"Failed to check for updates: {e}")
         return None
 
-def get_update_info():
-    os_version = get_os_version()
-    url = f"{API_ENDPOINTS['get_update']}?os_version={os_version}"
-    
-    print(f"Getting update info for {os_version} ...")
+def download_update(update_info, throttle=None):
+    url = urljoin(API_BASE_URL, update_info['download_url'])
+    expected_checksum = update_info['sha256'].lower()
+    algorithm, expected_digest = select_digest(update_info)
+
+    if update_info.get('delta'):
+        try:
+            # The rebuilt artifact must match the full-release digest
+            computed_digest = download_delta_update(update_info, algorithm, throttle)
+            if computed_digest == expected_digest:
+                print(f"Rebuilt {DOWNLOAD_PATH} from delta update.")
+                return computed_digest
+            print("Rebuilt artifact failed checksum validation, falling back to full download ...")
+        except DownloadPaused:
+            raise
+        except Exception as e:
+            print(f"Delta update failed ({e}), falling back to full download ...")
+
+    print(f"Saving file to {DOWNLOAD_PATH} ...")
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        update_info = response.json()
-        return update_info
+        partial_path, computed_digest = download_file(url, expected_checksum, update_info['size'], algorithm, throttle)
+        os.replace(partial_path, DOWNLOAD_PATH)
+        print(f"File successfully saved as {DOWNLOAD_PATH}. Size: {update_info['size']} bytes")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to get update info: {e}")
-        return None
-
-def save_file(base64_data, path):
-    print(f"Saving file to {path} ...")
-    try:
-        file_data = base64.b64decode(base64_data)
-        with open(path, 'wb') as file:
-            file.write(file_data)
-        
-        # Verify if the file has been successfully saved
-        if os.path.getsize(path) == 0:
-            raise Exception(f"Saved file is empty: {path}")
-
-        print(f"File successfully saved as {path}. Size: {os.path.getsize(path)} bytes")
-    
     except Exception as e:
         print(f"Error saving file: {e}")
         raise
 
-def download_update(download_base64, checksum_base64):
-    save_file(download_base64, DOWNLOAD_PATH)
-    save_file(checksum_base64, CHECKSUM_PATH)
-
-def validate_update():
-    with open(CHECKSUM_PATH, 'r') as file:
-        # Read the line and split by space to get only the checksum part
-        checksum_line = file.read().strip()
-        expected_checksum = checksum_line.split()[0]  # Take only the checksum part
-    
-    sha256_hash = hashlib.sha256()
-    with open(DOWNLOAD_PATH, 'rb') as file:
-        for byte_block in iter(lambda: file.read(4096), b""):
-            sha256_hash.update(byte_block)
-    
-    computed_checksum = sha256_hash.hexdigest()
-    print(f"Expected checksum: {expected_checksum}")
-    print(f"Computed checksum: {computed_checksum}")
+    return computed_digest
 
-    return computed_checksum == expected_checksum
+def load_prefetch_state():
+    # The prefetched update, or None when there is none or its files have gone missing
+    try:
+        with open(PREFETCH_STATE_PATH, 'r') as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if os.path.isdir(state.get('staging_dir', '')) and os.path.exists(DOWNLOAD_PATH):
+        return state
+    discard_prefetched_update(state)
+    return None
+
+def discard_prefetched_update(state):
+    if state and state.get('staging_dir'):
+        shutil.rmtree(state['staging_dir'], ignore_errors=True)
+    if state and os.path.exists(DOWNLOAD_PATH):
+        os.remove(DOWNLOAD_PATH)
+    if os.path.exists(PREFETCH_STATE_PATH):
+        os.remove(PREFETCH_STATE_PATH)
+
+def version_install_dir(version):
+    # Release tags name directories in VERSIONS_DIR, refuse any that would leave it
+    if not version or version in (os.curdir, os.pardir) or os.path.basename(version) != version:
+        raise ValueError(f"Invalid version {version!r}")
+    return os.path.join(VERSIONS_DIR, version)
+
+def prefetch_update(update_info, throttle=None):
+    # Download, verify and extract an update next to the installed app without
+    # touching it, so applying it later is only a rename. Safe to call again after an
+    # interruption: the download resumes from its partial file.
+    state = load_prefetch_state()
+    if state is not None and state['version'] == update_info['version']:
+        return state
+    discard_prefetched_update(state)
+    # Versions that handed over to a later one have exited by now. Only the running
+    # install and the one that starts next are kept
+    remove_stale_installs(VERSIONS_DIR, [INSTALL_DIR, read_current_install(CURRENT_INSTALL_PATH)])
+
+    # Includes verification, the digest is computed as the bytes arrive. Paused
+    # downloads aren't recorded, their duration says nothing about the download
+    started_at = time.perf_counter()
+    computed_digest = download_update(update_info, throttle)
+    RECORDER.observe("download_ms", (time.perf_counter() - started_at) * 1000)
+    if not validate_update(computed_digest, select_digest(update_info)[1]):
+        os.remove(DOWNLOAD_PATH)
+        raise ValueError("Update validation failed.")
+
+    with RECORDER.timed("extract_ms"):
+        staging_dir = extract_to_staging(DOWNLOAD_PATH, version_install_dir(update_info['version']))
+    state = {
+        "version": update_info['version'],
+        "sha256": update_info['sha256'].lower(),
+        "staging_dir": staging_dir,
+    }
+    with open(PREFETCH_STATE_PATH, 'w') as file:
+        json.dump(state, file)
+    return state
+
+def apply_prefetched_update(state):
+    # Everything slow happened in prefetch_update, this is a rename and a small write.
+    # The running install isn't touched: the update goes into its own directory, which
+    # is returned, and becomes the one to start. The download only becomes the delta
+    # base in finish_prefetched_update, once the new version is known to start; until
+    # then rollback_update can undo this
+    install_dir = version_install_dir(state['version'])
+    with RECORDER.timed("install_ms"):
+        install_version(state['staging_dir'], install_dir, state['version'])
+        write_installed_version(install_dir, state['version'])
+        select_install(CURRENT_INSTALL_PATH, install_dir)
+    return install_dir
+
+def finish_prefetched_update(state):
+    retain_base_artifact(DOWNLOAD_PATH, state['sha256'], state['version'])
+    os.remove(PREFETCH_STATE_PATH)
+
+def rollback_update(state):
+    # Undo apply_prefetched_update when the new version fails to start: the running
+    # install is the one to start again and the new one is removed
+    select_install(CURRENT_INSTALL_PATH, INSTALL_DIR)
+    shutil.rmtree(version_install_dir(state['version']), ignore_errors=True)
+    return read_current_version()
 
 def main():
     current_version = read_current_version()
     print(f"Current version: {current_version}")
     try:
-        version_info = check_for_updates()
-        if version_info:
-            update_info = get_update_info()
-            if update_info:
-                download_update(update_info['download_zip'], update_info['checksum_zip'])
-                if validate_update():
-                    write_current_version(update_info['version'])
-                    print(f"Update applied successfully. New version: {update_info['version']}")
-                else:
-                    print("Update validation failed.")
+        update_info = check_for_updates()
+        if update_info:
+            computed_digest = download_update(update_info)
+            if validate_update(computed_digest, select_digest(update_info)[1]):
+                retain_base_artifact(DOWNLOAD_PATH, update_info['sha256'].lower(), update_info['version'])
+                write_current_version(update_info['version'])
+                print(f"Update applied successfully. New version: {update_info['version']}")
             else:
-                print("Failed to get update info.")
-        else:
-            print("No updates available.")
+                print("Update validation failed.")
     
     except ValueError as e:
         print(e)
@@ -0,0 +1,53 @@
+import json
+import random
+from metrics import Counter, Gauge
+
+DOWNLOADS_IN_FLIGHT = Gauge("downloads_in_flight", "Artifact, delta, manifest and chunk downloads currently being streamed")
+DOWNLOADS_REJECTED = Counter("downloads_rejected_total", "Downloads turned away with 503 because too many were in flight")
+
+
+class AdmissionLimiter:
+    # ASGI middleware bounding how many downloads (artifacts, deltas, manifests and
+    # chunks) are streamed at once.
+    #
+    # Requests over the limit get an immediate 503 with a jittered Retry-After
+    # instead of queueing, so peak bandwidth stays bounded and rejected clients come
+    # back spread out. The count covers the whole response body, not just the handler.
+    def __init__(self, app, path_prefixes, max_concurrent, retry_after):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_concurrent <= 0 or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        if self.active >= self.max_concurrent:
+            DOWNLOADS_REJECTED.inc()
+            await self.reject(send)
+            return
+
+        self.active += 1
+        DOWNLOADS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
+            DOWNLOADS_IN_FLIGHT.dec()
+
+    async def reject(self, send):
+        body = json.dumps({"detail": "Too many downloads in progress, retry later"}).encode()
+        retry_after = int(self.retry_after * random.uniform(1.0, 2.0))
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from file_lock import FileLock
+
+
+# Objects are named by their sha256, nothing else may ever be turned into a path
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+class ArtifactIntegrityError(Exception):
+    pass
+
+
+class ArtifactStore:
+    # Content-addressed on-disk store for release artifacts.
+    #
+    # Objects live at <root>/objects/<sha256[:2]>/<sha256>, so the same zip is only
+    # ever downloaded from upstream once no matter how many clients ask for it.
+    # The modification time of an object doubles as its last-access time, which
+    # keeps the LRU order across server restarts.
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.locks_dir = os.path.join(root, "locks")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._fill_locks = {}
+
+        self.stats = {"hits": 0, "fills": 0, "evictions": 0}
+
+    def path_for(self, sha256):
+        if not SHA256_PATTERN.fullmatch(sha256):
+            raise ValueError(f"Not a sha256 digest: {sha256!r}")
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def get(self, sha256):
+        path = self.path_for(sha256)
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return path
+
+    async def fill(self, sha256, fetch_chunks):
+        # Return the local path of the object, downloading it with `fetch_chunks()`
+        # (a callable returning an async iterable of bytes) if it is not stored yet.
+        # Concurrent fills for the same digest are coalesced into one download, also
+        # across worker processes sharing the store.
+        path = self.get(sha256)
+        if path is not None:
+            return path
+
+        fill_lock = self._fill_locks.setdefault(sha256, asyncio.Lock())
+        async with fill_lock:
+            path = self.get(sha256)
+            if path is not None:
+                return path
+
+            process_lock = FileLock(os.path.join(self.locks_dir, f"{sha256}.lock"))
+            await process_lock.acquire_async()
+            try:
+                # Another worker may have stored it while this one waited for the lock
+                path = self.get(sha256)
+                if path is not None:
+                    return path
+                await self._download(sha256, fetch_chunks)
+            finally:
+                process_lock.release()
+                self._fill_locks.pop(sha256, None)
+            with self._lock:
+                self.stats["fills"] += 1
+
+        await asyncio.to_thread(self.evict, keep=sha256)
+        return self.path_for(sha256)
+
+    def evict(self, keep=None):
+        # Drop least recently used objects until the store fits in max_bytes
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                st = os.stat(os.path.join(dirpath, name))
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(self.path_for(name))
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.stats["evictions"] += 1
+
+    def digests(self):
+        # sha256 of every stored object
+        return {name for _, _, filenames in os.walk(self.objects_dir) for name in filenames}
+
+    def snapshot(self):
+        objects = 0
+        total = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                objects += 1
+                total += os.path.getsize(os.path.join(dirpath, name))
+        with self._lock:
+            return {**self.stats, "objects": objects, "bytes": total, "max_bytes": self.max_bytes}
+
+    async def _download(self, sha256, fetch_chunks):
+        sha256_hash = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for chunk in fetch_chunks():
+                    # Keep disk writes off the event loop
+                    await asyncio.to_thread(file.write, chunk)
+                    sha256_hash.update(chunk)
+
+            if sha256_hash.hexdigest() != sha256:
+                raise ArtifactIntegrityError(
+                    f"Artifact checksum mismatch: expected {sha256}, got {sha256_hash.hexdigest()}")
+
+            os.makedirs(os.path.dirname(self.path_for(sha256)), exist_ok=True)
+            os.replace(tmp_path, self.path_for(sha256))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
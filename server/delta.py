@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from artifact_store import SHA256_PATTERN
+from chunking import chunk_boundaries, map_file
+from file_lock import FileLock
+
+# Binary delta format, shared with apply_delta() in the updaters:
+#
+#   DELTA_MAGIC
+#   b"C" + >QI (base offset, length)           copy bytes from the base artifact
+#   b"D" + >I (compressed length) + zlib data  literal bytes not found in the base
+DELTA_MAGIC = b"NTDELTA1"
+
+# Literal runs are flushed once they reach this size so the client can apply the
+# patch with bounded memory
+MAX_LITERAL_SIZE = 1024 * 1024
+
+# Failed pairs are not rebuilt for this long (seconds), and only this many are
+# remembered: the pair is keyed by the digest the client reports
+FAILED_RETRY_INTERVAL = 600
+MAX_FAILED_PAIRS = 1024
+
+def build_delta(base_path, target_path, out_file):
+    # Write a patch that rebuilds `target_path` from `base_path` to `out_file`
+    with open(base_path, "rb") as base_file, open(target_path, "rb") as target_file:
+        base = map_file(base_file)
+        target = map_file(target_file)
+
+        index = {}
+        for offset, length in chunk_boundaries(base):
+            index.setdefault(hashlib.blake2b(base[offset:offset + length], digest_size=16).digest(), (offset, length))
+
+        out_file.write(DELTA_MAGIC)
+        copy = None
+        literal = []
+        literal_size = 0
+
+        def flush_copy():
+            if copy is not None:
+                out_file.write(b"C" + struct.pack(">QI", *copy))
+
+        def flush_literal():
+            if literal:
+                data = zlib.compress(b"".join(literal), 6)
+                out_file.write(b"D" + struct.pack(">I", len(data)) + data)
+                literal.clear()
+
+        for offset, length in chunk_boundaries(target):
+            chunk = target[offset:offset + length]
+            match = index.get(hashlib.blake2b(chunk, digest_size=16).digest())
+            if match is not None and match[1] == length:
+                flush_literal()
+                literal_size = 0
+                if copy is not None and copy[0] + copy[1] == match[0]:
+                    # Extend the previous copy when the base ranges are contiguous
+                    copy = (copy[0], copy[1] + length)
+                else:
+                    flush_copy()
+                    copy = match
+            else:
+                flush_copy()
+                copy = None
+                literal.append(chunk)
+                literal_size += length
+                if literal_size >= MAX_LITERAL_SIZE:
+                    flush_literal()
+                    literal_size = 0
+
+        flush_copy()
+        flush_literal()
+
+
+class DeltaCache:
+    # Patches between two artifacts, stored as <root>/<base sha256>-<target sha256>.delta
+    # with the digest of the patch itself in a ".sha256" sidecar. Patches are built
+    # in the background; until one is ready the client is sent the full artifact.
+    def __init__(self, root, max_bytes, retry_interval=FAILED_RETRY_INTERVAL, max_failed=MAX_FAILED_PAIRS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.retry_interval = retry_interval
+        self.max_failed = max_failed
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._building = set()
+        self._failed = {}  # (base, target) -> time of the failure, oldest first
+        self._tasks = set()  # Strong references so running builds aren't garbage collected
+
+        self.stats = {"hits": 0, "builds": 0, "failures": 0, "evictions": 0}
+
+    def path_for(self, base_sha256, target_sha256):
+        if not (SHA256_PATTERN.fullmatch(base_sha256) and SHA256_PATTERN.fullmatch(target_sha256)):
+            raise ValueError(f"Not a sha256 digest pair: {base_sha256!r}, {target_sha256!r}")
+        return os.path.join(self.root, f"{base_sha256}-{target_sha256}.delta")
+
+    def get(self, base_sha256, target_sha256):
+        # Return (path, size, sha256) of a ready patch, or None
+        path = self.path_for(base_sha256, target_sha256)
+        try:
+            with open(path + ".sha256") as file:
+                sha256 = file.read().strip()
+            size = os.path.getsize(path)
+            # Mark as recently used, like ArtifactStore.get
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return path, size, sha256
+
+    def build_async(self, base_sha256, target_sha256, resolve_paths):
+        # Build the patch in a background task. `resolve_paths()` is a coroutine
+        # returning the local (base path, target path) pair, downloading them if needed.
+        key = (base_sha256, target_sha256)
+        with self._lock:
+            failed_at = self._failed.get(key)
+            if key in self._building or (failed_at is not None and time.monotonic() - failed_at < self.retry_interval):
+                return
+            self._failed.pop(key, None)
+            self._building.add(key)
+
+        task = asyncio.get_running_loop().create_task(self._build(key, resolve_paths))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def prune(self, target_sha256s):
+        # Patches towards other artifacts than `target_sha256s` are never offered again
+        for name in os.listdir(self.root):
+            target = name.split(".")[0].partition("-")[2]
+            if not name.startswith("tmp") and target not in target_sha256s:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        # Drop least recently served patches until the cache fits in max_bytes
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".delta"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            path = os.path.join(self.root, name)
+            # The sidecar goes first, get() treats a patch without one as not built
+            for stale_path in (path + ".sha256", path):
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            with self._lock:
+                self.stats["evictions"] += 1
+
+    def _write_delta(self, fd, tmp_path, path, base_path, target_path):
+        with os.fdopen(fd, "wb") as out_file:
+            build_delta(base_path, target_path, out_file)
+
+        sha256_hash = hashlib.sha256()
+        with open(tmp_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256_hash.update(chunk)
+
+        os.replace(tmp_path, path)
+        with open(path + ".sha256", "w") as file:
+            file.write(sha256_hash.hexdigest())
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "building": len(self._building)}
+
+    async def _build(self, key, resolve_paths):
+        base_sha256, target_sha256 = key
+        path = self.path_for(base_sha256, target_sha256)
+        tmp_path = None
+        # Another worker process building the same patch will publish it for this one too
+        process_lock = FileLock(path + ".lock")
+        if not process_lock.acquire(blocking=False):
+            with self._lock:
+                self._building.discard(key)
+            return
+        try:
+            if os.path.exists(path + ".sha256"):
+                return
+            base_path, target_path = await resolve_paths()
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix="tmp")
+            # Diffing is CPU and disk bound, keep it off the event loop
+            await asyncio.to_thread(self._write_delta, fd, tmp_path, path, base_path, target_path)
+
+            with self._lock:
+                self.stats["builds"] += 1
+            print(f"Built delta {base_sha256[:12]} -> {target_sha256[:12]} ({os.path.getsize(path)} bytes)")
+        except Exception as e:
+            with self._lock:
+                self.stats["failures"] += 1
+                # Don't retry on every request, the pair is usually not resolvable
+                self._failed[key] = time.monotonic()
+                while len(self._failed) > self.max_failed:
+                    del self._failed[next(iter(self._failed))]
+            print(f"Failed to build delta {base_sha256[:12]} -> {target_sha256[:12]}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            process_lock.release()
+            with self._lock:
+                self._building.discard(key)
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    # Advisory lock on a file, shared by every worker process of the server.
+    #
+    # The operating system drops the lock when its holder exits, so a crashed worker
+    # never leaves the others waiting. Not reentrant, and not meant to be shared
+    # between coroutines of one process: pair it with an asyncio.Lock for that.
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.name == "nt":
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.05)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self._fd = fd
+        return True
+
+    async def acquire_async(self):
+        # Waiting for another process can take as long as its upstream request, do it off the event loop
+        await asyncio.to_thread(self.acquire)
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if os.name == "nt":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
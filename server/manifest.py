@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+import zipfile
+from chunking import chunk_boundaries
+from file_lock import FileLock
+
+# Chunk manifests for deduplicated downloads.
+#
+# Every file bundled in a release zip is split with the content-defined chunker and
+# each chunk is stored once, by sha256, under <root>/chunks. The manifest lists the
+# files with their chunk digests so an updater can rebuild the install from chunks
+# it already has locally and fetch only the missing ones.
+#
+# The format name changes whenever the chunker does, clients must use the same one.
+MANIFEST_FORMAT = "anchor-v1"
+
+# Unreferenced chunks younger than this are kept by ChunkStore.prune, they may belong
+# to a manifest that is still being built
+CHUNK_PRUNE_GRACE = 3600
+
+
+class ChunkStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def get(self, sha256):
+        path = self.path_for(sha256)
+        return path if os.path.exists(path) else None
+
+    def put(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha256)
+        try:
+            # A chunk that is already stored is marked as new, so prune() spares it
+            # until the manifest being built references it
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        return sha256
+
+    def prune(self, referenced, grace=CHUNK_PRUNE_GRACE):
+        # Remove chunks no manifest in `referenced` uses, returning how many went
+        removed = 0
+        cutoff = time.time() - grace
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if name not in referenced and os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+def build_manifest(zip_path, chunk_store):
+    files = []
+    symlinks = []
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            mode = info.external_attr >> 16
+            data = zip_ref.read(info)
+            if stat.S_ISLNK(mode):
+                symlinks.append({"path": info.filename, "target": data.decode()})
+                continue
+
+            chunks = [
+                [chunk_store.put(data[offset:offset + length]), length]
+                for offset, length in chunk_boundaries(data)
+            ]
+            files.append({
+                "path": info.filename,
+                "size": len(data),
+                "mode": stat.S_IMODE(mode),
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "chunks": chunks,
+            })
+
+    return {"format": MANIFEST_FORMAT, "files": files, "symlinks": symlinks}
+
+
+class ManifestCache:
+    # Manifests keyed by the sha256 of the artifact they describe, persisted as JSON
+    def __init__(self, root, chunk_store):
+        self.root = root
+        self.chunk_store = chunk_store
+        os.makedirs(self.root, exist_ok=True)
+        self._memory = {}
+        self._locks = {}
+
+    def path_for(self, artifact_sha256):
+        return os.path.join(self.root, f"{artifact_sha256}.json")
+
+    async def get(self, artifact_sha256, zip_path):
+        if artifact_sha256 in self._memory:
+            return self._memory[artifact_sha256]
+
+        lock = self._locks.setdefault(artifact_sha256, asyncio.Lock())
+        async with lock:
+            if artifact_sha256 not in self._memory:
+                # Chunking and hashing a release is CPU and disk bound, keep it off the event loop
+                self._memory[artifact_sha256] = await asyncio.to_thread(self._load_or_build, artifact_sha256, zip_path)
+            self._locks.pop(artifact_sha256, None)
+        return self._memory[artifact_sha256]
+
+    def prune(self, artifact_sha256s):
+        # Remove manifests of artifacts not in `artifact_sha256s` (the ones still stored)
+        # and return the digests of the chunks the remaining manifests use
+        referenced = set()
+        for name in os.listdir(self.root):
+            if name.startswith("tmp"):
+                # A manifest being written
+                continue
+            artifact_sha256 = name.split(".")[0]
+            path = os.path.join(self.root, name)
+            try:
+                if artifact_sha256 not in artifact_sha256s:
+                    # The manifest and its lock file
+                    os.remove(path)
+                    self._memory.pop(artifact_sha256, None)
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                manifest = self._memory.get(artifact_sha256)
+                if manifest is None:
+                    with open(path, "r") as file:
+                        manifest = json.load(file)
+            except FileNotFoundError:
+                continue
+            for entry in manifest["files"]:
+                referenced.update(sha256 for sha256, _ in entry["chunks"])
+        return referenced
+
+    def _load_or_build(self, artifact_sha256, zip_path):
+        path = self.path_for(artifact_sha256)
+        # Held while building so worker processes sharing the directory build each manifest once
+        process_lock = FileLock(path + ".lock")
+        process_lock.acquire()
+        try:
+            try:
+                with open(path, "r") as file:
+                    return json.load(file)
+            except FileNotFoundError:
+                pass
+
+            manifest = build_manifest(zip_path, self.chunk_store)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root)
+            with os.fdopen(fd, "w") as file:
+                json.dump(manifest, file)
+            os.replace(tmp_path, path)
+            return manifest
+        finally:
+            process_lock.release()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus text-format metrics.
+#
+# Metrics are registered in REGISTRY when created and rendered by render() for the
+# /metrics endpoint. Label values are passed as keyword arguments, e.g.
+# HTTP_REQUESTS.inc(route="/check-version", method="GET", status="200").
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY = []
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()  # Also updated from worker threads
+        self._values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(labels.items())] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def merge(self, cumulative_counts, total, count, **labels):
+        # Add observations aggregated elsewhere, with counts per bucket bound like ours
+        key = tuple(labels.items())
+        with self._lock:
+            counts, old_total, old_count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [existing + added for existing, added in zip(counts, cumulative_counts)]
+            self._values[key] = (counts, old_total + total, old_count + count)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, bucket_count))
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append((f"{self.name}_sum", labels, round(total, 6)))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time spent handling requests, by route")
+HTTP_REQUESTS = Counter("http_requests_total", "Requests handled, by route, method and status code")
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "Time until GitHub responded (headers only for streams)")
+UPSTREAM_RESPONSES = Counter("upstream_responses_total", "GitHub responses by status code, or error type when none was received")
+
+HTTP_RESPONSE_BYTES = Counter("http_response_bytes_total", "Response body bytes sent, by route and OS of the artifact")
+
+# Platforms releases are built for; os_version labels are one of these, optionally
+# with an architecture suffix ("linux-arm64")
+KNOWN_OS_VERSIONS = {"linux", "macos", "windows"}
+
+CACHE_REQUESTS = Gauge("cache_requests", "Cache lookups since startup, by cache and result")
+CACHE_HIT_RATIO = Gauge("cache_hit_ratio", "Share of cache lookups served without going upstream or rebuilding")
+
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "How late the last event loop lag probe woke up")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram("event_loop_lag_probe_seconds", "How late event loop lag probes woke up")
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so timings include the whole response body and
+    # FileResponse streaming is left untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        body_bytes = 0
+
+        async def send_and_record(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; label by its template
+            # so /download/v1.2/linux and /download/v1.3/linux share a series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, route=route)
+            HTTP_REQUESTS.inc(route=route, method=scope["method"], status=str(status))
+            if body_bytes:
+                os_version = scope.get("path_params", {}).get("os_version", "")
+                HTTP_RESPONSE_BYTES.inc(body_bytes, route=route, os_version=os_version_label(os_version, status))
+
+
+def os_version_label(os_version, status):
+    # The path parameter is client input. Only successful responses keep it, they exist
+    # for platforms a release ships, so errors and probes can't grow the label set
+    if not os_version:
+        return ""
+    if status < 400 and os_version.partition("-")[0] in KNOWN_OS_VERSIONS:
+        return os_version
+    return "other"
+
+
+def set_cache_stats(cache, hits, misses):
+    CACHE_REQUESTS.set(hits, cache=cache, result="hit")
+    CACHE_REQUESTS.set(misses, cache=cache, result="miss")
+    if hits + misses:
+        CACHE_HIT_RATIO.set(round(hits / (hits + misses), 4), cache=cache)
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    # A probe that sleeps for `interval` should wake up on time, anything later is
+    # time the loop spent running something else (blocking calls, CPU-heavy handlers)
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        EVENT_LOOP_LAG.set(round(lag, 6))
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+def log_timing(event, duration, **fields):
+    # One JSON object per line so the logs can be parsed without a custom format
+    print(json.dumps({"event": event, "duration_ms": round(duration * 1000, 2), **fields}), flush=True)
+
+
+@contextmanager
+def timed(event, **fields):
+    # Log how long the block took; `fields` may be updated inside the block
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield fields
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        log_timing(event, time.perf_counter() - start, status=status, **fields)
@@ -0,0 +1,31 @@
+import asyncio
+from metrics import Gauge
+
+EVENT_SUBSCRIBERS = Gauge("release_event_subscribers", "Clients holding a /events connection open")
+
+
+class ReleaseNotifier:
+    # Wakes every /events subscriber when the latest release tag changes.
+    #
+    # Subscribers share one asyncio.Event per release, so an idle connection costs a
+    # suspended coroutine and nothing is done per subscriber until a release appears.
+    def __init__(self):
+        self.version = None
+        self._changed = asyncio.Event()
+
+    def publish(self, version):
+        if not version or version == self.version:
+            return
+        self.version = version
+        # Wake everyone waiting on the current event and start a new one for the next release
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout):
+        # Returns True when a new release was published, False after `timeout` seconds
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
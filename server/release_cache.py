@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import httpx
+from file_lock import FileLock
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class ReleaseCache:
+    # In-process cache for the GitHub "latest release" document.
+    #
+    # - Entries are fresh for `ttl` seconds. After that the stale value keeps being
+    #   served while a single background task revalidates it.
+    # - Revalidation sends If-None-Match with the last ETag, so an unchanged release
+    #   costs a 304 (which GitHub does not count against the rate limit).
+    # - Concurrent cold misses are coalesced: only one caller goes upstream, the
+    #   rest wait for its result.
+    # - With `shared_path`, the document is also kept in that file for the other
+    #   worker processes. Fetches hold a file lock and first look at what another
+    #   worker stored, so only one process per TTL goes upstream.
+    def __init__(self, url, upstream, ttl=60.0, shared_path=None):
+        self.url = url
+        self.upstream = upstream
+        self.ttl = ttl
+        self.shared_path = shared_path
+        self._shared_lock = FileLock(shared_path + ".lock") if shared_path else None
+        self._force_upstream = False
+
+        self._fetch_lock = asyncio.Lock()  # Only one upstream fetch runs at a time
+        self._release = None
+        self._etag = None
+        self._fetched_at = 0.0
+        self._refresh_task = None
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "not_modified": 0,
+            "errors": 0,
+            "shared_loads": 0,
+        }
+
+    async def get(self):
+        if self._release is not None:
+            self.stats["hits"] += 1
+            if self._is_stale() and self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._background_refresh())
+            return self._release
+
+        self.stats["misses"] += 1
+        async with self._fetch_lock:
+            # Another caller may have filled the cache while we were waiting
+            if self._release is not None:
+                return self._release
+            return await self._fetch()
+
+    async def refresh(self):
+        # Revalidate upstream right away, e.g. when a webhook announced a new release
+        self.invalidate()
+        async with self._fetch_lock:
+            return await self._fetch()
+
+    def sync_shared(self):
+        # Adopt a newer document another worker stored; returns True when one was found
+        if self.shared_path is None:
+            return False
+        return self._load_shared()
+
+    def invalidate(self):
+        # Force the next get() to revalidate upstream (the ETag is kept)
+        self._fetched_at = 0.0
+        self._force_upstream = True
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "ttl": self.ttl,
+            "cached": self._release is not None,
+            "age": round(time.monotonic() - self._fetched_at, 3) if self._release is not None else None,
+            "etag": self._etag,
+        }
+
+    def _is_stale(self):
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+    async def _background_refresh(self):
+        try:
+            async with self._fetch_lock:
+                if self._is_stale():
+                    await self._fetch()
+        except UpstreamError as e:
+            # Keep serving the stale value; the next hit after the TTL retries
+            print(f"Background release refresh failed: {e.detail}")
+        finally:
+            self._refresh_task = None
+
+    async def _fetch(self):
+        if self._shared_lock is None:
+            return await self._fetch_upstream()
+
+        await self._shared_lock.acquire_async()
+        try:
+            # Another worker may have refreshed while this one waited for the lock
+            if not self._force_upstream and self._load_shared() and not self._is_stale():
+                return self._release
+            release = await self._fetch_upstream()
+            self._force_upstream = False
+            self._store_shared()
+            return release
+        finally:
+            self._shared_lock.release()
+
+    def _load_shared(self):
+        try:
+            with open(self.shared_path, "r") as file:
+                shared = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        # Convert the writer's wall-clock fetch time into this process' monotonic clock
+        fetched_at = time.monotonic() - max(0.0, time.time() - shared["fetched_at"])
+        if self._release is not None and fetched_at <= self._fetched_at:
+            return False
+
+        self._release = shared["release"]
+        self._etag = shared["etag"]
+        self._fetched_at = fetched_at
+        self.stats["shared_loads"] += 1
+        return True
+
+    def _store_shared(self):
+        shared = {
+            "release": self._release,
+            "etag": self._etag,
+            "fetched_at": time.time() - (time.monotonic() - self._fetched_at),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.shared_path))
+        with os.fdopen(fd, "w") as file:
+            json.dump(shared, file)
+        os.replace(tmp_path, self.shared_path)
+
+    async def _fetch_upstream(self):
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+
+        self.stats["refreshes"] += 1
+        try:
+            response = await self.upstream.get(self.url, headers=headers)
+        except httpx.HTTPError as e:
+            self.stats["errors"] += 1
+            raise UpstreamError(502, f"GitHub API request failed: {e}")
+
+        if response.status_code == 304 and self._release is not None:
+            self.stats["not_modified"] += 1
+            self._fetched_at = time.monotonic()
+            return self._release
+
+        if response.status_code != 200:
+            self.stats["errors"] += 1
+            raise UpstreamError(response.status_code, "GitHub API request failed")
+
+        self._release = response.json()
+        self._etag = response.headers.get("ETag")
+        self._fetched_at = time.monotonic()
+        return self._release
@@ -0,0 +1,56 @@
+import hashlib
+import random
+import time
+from datetime import datetime
+
+
+class RolloutPolicy:
+    # Staged rollout of new releases.
+    #
+    # Every client is placed in a bucket in [0, 100) derived from its client ID and
+    # the release tag, so the same client stays in or out of a release for its
+    # whole rollout. The share of buckets that are offered the release ramps from 0
+    # to `percent` over `ramp_seconds` after the release is published.
+    def __init__(self, percent=100.0, ramp_seconds=0.0, poll_interval=3600.0):
+        self.percent = percent
+        self.ramp_seconds = ramp_seconds
+        self.poll_interval = poll_interval
+
+    def bucket(self, client_id, version):
+        digest = hashlib.sha256(f"{version}:{client_id}".encode()).digest()
+        return int.from_bytes(digest[:4], "big") % 10000 / 100
+
+    def current_percent(self, release):
+        published_at = parse_timestamp(release.get("published_at"))
+        if self.ramp_seconds <= 0 or published_at is None:
+            return self.percent
+        progress = (time.time() - published_at) / self.ramp_seconds
+        return self.percent * min(max(progress, 0.0), 1.0)
+
+    def is_eligible(self, client_id, release):
+        # Clients that don't send an ID predate staged rollouts and always get the release
+        if not client_id:
+            return True
+        return self.bucket(client_id, release.get("tag_name")) < self.current_percent(release)
+
+    def poll_hint(self, client_id, release):
+        # Seconds until the client should check again. Jittered so polls spread out
+        # instead of arriving in waves, and shortened for clients waiting on the ramp
+        hint = self.poll_interval * random.uniform(0.8, 1.2)
+        published_at = parse_timestamp(release.get("published_at"))
+        if client_id and published_at is not None and self.ramp_seconds > 0 and not self.is_eligible(client_id, release):
+            bucket = self.bucket(client_id, release.get("tag_name"))
+            if bucket < self.percent:
+                eligible_at = published_at + self.ramp_seconds * bucket / self.percent
+                hint = min(hint, max(eligible_at - time.time(), 0) + random.uniform(1, 60))
+        return max(1, int(hint))
+
+
+def parse_timestamp(value):
+    # GitHub timestamps look like 2024-05-01T12:00:00Z
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
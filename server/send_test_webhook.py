@@ -0,0 +1,42 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import urllib.error
+import urllib.request
+from dotenv import load_dotenv
+
+# Local stand-in for GitHub's "release published" webhook: signs a payload with
+# GITHUB_WEBHOOK_SECRET the same way GitHub does and posts it to the server.
+#
+#   python server/send_test_webhook.py --tag v1.2.3
+
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a signed release webhook to the update server")
+    parser.add_argument("--url", default="http://localhost:8000/webhooks/github")
+    parser.add_argument("--tag", default="v0.0.0", help="Tag name put in the payload")
+    parser.add_argument("--secret", default=os.getenv("GITHUB_WEBHOOK_SECRET"), help="Defaults to GITHUB_WEBHOOK_SECRET")
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("Set GITHUB_WEBHOOK_SECRET or pass --secret")
+
+    body = json.dumps({"action": "published", "release": {"tag_name": args.tag}}).encode()
+    signature = "sha256=" + hmac.new(args.secret.encode(), body, hashlib.sha256).hexdigest()
+    request = urllib.request.Request(args.url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-GitHub-Event": "release",
+        "X-Hub-Signature-256": signature,
+    })
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            print(response.status, response.read().decode())
+    except urllib.error.HTTPError as e:
+        print(e.code, e.read().decode())
+
+if __name__ == "__main__":
+    main()
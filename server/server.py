@@ -1,31 +1,236 @@
-from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 import uvicorn
-import requests
+import httpx
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
 import os
-import base64
+import time
 from dotenv import load_dotenv
+from release_cache import ReleaseCache, UpstreamError
+from upstream import Upstream
+from artifact_store import ArtifactStore, ArtifactIntegrityError, SHA256_PATTERN
+from delta import DeltaCache
+from file_lock import FileLock
+from manifest import ChunkStore, ManifestCache, MANIFEST_FORMAT
+import metrics
+from metrics import MetricsMiddleware, log_timing, timed
+from rollout import RolloutPolicy
+from admission import AdmissionLimiter
+from notifier import ReleaseNotifier, EVENT_SUBSCRIBERS
+from telemetry import TelemetryStore
 
 # Load environment variables from .env file
 load_dotenv()
 
-api = FastAPI()
-
 # Get GitHub repository details from environment variables
-GITHUB_API_URL = "https://api.github.com/repos/{owner}/{repo}/releases/latest"
+# Overridable so benchmarks can point the server at a local stand-in for the GitHub API
+GITHUB_API_BASE_URL = os.getenv("GITHUB_API_BASE_URL", "https://api.github.com")
+GITHUB_API_URL = GITHUB_API_BASE_URL + "/repos/{owner}/{repo}/releases/latest"
 OWNER = os.getenv("GITHUB_OWNER")
 REPO = os.getenv("GITHUB_REPO")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
-def get_latest_release():
-    url = GITHUB_API_URL.format(owner=OWNER, repo=REPO)
-    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-    
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
+# How long (seconds) release metadata is served from memory before revalidating upstream
+RELEASE_CACHE_TTL = float(os.getenv("RELEASE_CACHE_TTL", "60"))
+
+# Shared connection pool and concurrency limit for all GitHub traffic
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+
+upstream = Upstream(
+    headers={"Authorization": f"token {GITHUB_TOKEN}"},
+    max_connections=UPSTREAM_MAX_CONNECTIONS,
+    concurrency=UPSTREAM_CONCURRENCY,
+    timeout=UPSTREAM_TIMEOUT,
+)
+
+# Local artifact store: every release zip is downloaded from GitHub once and served from disk
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts"))
+ARTIFACT_STORE_MAX_BYTES = int(os.getenv("ARTIFACT_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# How often (seconds) to look for a new tag and prefetch its artifacts, 0 disables prefetching
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "300"))
+
+# Disk budget for delta patches, the least recently served ones go first
+DELTA_STORE_MAX_BYTES = int(os.getenv("DELTA_STORE_MAX_BYTES", str(512 * 1024 ** 2)))
+
+# How often (seconds) manifests, chunks and deltas of artifacts that are no longer
+# stored are removed and the delta budget is enforced, 0 disables it
+STORE_MAINTENANCE_INTERVAL = float(os.getenv("STORE_MAINTENANCE_INTERVAL", "600"))
+
+# How long (seconds) clients and HTTP caches may reuse a /check-version response
+CHECK_VERSION_MAX_AGE = int(os.getenv("CHECK_VERSION_MAX_AGE", "60"))
+
+# Deltas are only offered when the patch is at most this fraction of the full artifact
+DELTA_MAX_RATIO = float(os.getenv("DELTA_MAX_RATIO", "0.5"))
+
+# Staged rollout: share of clients offered a new release, reached ROLLOUT_RAMP_HOURS after it is published
+ROLLOUT_PERCENT = float(os.getenv("ROLLOUT_PERCENT", "100"))
+ROLLOUT_RAMP_HOURS = float(os.getenv("ROLLOUT_RAMP_HOURS", "0"))
+
+# Seconds clients are told to wait between version checks (jittered per response)
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "3600"))
+
+# Artifact, delta, manifest and chunk downloads streamed at once per worker, 0 disables the limit.
+# Clients over the limit get a 503 with Retry-After around DOWNLOAD_RETRY_AFTER seconds.
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "64"))
+DOWNLOAD_RETRY_AFTER = int(os.getenv("DOWNLOAD_RETRY_AFTER", "30"))
+
+rollout = RolloutPolicy(ROLLOUT_PERCENT, ROLLOUT_RAMP_HOURS * 3600, POLL_INTERVAL)
+
+# Secret of the GitHub "release" webhook; the endpoint is disabled when unset
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+
+# Seconds between keep-alive comments on idle /events connections
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "30"))
+
+# How often (seconds) each worker looks for a release stored by another worker
+RELEASE_WATCH_INTERVAL = float(os.getenv("RELEASE_WATCH_INTERVAL", "2"))
+
+notifier = ReleaseNotifier()
+
+# Client performance telemetry, aggregated per version and OS (per worker, like /metrics)
+telemetry = TelemetryStore()
 
-    return response.json()
+artifact_store = ArtifactStore(ARTIFACT_STORE_DIR, ARTIFACT_STORE_MAX_BYTES)
+
+# The release document is shared through a file next to the artifacts, so with
+# several workers only one of them revalidates it upstream per TTL
+release_cache = ReleaseCache(
+    GITHUB_API_URL.format(owner=OWNER, repo=REPO),
+    upstream,
+    ttl=RELEASE_CACHE_TTL,
+    shared_path=os.path.join(ARTIFACT_STORE_DIR, "release.json"),
+)
+delta_cache = DeltaCache(os.path.join(ARTIFACT_STORE_DIR, "deltas"), DELTA_STORE_MAX_BYTES)
+chunk_store = ChunkStore(os.path.join(ARTIFACT_STORE_DIR, "chunks"))
+manifest_cache = ManifestCache(os.path.join(ARTIFACT_STORE_DIR, "manifests"), chunk_store)
+
+# Chunks are immutable and addressed by their digest, any cache may keep them forever
+CHUNK_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# The last releases seen as latest, by tag. Delta bases are only resolved from these
+# or from the artifact store, never by looking up a client-supplied tag upstream
+RECENT_RELEASES = int(os.getenv("RECENT_RELEASES", "10"))
+recent_releases = {}
+
+async def get_latest_release():
+    start = time.perf_counter()
+    misses = release_cache.stats["misses"]
+    try:
+        release = await release_cache.get()
+    except UpstreamError as e:
+        log_timing("get_latest_release", time.perf_counter() - start, status=e.status_code)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    # Cache hits take microseconds, only log the calls that had to wait for GitHub
+    if release_cache.stats["misses"] != misses:
+        log_timing("get_latest_release", time.perf_counter() - start, status="ok", version=release.get("tag_name"))
+    # Wakes /events subscribers whenever a lookup reveals a new tag
+    notifier.publish(release.get("tag_name"))
+    remember_release(release)
+    return release
+
+def remember_release(release):
+    tag = release.get("tag_name")
+    recent_releases.pop(tag, None)
+    recent_releases[tag] = release
+    while len(recent_releases) > RECENT_RELEASES:
+        del recent_releases[next(iter(recent_releases))]
+
+async def prefetch_artifacts():
+    prefetched_version = None
+    while True:
+        try:
+            release = await get_latest_release()
+            version = release.get("tag_name")
+            if version != prefetched_version:
+                latest_sha256s = set()
+                for asset in release.get("assets", []):
+                    if asset["name"].endswith(".zip"):
+                        os_version = asset["name"][len("app-"):-len(".zip")]
+                        _, sha256, path = await ensure_artifact(release, os_version)
+                        await manifest_cache.get(sha256, path)
+                        latest_sha256s.add(sha256)
+                delta_cache.prune(latest_sha256s)
+                print(f"Prefetched artifacts for release {version}")
+                prefetched_version = version
+        except Exception as e:
+            print(f"Artifact prefetch failed: {e}")
+
+        await asyncio.sleep(PREFETCH_INTERVAL)
+
+def prune_stores():
+    # Manifests, chunks and deltas are derived from stored artifacts, so the artifact
+    # store's LRU bounds them: whatever belongs to an evicted artifact goes as well
+    process_lock = FileLock(os.path.join(ARTIFACT_STORE_DIR, "maintenance.lock"))
+    if not process_lock.acquire(blocking=False):
+        # Another worker is already pruning the shared directories
+        return
+    try:
+        artifact_sha256s = artifact_store.digests()
+        referenced_chunks = manifest_cache.prune(artifact_sha256s)
+        removed_chunks = chunk_store.prune(referenced_chunks)
+        delta_cache.prune(artifact_sha256s)
+        delta_cache.evict()
+    finally:
+        process_lock.release()
+    if removed_chunks:
+        print(f"Pruned {removed_chunks} unreferenced chunks")
+
+async def maintain_stores():
+    while True:
+        await asyncio.sleep(STORE_MAINTENANCE_INTERVAL)
+        try:
+            # Walks the store directories, keep it off the event loop
+            await asyncio.to_thread(prune_stores)
+        except Exception as e:
+            print(f"Store maintenance failed: {e}")
+
+async def watch_shared_release():
+    # With several workers the webhook or TTL refresh lands on one of them; the
+    # others learn about the new release from the shared cache file
+    while True:
+        await asyncio.sleep(RELEASE_WATCH_INTERVAL)
+        try:
+            if release_cache.sync_shared():
+                await get_latest_release()
+        except Exception as e:
+            print(f"Watching the shared release cache failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    await upstream.start()
+    prefetch_task = None
+    if PREFETCH_INTERVAL > 0:
+        prefetch_task = asyncio.create_task(prefetch_artifacts())
+    maintenance_task = None
+    if STORE_MAINTENANCE_INTERVAL > 0:
+        maintenance_task = asyncio.create_task(maintain_stores())
+    lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    watch_task = asyncio.create_task(watch_shared_release())
+    yield
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+    lag_task.cancel()
+    watch_task.cancel()
+    await upstream.close()
+
+api = FastAPI(lifespan=lifespan)
+api.add_middleware(AdmissionLimiter, path_prefixes=["/download/", "/delta/", "/manifest/", "/chunks/"],
+                   max_concurrent=MAX_CONCURRENT_DOWNLOADS, retry_after=DOWNLOAD_RETRY_AFTER)
+# Added last so it is outermost and also sees the requests turned away by the limiter
+api.add_middleware(MetricsMiddleware)
 
 @api.get('/')
 def index():
@@ -42,79 +247,604 @@ def index():
     return Response(content=body, media_type="text/html")
 
 @api.get("/api/health_check")
-def health_check():
+async def health_check():
     try:
         return {"status": "healthy"}
     except Exception as e:
         raise HTTPException(status_code=500, detail="Unhealthy: " + str(e))
 
+@api.get("/api/cache_stats")
+def cache_stats():
+    return {
+        "release_cache": release_cache.snapshot(),
+        "artifact_store": artifact_store.snapshot(),
+        "delta_cache": delta_cache.snapshot(),
+    }
+
+@api.get("/metrics")
+def get_metrics():
+    release_stats = release_cache.snapshot()
+    metrics.set_cache_stats("release", release_stats["hits"], release_stats["misses"])
+    artifact_stats = artifact_store.snapshot()
+    metrics.set_cache_stats("artifact", artifact_stats["hits"], artifact_stats["fills"])
+    delta_stats = delta_cache.snapshot()
+    metrics.set_cache_stats("delta", delta_stats["hits"], delta_stats["builds"] + delta_stats["failures"])
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Model for a patch from the client's current artifact to the latest one
+class DeltaInfo(BaseModel):
+    base_sha256: str
+    size: int
+    sha256: str
+    download_url: str
+
 # Model for version info response
 class VersionInfo(BaseModel):
     version: str
-    download_zip: str
-    checksum_zip: str
+    size: int
+    sha256: str
+    download_url: str
+    delta: Optional[DeltaInfo] = None
+    # Every digest published for the artifact, keyed by algorithm (always includes sha256)
+    digests: Dict[str, str] = {}
+    # Chunk manifest of the files in the artifact, for updaters that rebuild from chunks
+    manifest_url: Optional[str] = None
+    manifest_format: str = MANIFEST_FORMAT
 
-@api.get("/check-version")
-def check_version():
-    release = get_latest_release()
-    version = release.get("tag_name")
-    
-    if not version:
-        raise HTTPException(status_code=404, detail="Version information not found")
+# Size of the blocks read from GitHub when filling the artifact store
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
 
-    return {"version": version}
+# Checksums never change for a published asset, so they are fetched once per asset.
+# Requests that miss while a fetch is in flight wait on its lock instead of fetching again,
+# and the other workers read what was fetched from CHECKSUM_DIR
+checksum_cache = {}
+checksum_locks = {}
+CHECKSUM_DIR = os.path.join(ARTIFACT_STORE_DIR, "checksums")
 
-@api.get("/get-update", response_model=VersionInfo)
-async def check_update(os_version: str = Query(..., description="OS version to fetch update for")):
-    release = get_latest_release()
-    version = release.get("tag_name")
+# Extra digest assets the release workflow may publish next to the .sha256 one
+EXTRA_DIGEST_ALGORITHMS = ("blake2b", "blake3")
+
+def github_asset_headers():
+    return {
+        "Authorization": f"token {GITHUB_TOKEN}",
+        "Accept": "application/octet-stream"
+    }
+
+def find_release_assets(release, os_version):
     assets = release.get("assets", [])
-    
+
     if not assets:
         raise HTTPException(status_code=404, detail="No assets found for the release")
-    
-    zip_file_url = None
-    checksum_url = None
-    
+
     for asset in assets:
-        if os_version in asset["name"] and asset["name"].endswith(".zip"):
-            zip_file_url = asset["url"]
-            
-            # Generate checksum URL
+        # Exact match: "linux" must not pick app-linux-arm64.zip
+        if asset["name"] == f"app-{os_version}.zip":
+            # Generate checksum asset name
             checksum_name = asset["name"] + ".sha256"
-            checksum_url = next((a["url"] for a in assets if a["name"] == checksum_name), None)
-            
-            if checksum_url is None:
+            checksum_asset = next((a for a in assets if a["name"] == checksum_name), None)
+
+            if checksum_asset is None:
                 raise HTTPException(status_code=404, detail=f"Checksum file for {asset['name']} not found")
-            
-            break
+
+            return asset, checksum_asset
+
+    raise HTTPException(status_code=404, detail=f"No update found for OS version '{os_version}'")
+
+def parse_checksum(content):
+    # The Windows job writes the checksum with PowerShell's Out-File (UTF-16, upper case)
+    if content.startswith(b"\xff\xfe") or content.startswith(b"\xfe\xff"):
+        text = content.decode("utf-16")
+    else:
+        text = content.decode("utf-8-sig")
+    return text.strip().split()[0].lower()
+
+async def get_checksum(checksum_asset):
+    checksum_url = checksum_asset["url"]
+    if checksum_url in checksum_cache:
+        return checksum_cache[checksum_url]
+
+    async with checksum_locks.setdefault(checksum_url, asyncio.Lock()):
+        # Another request may have fetched it while this one was waiting
+        if checksum_url not in checksum_cache:
+            checksum_cache[checksum_url] = await fetch_shared_checksum(checksum_url)
+            # Later requests hit the cache, waiters still hold the lock they queued on
+            checksum_locks.pop(checksum_url, None)
+    return checksum_cache[checksum_url]
+
+async def fetch_shared_checksum(checksum_url):
+    # Only one worker fetches the asset, the others wait for its lock and read the file
+    os.makedirs(CHECKSUM_DIR, exist_ok=True)
+    path = os.path.join(CHECKSUM_DIR, hashlib.sha256(checksum_url.encode()).hexdigest())
+    process_lock = FileLock(path + ".lock")
+    await process_lock.acquire_async()
+    try:
+        try:
+            with open(path) as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+
+        try:
+            checksum_response = await upstream.get(checksum_url, headers=github_asset_headers())
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Failed to download checksum file: {e}")
+        if checksum_response.status_code != 200:
+            raise HTTPException(status_code=checksum_response.status_code, detail="Failed to download checksum file")
+        checksum = parse_checksum(checksum_response.content)
+
+        with open(path + ".tmp", "w") as file:
+            file.write(checksum)
+        os.replace(path + ".tmp", path)
+        return checksum
+    finally:
+        process_lock.release()
+
+async def get_digests(release, zip_asset, sha256):
+    digests = {"sha256": sha256}
+    for algorithm in EXTRA_DIGEST_ALGORITHMS:
+        digest_name = f"{zip_asset['name']}.{algorithm}"
+        digest_asset = next((a for a in release.get("assets", []) if a["name"] == digest_name), None)
+        if digest_asset is not None:
+            digests[algorithm] = await get_checksum(digest_asset)
+    return digests
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+@api.get("/check-version")
+async def check_version(
+    request: Request,
+    response: Response,
+    client_id: Optional[str] = Query(None, description="Stable client ID, used for staged rollouts"),
+    current_version: Optional[str] = Query(None, description="Version the client is running"),
+):
+    release = await get_latest_release()
+    version = release.get("tag_name")
     
-    if not zip_file_url:
-        raise HTTPException(status_code=404, detail=f"No update found for OS version '{os_version}'")
+    if not version:
+        raise HTTPException(status_code=404, detail="Version information not found")
 
+    # Clients outside the rollout so far are told to stay on their current version
+    if current_version and not rollout.is_eligible(client_id, release):
+        version = current_version
+
+    # The body only depends on the offered version, so it is a strong validator. The
+    # jittered poll hint differs on every response, so it is only sent as Retry-After
+    # (on 304s too) and never in the body the ETag describes.
+    retry_after = rollout.poll_hint(client_id, release)
     headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/octet-stream"
+        "ETag": f'"{version}"',
+        "Cache-Control": f"public, max-age={CHECK_VERSION_MAX_AGE}",
+        "Retry-After": str(retry_after),
     }
-    
-    # Fetch the zip file and checksum file
-    zip_response = requests.get(zip_file_url, headers=headers)
-    if zip_response.status_code != 200:
-        raise HTTPException(status_code=zip_response.status_code, detail="Failed to download update file")
-    
-    checksum_response = requests.get(checksum_url, headers=headers)
-    if checksum_response.status_code != 200:
-        raise HTTPException(status_code=checksum_response.status_code, detail="Failed to download checksum file")
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return {"version": version}
+
+def validate_sha256(value, name):
+    # Digests from clients end up in file names, so only hex sha256 digests are accepted
+    value = value.lower()
+    if not SHA256_PATTERN.fullmatch(value):
+        raise HTTPException(status_code=422, detail=f"{name} is not a sha256 digest")
+    return value
+
+@api.get("/get-update", response_model=VersionInfo)
+async def check_update(
+    os_version: str = Query(..., description="OS version to fetch update for"),
+    current_version: Optional[str] = Query(None, description="Version the client is running"),
+    base_sha256: Optional[str] = Query(None, description="Checksum of the artifact the client has locally"),
+    base_version: Optional[str] = Query(None, description="Release the local artifact came from, if not current_version"),
+):
+    if base_sha256 is not None:
+        base_sha256 = validate_sha256(base_sha256, "base_sha256")
+    release = await get_latest_release()
+    return await build_version_info(release, os_version, current_version, base_sha256, base_version)
+
+async def build_version_info(release, os_version, current_version=None, base_sha256=None, base_version=None):
+    version = release.get("tag_name")
+    zip_asset, checksum_asset = find_release_assets(release, os_version)
+    sha256 = await get_checksum(checksum_asset)
 
-    # Encode files as base64
-    download_zip_base64 = base64.b64encode(zip_response.content).decode('utf-8')
-    checksum_zip_base64 = base64.b64encode(checksum_response.content).decode('utf-8')
+    # base_sha256 has been checked with validate_sha256 by the endpoint. The base is
+    # the installed release unless the client says otherwise (after a chunk update)
+    delta = None
+    base_version = base_version or current_version
+    if base_version and base_sha256 and base_sha256 != sha256:
+        delta = find_delta(release, os_version, base_version, base_sha256, sha256, zip_asset["size"])
 
     return VersionInfo(
         version=version,
-        download_zip=download_zip_base64,
-        checksum_zip=checksum_zip_base64
+        size=zip_asset["size"],
+        sha256=sha256,
+        download_url=f"/download/{version}/{os_version}",
+        delta=delta,
+        digests=await get_digests(release, zip_asset, sha256),
+        manifest_url=f"/manifest/{version}/{os_version}"
+    )
+
+class NegotiationRequest(BaseModel):
+    os_version: str
+    arch: Optional[str] = None
+    current_version: Optional[str] = None
+    client_id: Optional[str] = None
+    # Checksum of the artifact the client kept from its last update, for deltas
+    base_sha256: Optional[str] = None
+    # Release that artifact came from, when it isn't current_version
+    base_version: Optional[str] = None
+    # Delivery methods and digests the client supports: "delta", "manifest", "blake2b", "blake3"
+    capabilities: List[str] = []
+
+class NegotiationResult(BaseModel):
+    update_available: bool
+    # "delta", "manifest", "full" or "none"
+    delivery: str
+    # Bytes the client is expected to download with the chosen delivery, if known up front
+    size: Optional[int] = None
+    update: Optional[VersionInfo] = None
+    retry_after: int
+
+def resolve_platform(release, os_version, arch):
+    # Prefer an architecture-specific build (app-<os>-<arch>.zip) when the release has one
+    if arch:
+        platform = f"{os_version}-{arch.lower()}"
+        if any(asset["name"] == f"app-{platform}.zip" for asset in release.get("assets", [])):
+            return platform
+    return os_version
+
+@api.get("/negotiate", response_model=NegotiationResult)
+async def negotiate(
+    request: Request,
+    response: Response,
+    os_version: str = Query(..., description="OS version to fetch update for"),
+    arch: Optional[str] = Query(None, description="Machine architecture, for architecture-specific builds"),
+    current_version: Optional[str] = Query(None, description="Version the client is running"),
+    client_id: Optional[str] = Query(None, description="Stable client ID, used for staged rollouts"),
+    base_sha256: Optional[str] = Query(None, description="Checksum of the artifact the client has locally"),
+    base_version: Optional[str] = Query(None, description="Release the local artifact came from, if not current_version"),
+    capabilities: List[str] = Query([], description="Delivery methods and digests the client supports, repeated"),
+):
+    # Everything is in the URL, so shared caches and CDNs can store the answer like
+    # /check-version's and absorb polling; POST /negotiate takes the same fields as JSON
+    negotiation = NegotiationRequest(
+        os_version=os_version,
+        arch=arch,
+        current_version=current_version,
+        client_id=client_id,
+        base_sha256=base_sha256,
+        base_version=base_version,
+        capabilities=capabilities,
+    )
+    return await negotiation_response(negotiation, request, response,
+                                      {"Cache-Control": f"public, max-age={CHECK_VERSION_MAX_AGE}"})
+
+@api.post("/negotiate", response_model=NegotiationResult)
+async def negotiate_post(negotiation: NegotiationRequest, request: Request, response: Response):
+    return await negotiation_response(negotiation, request, response)
+
+async def negotiation_response(negotiation, request, response, extra_headers=None):
+    # One round trip from "what am I running" to "what should I download": the
+    # release lookup is shared by the version check and the delivery decision
+    if negotiation.base_sha256 is not None:
+        negotiation.base_sha256 = validate_sha256(negotiation.base_sha256, "base_sha256")
+    release = await get_latest_release()
+    retry_after = rollout.poll_hint(negotiation.client_id, release)
+    result = await decide_delivery(negotiation, release, retry_after)
+
+    # Polling clients send back the ETag of their last answer and get a bodyless 304
+    # until the decision changes. The validator covers everything but the jittered
+    # poll hint, hence weak; the hint travels in Retry-After, on 304s too.
+    decision = json.dumps(jsonable_encoder(result, exclude={"retry_after"}), sort_keys=True)
+    headers = {
+        "ETag": f'W/"{hashlib.sha256(decision.encode()).hexdigest()[:32]}"',
+        "Retry-After": str(retry_after),
+        **(extra_headers or {}),
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return result
+
+async def decide_delivery(negotiation, release, retry_after):
+    version = release.get("tag_name")
+    if (not version or version == negotiation.current_version
+            or not rollout.is_eligible(negotiation.client_id, release)):
+        return NegotiationResult(update_available=False, delivery="none", retry_after=retry_after)
+
+    os_version = resolve_platform(release, negotiation.os_version, negotiation.arch)
+    capabilities = set(negotiation.capabilities)
+    base_sha256 = negotiation.base_sha256 if "delta" in capabilities else None
+    update = await build_version_info(release, os_version, negotiation.current_version, base_sha256,
+                                      negotiation.base_version)
+    # Digests the client can't compute are of no use to it
+    update.digests = {
+        algorithm: digest for algorithm, digest in update.digests.items()
+        if algorithm == "sha256" or algorithm in capabilities
+    }
+
+    if update.delta is not None:
+        delivery, size = "delta", update.delta.size
+    elif "manifest" in capabilities:
+        # The missing chunks are only known once the client compares the manifest
+        delivery, size = "manifest", None
+    else:
+        delivery, size = "full", update.size
+    if delivery != "manifest":
+        update.manifest_url = None
+
+    return NegotiationResult(update_available=True, delivery=delivery, size=size, update=update, retry_after=retry_after)
+
+def find_delta(release, os_version, base_version, base_sha256, target_sha256, full_size):
+    ready = delta_cache.get(base_sha256, target_sha256)
+    if ready is None:
+        base_release = recent_releases.get(base_version)
+        if base_release is None and artifact_store.get(base_sha256) is None:
+            # An unknown base, there is nothing to build the delta from
+            return None
+
+        # Build it in the background and send the full artifact this time
+        async def resolve_paths():
+            base_path = artifact_store.get(base_sha256)
+            if base_path is None:
+                if base_release is None:
+                    raise ValueError(f"Artifact {base_sha256} is no longer stored")
+                _, sha256, base_path = await ensure_artifact(base_release, os_version)
+                if sha256 != base_sha256:
+                    raise ValueError(f"Release {base_version} does not match the client's base artifact")
+            return base_path, (await ensure_artifact(release, os_version))[2]
+
+        delta_cache.build_async(base_sha256, target_sha256, resolve_paths)
+        return None
+
+    _, size, sha256 = ready
+    if size > full_size * DELTA_MAX_RATIO:
+        return None
+
+    return DeltaInfo(
+        base_sha256=base_sha256,
+        size=size,
+        sha256=sha256,
+        download_url=f"/delta/{base_sha256}/{target_sha256}"
     )
 
+async def ensure_artifact(release, os_version):
+    # Return (zip_asset, sha256, local path) for the release artifact, filling the store on first use
+    zip_asset, checksum_asset = find_release_assets(release, os_version)
+    sha256 = await get_checksum(checksum_asset)
+
+    async def fetch_chunks():
+        with timed("artifact_download", os_version=os_version, sha256=sha256, bytes=0) as fields:
+            async with upstream.stream(zip_asset["url"], headers=github_asset_headers()) as zip_response:
+                if zip_response.status_code != 200:
+                    raise HTTPException(status_code=zip_response.status_code, detail="Failed to download update file")
+                async for chunk in zip_response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    fields["bytes"] += len(chunk)
+                    yield chunk
+
+    try:
+        path = await artifact_store.fill(sha256, fetch_chunks)
+    except ArtifactIntegrityError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Failed to download update file: {e}")
+
+    return zip_asset, sha256, path
+
+def parse_range(range_header, size):
+    # Parse a single "bytes=" range into an inclusive (start, end) pair.
+    # Returns None when the header should be ignored and the full body sent.
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+def read_file_range(path, start, end):
+    with open(path, "rb") as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def artifact_response(request, path, sha256, filename):
+    # The artifact is content-addressed, so its digest is a strong validator
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        size = os.path.getsize(path)
+        byte_range = parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                read_file_range(path, start, end),
+                status_code=206,
+                media_type="application/zip",
+                headers=headers
+            )
+
+    # FileResponse uses the ASGI zero-copy send extension when the server offers it
+    return FileResponse(path, media_type="application/zip", filename=filename, headers=headers)
+
+@api.get("/download/{version}/{os_version}")
+async def download_update(version: str, os_version: str, request: Request):
+    release = await get_latest_release()
+    if release.get("tag_name") != version:
+        raise HTTPException(status_code=404, detail=f"Version '{version}' is not the latest release")
+
+    zip_asset, sha256, path = await ensure_artifact(release, os_version)
+    return artifact_response(request, path, sha256, zip_asset["name"])
+
+@api.get("/delta/{base_sha256}/{target_sha256}")
+async def download_delta(base_sha256: str, target_sha256: str, request: Request):
+    base_sha256 = validate_sha256(base_sha256, "base_sha256")
+    target_sha256 = validate_sha256(target_sha256, "target_sha256")
+    ready = delta_cache.get(base_sha256, target_sha256)
+    if ready is None:
+        raise HTTPException(status_code=404, detail="Delta not available")
+
+    path, _, sha256 = ready
+    return artifact_response(request, path, sha256, f"{base_sha256[:12]}-{target_sha256[:12]}.delta")
+
+@api.get("/manifest/{version}/{os_version}")
+async def get_manifest(version: str, os_version: str, request: Request):
+    release = await get_latest_release()
+    if release.get("tag_name") != version:
+        raise HTTPException(status_code=404, detail=f"Version '{version}' is not the latest release")
+
+    _, sha256, path = await ensure_artifact(release, os_version)
+    etag = f'"{sha256}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    manifest = await manifest_cache.get(sha256, path)
+    return JSONResponse(
+        {"version": version, "artifact_sha256": sha256, **manifest},
+        headers={"ETag": etag, "Cache-Control": CHUNK_CACHE_CONTROL}
+    )
+
+@api.get("/chunks/{sha256}")
+async def download_chunk(sha256: str):
+    path = chunk_store.get(sha256) if SHA256_PATTERN.fullmatch(sha256) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        headers={"ETag": f'"{sha256}"', "Cache-Control": CHUNK_CACHE_CONTROL}
+    )
+
+def verify_webhook_signature(body, signature):
+    expected = "sha256=" + hmac.new(GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return signature is not None and hmac.compare_digest(expected, signature)
+
+@api.post("/webhooks/github")
+async def github_webhook(request: Request):
+    if not GITHUB_WEBHOOK_SECRET:
+        raise HTTPException(status_code=404, detail="Webhook not configured")
+
+    body = await request.body()
+    if not verify_webhook_signature(body, request.headers.get("x-hub-signature-256")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Webhook body is not a JSON object")
+
+    event = request.headers.get("x-github-event")
+    if event == "ping":
+        return {"status": "ok"}
+    if event != "release" or payload.get("action") not in ("published", "released"):
+        return {"status": "ignored"}
+
+    # Don't trust the payload for the release itself, look it up like every other request
+    try:
+        release = await release_cache.refresh()
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    notifier.publish(release.get("tag_name"))
+    return {"status": "accepted", "version": release.get("tag_name")}
+
+@api.get("/events")
+async def release_events(
+    client_id: Optional[str] = Query(None, description="Stable client ID, used for staged rollouts"),
+    current_version: Optional[str] = Query(None, description="Version the client is running"),
+):
+    # Server-sent events: a "release" event whenever a version the client should
+    # install is published, and a comment every EVENTS_HEARTBEAT seconds otherwise
+    async def stream():
+        announced = current_version
+        EVENT_SUBSCRIBERS.inc()
+        try:
+            yield f"retry: {int(EVENTS_HEARTBEAT * 1000)}\n\n"
+            while True:
+                try:
+                    release = await get_latest_release()
+                except HTTPException:
+                    release = None
+
+                version = release.get("tag_name") if release else None
+                # Clients outside a staged rollout are re-checked on every heartbeat
+                if version and version != announced and rollout.is_eligible(client_id, release):
+                    announced = version
+                    yield f"event: release\ndata: {json.dumps({'version': version})}\n\n"
+
+                if not await notifier.wait(EVENTS_HEARTBEAT):
+                    yield ": keep-alive\n\n"
+        finally:
+            EVENT_SUBSCRIBERS.dec()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class TelemetryHistogram(BaseModel):
+    counts: List[int]  # One per bucket bound in telemetry.TELEMETRY_BUCKETS_MS, plus one above them
+    sum: float
+
+class TelemetryReport(BaseModel):
+    version: str
+    os_version: str
+    histograms: Dict[str, TelemetryHistogram]
+
+@api.post("/telemetry", status_code=204)
+async def ingest_telemetry(report: TelemetryReport):
+    try:
+        telemetry.ingest(report.version, report.os_version,
+                         {metric: (histogram.counts, histogram.sum) for metric, histogram in report.histograms.items()})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(status_code=204)
+
+@api.get("/api/telemetry")
+def telemetry_summary():
+    # Per version and OS, so a release that regresses frame time or update duration stands out
+    return telemetry.summary()
+
 if __name__ == "__main__":
-    uvicorn.run(api, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description="Update server")
+    parser.add_argument("--workers", type=int, nargs="?", const=os.cpu_count() or 1,
+                        default=int(os.getenv("SERVER_WORKERS", "1")),
+                        help="Number of worker processes (default 1, --workers alone starts one per CPU)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Every worker imports the app itself, so uvicorn needs it as an import string
+        uvicorn.run("server:api", host="0.0.0.0", port=8000, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(api, host="0.0.0.0", port=8000)
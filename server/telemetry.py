@@ -0,0 +1,81 @@
+import re
+from itertools import accumulate
+from metrics import Counter, Histogram
+
+# Must match TELEMETRY_BUCKETS_MS in client/telemetry.py
+TELEMETRY_BUCKETS_MS = (1, 2, 4, 8, 16, 33, 50, 100, 250, 500, 1000, 2500, 5000,
+                        10000, 30000, 60000, 120000, 300000)
+
+# Timings the client reports; anything else is ignored so new clients can add metrics
+TELEMETRY_METRICS = {"startup_ms", "frame_ms", "update_check_ms", "download_ms", "extract_ms", "install_ms"}
+TELEMETRY_OS_VERSIONS = {"linux", "macos", "windows"}
+
+# Versions come from clients, so they are checked and capped to keep the label set bounded
+VERSION_PATTERN = re.compile(r"^[\w.+-]{1,32}$")
+MAX_TRACKED_VERSIONS = 50
+
+CLIENT_TIMINGS = Histogram("client_timing_milliseconds", "Timings reported by clients, by version, OS and metric",
+                           buckets=TELEMETRY_BUCKETS_MS)
+CLIENT_REPORTS = Counter("client_telemetry_reports_total", "Telemetry batches received, by version and OS")
+
+
+class TelemetryStore:
+    # Aggregates client telemetry per (version, OS, metric).
+    #
+    # Clients send histogram bucket counts rather than samples, so ingesting a batch
+    # is a few list additions and memory is bounded by the label limits, not by the
+    # number of clients. Totals also feed CLIENT_TIMINGS for /metrics.
+    def __init__(self, max_versions=MAX_TRACKED_VERSIONS):
+        self.max_versions = max_versions
+        self.histograms = {}  # (version, os_version, metric) -> [counts, total]
+
+    def version_label(self, version):
+        if not VERSION_PATTERN.match(version):
+            return "invalid"
+        known = {key[0] for key in self.histograms}
+        if version not in known and len(known) >= self.max_versions:
+            return "other"
+        return version
+
+    def ingest(self, version, os_version, histograms):
+        # `histograms` maps metric -> (counts, total); counts has one entry per bucket
+        # bound plus one for larger values. Raises ValueError for malformed batches.
+        if os_version not in TELEMETRY_OS_VERSIONS:
+            raise ValueError(f"Unknown OS {os_version!r}")
+        for metric, (counts, total) in histograms.items():
+            if len(counts) != len(TELEMETRY_BUCKETS_MS) + 1 or any(count < 0 for count in counts) or total < 0:
+                raise ValueError(f"Malformed histogram for {metric!r}")
+
+        version = self.version_label(version)
+        for metric, (counts, total) in histograms.items():
+            if metric not in TELEMETRY_METRICS or not any(counts):
+                continue
+            entry = self.histograms.setdefault((version, os_version, metric), [[0] * len(counts), 0.0])
+            entry[0] = [existing + added for existing, added in zip(entry[0], counts)]
+            entry[1] += total
+            CLIENT_TIMINGS.merge(list(accumulate(counts))[:len(TELEMETRY_BUCKETS_MS)], total, sum(counts),
+                                 version=version, os_version=os_version, metric=metric)
+        CLIENT_REPORTS.inc(version=version, os_version=os_version)
+
+    def summary(self):
+        # {version: {os_version: {metric: {count, mean_ms, p50_ms, p95_ms, p99_ms}}}}.
+        # Percentiles are bucket upper bounds, None when they fall past the last bound.
+        summary = {}
+        for (version, os_version, metric), (counts, total) in sorted(self.histograms.items()):
+            count = sum(counts)
+            summary.setdefault(version, {}).setdefault(os_version, {})[metric] = {
+                "count": count,
+                "mean_ms": round(total / count, 2),
+                "p50_ms": bucket_percentile(counts, 0.50),
+                "p95_ms": bucket_percentile(counts, 0.95),
+                "p99_ms": bucket_percentile(counts, 0.99),
+            }
+        return summary
+
+
+def bucket_percentile(counts, fraction):
+    target = fraction * sum(counts)
+    for bound, cumulative in zip(TELEMETRY_BUCKETS_MS, accumulate(counts)):
+        if cumulative >= target:
+            return bound
+    return None
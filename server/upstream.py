@@ -0,0 +1,63 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import httpx
+from metrics import UPSTREAM_DURATION, UPSTREAM_RESPONSES
+
+
+class Upstream:
+    # Shared async HTTP client for all GitHub traffic.
+    #
+    # One keep-alive connection pool is reused by every request, so release lookups
+    # no longer pay a TCP+TLS handshake each time. The semaphore bounds how many
+    # upstream requests (including long artifact downloads) run at once.
+    def __init__(self, headers, max_connections=20, concurrency=8, timeout=10.0, read_timeout=60.0):
+        self.headers = headers
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(timeout, read=read_timeout)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.client = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            # Release assets redirect to a CDN; httpx drops Authorization on cross-origin redirects
+            follow_redirects=True,
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url, headers=None):
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                response = await self.client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                self._record("get", start, type(e).__name__)
+                raise
+            self._record("get", start, response.status_code)
+            return response
+
+    @asynccontextmanager
+    async def stream(self, url, headers=None):
+        async with self._semaphore:
+            start = time.perf_counter()
+            response = None
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    self._record("stream", start, response.status_code)
+                    yield response
+            except httpx.HTTPError as e:
+                # Errors while reading the body were already counted by their status
+                if response is None:
+                    self._record("stream", start, type(e).__name__)
+                raise
+
+    def _record(self, kind, start, status):
+        UPSTREAM_DURATION.observe(time.perf_counter() - start, kind=kind)
+        UPSTREAM_RESPONSES.inc(kind=kind, status=str(status))
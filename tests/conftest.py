@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The server imports its modules as siblings and the updaters import client.*, so
+# both directories go on the path. server.py creates its stores at import time,
+# point them at a scratch directory before any test imports it.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "server"))
+os.environ["ARTIFACT_STORE_DIR"] = tempfile.mkdtemp(prefix="artifact-store-")
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import os
+import time
+import pytest
+from artifact_store import ArtifactIntegrityError, ArtifactStore
+from file_lock import FileLock
+
+def blob(name, size=100):
+    data = (name * size)[:size]
+    return data, hashlib.sha256(data).hexdigest()
+
+def fetcher(data, calls):
+    async def fetch_chunks():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        for start in range(0, len(data), 30):
+            yield data[start:start + 30]
+    return fetch_chunks
+
+def test_concurrent_fills_download_once(tmp_path):
+    store = ArtifactStore(str(tmp_path), 1024 ** 2)
+    data, sha256 = blob(b"a")
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(*(store.fill(sha256, fetcher(data, calls)) for _ in range(10)))
+
+    paths = asyncio.run(scenario())
+    assert set(paths) == {store.path_for(sha256)}
+    assert calls == [1]
+    with open(paths[0], "rb") as file:
+        assert file.read() == data
+    assert store.get(sha256) == paths[0]
+
+def test_corrupt_download_is_not_stored(tmp_path):
+    store = ArtifactStore(str(tmp_path), 1024 ** 2)
+    _, sha256 = blob(b"a")
+
+    with pytest.raises(ArtifactIntegrityError):
+        asyncio.run(store.fill(sha256, fetcher(b"tampered", [])))
+    assert store.get(sha256) is None
+    assert os.listdir(store.tmp_dir) == []
+
+def test_least_recently_used_objects_are_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path), 250)
+    (a, a_sha256), (b, b_sha256), (c, c_sha256) = blob(b"a"), blob(b"b"), blob(b"c")
+    asyncio.run(store.fill(a_sha256, fetcher(a, [])))
+    asyncio.run(store.fill(b_sha256, fetcher(b, [])))
+    now = time.time()
+    os.utime(store.path_for(a_sha256), (now - 100, now - 100))
+    os.utime(store.path_for(b_sha256), (now - 50, now - 50))
+
+    # Serving an object makes it the most recently used
+    store.get(a_sha256)
+    asyncio.run(store.fill(c_sha256, fetcher(c, [])))
+
+    assert store.digests() == {a_sha256, c_sha256}
+    assert store.stats["evictions"] == 1
+
+def test_fill_waits_for_another_worker_storing_the_object(tmp_path):
+    store = ArtifactStore(str(tmp_path), 1024 ** 2)
+    data, sha256 = blob(b"a")
+    calls = []
+    # Held by "another worker" that is downloading the same artifact
+    other_worker = FileLock(os.path.join(store.locks_dir, f"{sha256}.lock"))
+    other_worker.acquire()
+
+    async def scenario():
+        fill = asyncio.create_task(store.fill(sha256, fetcher(data, calls)))
+        await asyncio.sleep(0.1)
+        os.makedirs(os.path.dirname(store.path_for(sha256)), exist_ok=True)
+        with open(store.path_for(sha256), "wb") as file:
+            file.write(data)
+        other_worker.release()
+        return await fill
+
+    assert asyncio.run(scenario()) == store.path_for(sha256)
+    assert calls == []
@@ -0,0 +1,78 @@
+import asyncio
+from collections import Counter
+import httpx
+import pytest
+import server
+
+SHA256 = "ab" * 32
+BLAKE2B = "cd" * 64
+RELEASE = {
+    "tag_name": "v2.0.0",
+    "assets": [
+        {"name": "app-linux.zip", "size": 1000, "url": "https://upstream/zip"},
+        {"name": "app-linux.zip.sha256", "url": "https://upstream/sha256"},
+        {"name": "app-linux.zip.blake2b", "url": "https://upstream/blake2b"},
+    ],
+}
+DIGESTS = {"https://upstream/sha256": SHA256, "https://upstream/blake2b": BLAKE2B}
+
+class SlowUpstream:
+    # Counts fetches per URL and answers slowly, so concurrent requests overlap
+    def __init__(self):
+        self.calls = Counter()
+
+    async def get(self, url, headers=None):
+        self.calls[url] += 1
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=f"{DIGESTS[url]}  app-linux.zip\n".encode())
+
+@pytest.fixture
+def fake_upstream(monkeypatch, tmp_path):
+    async def get_latest_release():
+        return RELEASE
+
+    fake = SlowUpstream()
+    monkeypatch.setattr(server, "upstream", fake)
+    monkeypatch.setattr(server, "get_latest_release", get_latest_release)
+    monkeypatch.setattr(server, "checksum_cache", {})
+    monkeypatch.setattr(server, "checksum_locks", {})
+    monkeypatch.setattr(server, "CHECKSUM_DIR", str(tmp_path))
+    return fake
+
+async def fetch_concurrently(requests):
+    transport = httpx.ASGITransport(app=server.api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(client.request(method, url, **kwargs) for method, url, kwargs in requests))
+
+def test_concurrent_update_checks_fetch_each_checksum_once(fake_upstream):
+    # /check-version never needs digests; /get-update and /negotiate do
+    requests = [("GET", "/get-update", {"params": {"os_version": "linux"}})] * 10
+    requests += [("POST", "/negotiate", {"json": {"os_version": "linux", "current_version": "v1.0.0"}})] * 10
+    responses = asyncio.run(fetch_concurrently(requests))
+
+    assert [response.status_code for response in responses] == [200] * 20
+    assert fake_upstream.calls == {"https://upstream/sha256": 1, "https://upstream/blake2b": 1}
+    assert responses[0].json()["digests"] == {"sha256": SHA256, "blake2b": BLAKE2B}
+    assert server.checksum_locks == {}
+
+def test_failed_checksum_fetch_is_retried(fake_upstream):
+    async def failing_get(url, headers=None):
+        return httpx.Response(502)
+
+    fake_upstream.get, working_get = failing_get, fake_upstream.get
+    responses = asyncio.run(fetch_concurrently([("GET", "/get-update", {"params": {"os_version": "linux"}})] * 3))
+    assert [response.status_code for response in responses] == [502] * 3
+
+    fake_upstream.get = working_get
+    responses = asyncio.run(fetch_concurrently([("GET", "/get-update", {"params": {"os_version": "linux"}})]))
+    assert responses[0].status_code == 200
+    assert fake_upstream.calls["https://upstream/sha256"] == 1
+
+def test_checksums_are_shared_with_other_workers(fake_upstream, monkeypatch):
+    asyncio.run(fetch_concurrently([("GET", "/get-update", {"params": {"os_version": "linux"}})]))
+    # Another worker starts with an empty cache
+    monkeypatch.setattr(server, "checksum_cache", {})
+    responses = asyncio.run(fetch_concurrently([("GET", "/get-update", {"params": {"os_version": "linux"}})]))
+
+    assert responses[0].json()["digests"] == {"sha256": SHA256, "blake2b": BLAKE2B}
+    assert fake_upstream.calls == {"https://upstream/sha256": 1, "https://upstream/blake2b": 1}
@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import random
+import struct
+import pytest
+from delta import DELTA_MAGIC, DeltaCache, build_delta
+from client.update_common import apply_delta
+
+def random_bytes(seed, size):
+    return random.Random(seed).randbytes(size)
+
+def round_trip(tmp_path, base, target):
+    base_path = tmp_path / "base.zip"
+    target_path = tmp_path / "target.zip"
+    delta_path = tmp_path / "patch.delta"
+    out_path = tmp_path / "rebuilt.zip"
+    base_path.write_bytes(base)
+    target_path.write_bytes(target)
+    with open(delta_path, "wb") as out_file:
+        build_delta(base_path, target_path, out_file)
+
+    digest = apply_delta(base_path, delta_path, out_path)
+    assert out_path.read_bytes() == target
+    assert digest == hashlib.sha256(target).hexdigest()
+    return delta_path.stat().st_size
+
+BASE = random_bytes(0, 512 * 1024)
+
+@pytest.mark.parametrize("target", [
+    BASE,
+    BASE[:100_000] + random_bytes(1, 4096) + BASE[100_000:],  # insertion
+    BASE[:200_000] + BASE[260_000:],  # deletion
+    BASE[:300_000] + random_bytes(2, 1000) + BASE[301_000:],  # overwrite
+    BASE[256 * 1024:] + BASE[:256 * 1024],  # moved blocks
+    random_bytes(3, 64 * 1024) + BASE + random_bytes(4, 64 * 1024),  # new head and tail
+], ids=["identical", "insertion", "deletion", "overwrite", "moved", "head-and-tail"])
+def test_round_trip_reuses_the_base(tmp_path, target):
+    delta_size = round_trip(tmp_path, BASE, target)
+    new_bytes = max(len(target) - len(BASE), 4096)
+    assert delta_size < new_bytes + 64 * 1024
+
+@pytest.mark.parametrize("base, target", [
+    (BASE, random_bytes(5, 300_000)),
+    (BASE, b""),
+    (b"", BASE),
+    (b"x", b"y"),
+], ids=["unrelated", "empty-target", "empty-base", "tiny"])
+def test_round_trip_without_shared_content(tmp_path, base, target):
+    round_trip(tmp_path, base, target)
+
+def test_apply_rejects_a_file_that_is_not_a_delta(tmp_path):
+    (tmp_path / "base.zip").write_bytes(BASE)
+    (tmp_path / "patch.delta").write_bytes(b"PK\x03\x04 not a patch")
+    with pytest.raises(ValueError):
+        apply_delta(tmp_path / "base.zip", tmp_path / "patch.delta", tmp_path / "out.zip")
+
+def test_apply_rejects_copies_past_the_end_of_the_base(tmp_path):
+    (tmp_path / "base.zip").write_bytes(b"short base")
+    (tmp_path / "patch.delta").write_bytes(DELTA_MAGIC + b"C" + struct.pack(">QI", 4, 100))
+    with pytest.raises(ValueError):
+        apply_delta(tmp_path / "base.zip", tmp_path / "patch.delta", tmp_path / "out.zip")
+
+def test_failed_pairs_expire_and_are_bounded(tmp_path):
+    cache = DeltaCache(str(tmp_path), 1024 ** 2, retry_interval=0.2, max_failed=2)
+    attempts = []
+
+    async def unresolvable():
+        attempts.append(1)
+        raise ValueError("no base")
+
+    async def build(base_sha256):
+        cache.build_async(base_sha256, "ff" * 32, unresolvable)
+        await asyncio.gather(*cache._tasks)
+
+    async def scenario():
+        await build("aa" * 32)
+        await build("aa" * 32)
+        assert len(attempts) == 1
+        # Bases are client-supplied, only the latest failures are remembered
+        await build("bb" * 32)
+        await build("cc" * 32)
+        assert len(cache._failed) == 2
+        await asyncio.sleep(0.2)
+        await build("bb" * 32)
+        assert len(attempts) == 4
+
+    asyncio.run(scenario())
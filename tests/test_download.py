@@ -0,0 +1,47 @@
+import pytest
+import requests
+from client import update_common
+
+SHA256 = "ab" * 32
+
+class FakeResponse:
+    # What requests.get(..., stream=True) returns, for a response without a body
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+@pytest.fixture
+def answers(monkeypatch, tmp_path):
+    # Status codes the server answers with, one per request
+    answers = []
+    sleeps = []
+    monkeypatch.setattr(update_common, "DOWNLOAD_PATH", str(tmp_path / "update.zip"))
+    monkeypatch.setattr(update_common.requests, "get", lambda url, **kwargs: FakeResponse(*answers.pop(0)))
+    monkeypatch.setattr(update_common.time, "sleep", sleeps.append)
+    return answers, sleeps
+
+@pytest.mark.parametrize("status", [400, 403, 404, 416])
+def test_client_errors_fail_without_retrying(answers, status):
+    pending, sleeps = answers
+    pending.append((status,))
+    with pytest.raises(requests.exceptions.HTTPError):
+        update_common.download_file("http://server/download", SHA256, 100)
+    assert sleeps == []
+
+def test_shed_load_is_retried_after_retry_after(answers):
+    pending, sleeps = answers
+    pending += [(503, {"Retry-After": "2"}), (502,), (404,)]
+    with pytest.raises(requests.exceptions.HTTPError):
+        update_common.download_file("http://server/download", SHA256, 100)
+    assert pending == []
+    assert len(sleeps) == 2
+    assert 2 <= sleeps[0] <= 3
@@ -0,0 +1,69 @@
+import os
+import stat
+import zipfile
+import pytest
+from client.extract import PREVIOUS_SUFFIX, VERSION_MARKER, install_zip, recover, rollback
+
+def make_zip(path, files, symlinks=()):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, (data, mode) in files.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            zip_ref.writestr(info, data)
+        for name, target in symlinks:
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFLNK | 0o777) << 16
+            zip_ref.writestr(info, target)
+    return str(path)
+
+def install(tmp_path, version):
+    files = {"dist/client/client": (version.encode() * 1000, 0o755), "dist/client/data.txt": (b"data", 0o644)}
+    install_zip(make_zip(tmp_path / f"{version}.zip", files), str(tmp_path / "app"), version)
+
+def test_install_extracts_files_with_their_permissions(tmp_path):
+    zip_path = make_zip(tmp_path / "v1.zip", {
+        "dist/client/client": (b"binary" * 100000, 0o755),
+        "dist/client/lib/data.txt": (b"data", 0o644),
+    }, symlinks=[("dist/client/current", "client")])
+    install_zip(zip_path, str(tmp_path / "app"), "v1")
+
+    app = tmp_path / "app"
+    assert (app / "dist/client/client").read_bytes() == b"binary" * 100000
+    assert (app / "dist/client/lib/data.txt").read_bytes() == b"data"
+    assert (app / VERSION_MARKER).read_text() == "v1"
+    if os.name == "posix":
+        assert stat.S_IMODE((app / "dist/client/client").stat().st_mode) == 0o755
+        assert stat.S_IMODE((app / "dist/client/lib/data.txt").stat().st_mode) == 0o644
+        assert os.readlink(app / "dist/client/current") == "client"
+
+def test_members_outside_the_install_are_refused(tmp_path):
+    zip_path = make_zip(tmp_path / "evil.zip", {"../evil": (b"x", 0o644)})
+    with pytest.raises(ValueError):
+        install_zip(zip_path, str(tmp_path / "app"), "v1")
+    assert not (tmp_path / "evil").exists()
+    assert sorted(os.listdir(tmp_path)) == ["evil.zip"]
+
+def test_swap_keeps_the_previous_install_for_rollback(tmp_path):
+    install(tmp_path, "v1")
+    install(tmp_path, "v2")
+    app = tmp_path / "app"
+    assert (app / VERSION_MARKER).read_text() == "v2"
+    assert (tmp_path / ("app" + PREVIOUS_SUFFIX) / VERSION_MARKER).read_text() == "v1"
+
+    assert rollback(str(app)) == "v1"
+    assert (app / VERSION_MARKER).read_text() == "v1"
+    assert sorted(os.listdir(tmp_path)) == ["app", "v1.zip", "v2.zip"]
+    with pytest.raises(FileNotFoundError):
+        rollback(str(app))
+
+def test_recover_finishes_an_interrupted_swap(tmp_path):
+    install(tmp_path, "v1")
+    app = tmp_path / "app"
+    # Interrupted after the install was moved aside, before the new one was moved in
+    os.rename(app, str(app) + PREVIOUS_SUFFIX)
+
+    recover(str(app))
+    assert (app / VERSION_MARKER).read_text() == "v1"
+    # Nothing to do once the install is in place
+    recover(str(app))
+    assert (app / VERSION_MARKER).read_text() == "v1"
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import time
+from client.handover import HANDOVER_ADDRESS_ENV, hand_over, receive_handover
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The new version: takes over the session, records it and confirms, hangs or crashes
+NEW_VERSION = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT_DIR!r})
+from client.handover import confirm_handover, receive_handover
+state, connection = receive_handover()
+with open(sys.argv[1], 'w') as file:
+    json.dump(state, file)
+if sys.argv[2] == "confirm":
+    confirm_handover(connection)
+elif sys.argv[2] == "hang":
+    time.sleep(60)
+else:
+    sys.exit(3)
+"""
+
+STATE = {"current_seconds": 1234, "started": True, "mode": "work"}
+
+def new_version(tmp_path, behaviour):
+    return [sys.executable, "-c", NEW_VERSION, str(tmp_path / "received.json"), behaviour]
+
+def test_session_is_handed_to_the_new_version(tmp_path):
+    assert hand_over(STATE, new_version(tmp_path, "confirm"))
+    assert json.loads((tmp_path / "received.json").read_text()) == STATE
+
+def test_new_version_that_never_confirms_is_stopped(tmp_path):
+    started = time.monotonic()
+    assert not hand_over(STATE, new_version(tmp_path, "hang"), timeout=3)
+    assert time.monotonic() - started < 10
+
+def test_new_version_that_exits_is_reported(tmp_path):
+    assert not hand_over(STATE, new_version(tmp_path, "exit"))
+    assert json.loads((tmp_path / "received.json").read_text()) == STATE
+
+def test_normal_start_has_nothing_to_receive(monkeypatch):
+    monkeypatch.delenv(HANDOVER_ADDRESS_ENV, raising=False)
+    assert receive_handover() == (None, None)
@@ -0,0 +1,82 @@
+import os
+import sys
+from client.extract import VERSION_MARKER, install_version, read_current_install, remove_stale_installs, select_install
+from client.handover import CURRENT_INSTALL_NAME, VERSIONS_DIR_NAME, current_install_command
+
+def make_install(install_dir, version):
+    # The onedir layout of a release zip: dist/client/client plus the bundled files
+    os.makedirs(os.path.join(install_dir, "dist", "client"))
+    executable = os.path.join(install_dir, "dist", "client", "client.exe" if os.name == "nt" else "client")
+    with open(executable, "w") as file:
+        file.write(version)
+    return executable
+
+def test_install_version_leaves_the_running_install_alone(tmp_path):
+    running = tmp_path / "app"
+    make_install(running, "v1")
+    staging = tmp_path / VERSIONS_DIR_NAME / ".staging-1"
+    make_install(staging, "v2")
+    install_dir = tmp_path / VERSIONS_DIR_NAME / "v2"
+
+    install_version(str(staging), str(install_dir), "v2")
+
+    assert (install_dir / VERSION_MARKER).read_text() == "v2"
+    assert not staging.exists()
+    assert sorted(os.listdir(running)) == ["dist"]
+
+def test_install_version_replaces_a_failed_attempt(tmp_path):
+    install_dir = tmp_path / "v2"
+    make_install(install_dir, "broken")
+    staging = tmp_path / ".staging-1"
+    make_install(staging, "v2")
+
+    install_version(str(staging), str(install_dir), "v2")
+    assert (install_dir / "dist" / "client").exists()
+    assert (install_dir / VERSION_MARKER).read_text() == "v2"
+
+def test_select_install_round_trips_relative_to_the_pointer(tmp_path):
+    pointer = tmp_path / CURRENT_INSTALL_NAME
+    assert read_current_install(str(pointer)) is None
+
+    install_dir = tmp_path / VERSIONS_DIR_NAME / "v2"
+    install_dir.mkdir(parents=True)
+    select_install(str(pointer), str(install_dir))
+
+    assert pointer.read_text() == os.path.join(VERSIONS_DIR_NAME, "v2")
+    assert read_current_install(str(pointer)) == str(install_dir)
+    install_dir.rmdir()
+    assert read_current_install(str(pointer)) is None
+
+def test_remove_stale_installs_keeps_running_current_and_staging(tmp_path):
+    versions_dir = tmp_path / VERSIONS_DIR_NAME
+    for name in ("v1", "v2", "v3", ".staging-abc"):
+        (versions_dir / name).mkdir(parents=True)
+
+    remove_stale_installs(str(versions_dir), [str(versions_dir / "v2"), str(versions_dir / "v3"), None])
+    assert sorted(os.listdir(versions_dir)) == [".staging-abc", "v2", "v3"]
+    remove_stale_installs(str(tmp_path / "missing"), [])
+
+def test_current_install_command_starts_the_selected_install(tmp_path, monkeypatch):
+    original = make_install(tmp_path / "app", "v1")
+    current = make_install(tmp_path / VERSIONS_DIR_NAME / "v2", "v2")
+    monkeypatch.setattr(sys, "frozen", True, raising=False)
+    monkeypatch.setattr(sys, "argv", [original, "--flag"])
+
+    monkeypatch.setattr(sys, "executable", original)
+    assert current_install_command() is None
+    select_install(str(tmp_path / CURRENT_INSTALL_NAME), str(tmp_path / VERSIONS_DIR_NAME / "v2"))
+    assert current_install_command() == [current, "--flag"]
+
+    # The current install doesn't start itself again
+    monkeypatch.setattr(sys, "executable", current)
+    assert current_install_command() is None
+
+def test_current_install_command_ignores_missing_installs_and_source_runs(tmp_path, monkeypatch):
+    original = make_install(tmp_path / "app", "v1")
+    (tmp_path / CURRENT_INSTALL_NAME).write_text(os.path.join(VERSIONS_DIR_NAME, "gone"))
+    monkeypatch.setattr(sys, "executable", original)
+
+    monkeypatch.setattr(sys, "frozen", True, raising=False)
+    assert current_install_command() is None
+    monkeypatch.delattr(sys, "frozen")
+    assert current_install_command() is None
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import os
+import random
+import stat
+import zipfile
+import chunking
+import updater
+from client import chunking as client_chunking
+from manifest import ChunkStore, ManifestCache
+
+def random_bytes(seed, size):
+    return random.Random(seed).randbytes(size)
+
+OLD = random_bytes(0, 300 * 1024)
+# An insertion near the start, the chunks after it stay the same
+NEW = OLD[:20_000] + random_bytes(1, 5000) + OLD[20_000:]
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as zip_ref:
+        for name, data in files.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFREG | 0o755) << 16
+            zip_ref.writestr(info, data)
+    return str(path)
+
+def build(tmp_path, files):
+    chunk_store = ChunkStore(str(tmp_path / "chunks"))
+    cache = ManifestCache(str(tmp_path / "manifests"), chunk_store)
+    zip_path = make_zip(tmp_path / "app.zip", files)
+    sha256 = hashlib.sha256((tmp_path / "app.zip").read_bytes()).hexdigest()
+    return cache, asyncio.run(cache.get(sha256, zip_path)), sha256
+
+def read_chunk(cache, sha256):
+    with open(cache.chunk_store.get(sha256), "rb") as file:
+        return file.read()
+
+def test_client_and_server_chunk_alike():
+    assert list(client_chunking.chunk_boundaries(NEW)) == list(chunking.chunk_boundaries(NEW))
+
+def test_manifest_describes_every_file_with_stored_chunks(tmp_path):
+    cache, manifest, _ = build(tmp_path, {"dist/client/client": NEW, "dist/client/copy": NEW})
+    assert [entry["path"] for entry in manifest["files"]] == ["dist/client/client", "dist/client/copy"]
+
+    entry = manifest["files"][0]
+    assert entry["sha256"] == hashlib.sha256(NEW).hexdigest()
+    assert entry["mode"] == 0o755
+    rebuilt = b"".join(read_chunk(cache, sha256) for sha256, _ in entry["chunks"])
+    assert rebuilt == NEW
+    # Identical content is stored once
+    assert manifest["files"][1]["chunks"] == entry["chunks"]
+
+def test_manifest_is_loaded_from_disk_after_a_restart(tmp_path, monkeypatch):
+    cache, manifest, sha256 = build(tmp_path, {"dist/client/client": NEW})
+    restarted = ManifestCache(cache.root, cache.chunk_store)
+    monkeypatch.setattr("manifest.build_manifest", lambda zip_path, chunk_store: None)
+    assert asyncio.run(restarted.get(sha256, str(tmp_path / "app.zip"))) == manifest
+
+def test_prune_drops_manifests_and_chunks_of_evicted_artifacts(tmp_path):
+    cache, manifest, sha256 = build(tmp_path, {"dist/client/client": NEW})
+    assert cache.prune({sha256}) == {sha256 for sha256, _ in manifest["files"][0]["chunks"]}
+    assert cache.prune(set()) == set()
+    assert not os.path.exists(cache.path_for(sha256))
+    # Chunks are only removed once they are past the grace period
+    assert cache.chunk_store.prune(set()) == 0
+    assert cache.chunk_store.prune(set(), grace=-1) == len(manifest["files"][0]["chunks"])
+
+def test_update_is_rebuilt_from_installed_and_fetched_chunks(tmp_path, monkeypatch):
+    install_dir = tmp_path / "app"
+    (install_dir / "dist" / "client").mkdir(parents=True)
+    (install_dir / "dist" / "client" / "client").write_bytes(OLD)
+    monkeypatch.setattr(updater, "EXTRACTED_DIR", str(install_dir))
+    monkeypatch.setattr(updater, "CHUNK_INDEX_PATH", str(tmp_path / "chunk_index.json"))
+    monkeypatch.setattr(updater, "CHUNK_CACHE_DIR", str(tmp_path / "chunk-cache"))
+
+    cache, manifest, _ = build(tmp_path, {"dist/client/client": NEW})
+    local_chunks = updater.index_installed_chunks()
+    missing = [sha256 for sha256, _ in manifest["files"][0]["chunks"] if sha256 not in local_chunks]
+    # Only the chunks around the insertion have to be fetched
+    assert 0 < len(missing) <= 3
+    os.makedirs(updater.CHUNK_CACHE_DIR)
+    for sha256 in missing:
+        with open(os.path.join(updater.CHUNK_CACHE_DIR, sha256), "wb") as file:
+            file.write(read_chunk(cache, sha256))
+
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    updater.rebuild_from_chunks(manifest, local_chunks, str(staging_dir))
+    assert (staging_dir / "dist" / "client" / "client").read_bytes() == NEW
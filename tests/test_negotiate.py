@@ -0,0 +1,76 @@
+import json
+import pytest
+import requests
+from fastapi.testclient import TestClient
+import server
+from client import update_common
+
+SHA256 = "ab" * 32
+RELEASE = {
+    "tag_name": "v2.0.0",
+    "assets": [
+        {"name": "app-linux.zip", "size": 1000, "url": "https://upstream/zip"},
+        {"name": "app-linux.zip.sha256", "url": "https://upstream/sha256"},
+    ],
+}
+QUERY = {"os_version": "linux", "current_version": "v1.0.0", "client_id": "client-1", "capabilities": ["delta"]}
+
+@pytest.fixture
+def client(monkeypatch):
+    async def get_latest_release():
+        return RELEASE
+
+    monkeypatch.setattr(server, "get_latest_release", get_latest_release)
+    monkeypatch.setattr(server, "checksum_cache", {"https://upstream/sha256": SHA256})
+    # Everyone is in the rollout
+    monkeypatch.setattr(server.rollout, "is_eligible", lambda client_id, release: True)
+    return TestClient(server.api)
+
+def test_get_negotiate_is_cacheable_and_conditional(client):
+    response = client.get("/negotiate", params=QUERY)
+    assert response.status_code == 200
+    assert response.json()["delivery"] == "full"
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    etag = response.headers["ETag"]
+
+    revalidated = client.get("/negotiate", params=QUERY, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["ETag"] == etag
+    assert revalidated.headers["Retry-After"].isdigit()
+
+    # A different decision gets a different validator
+    updated = client.get("/negotiate", params={**QUERY, "current_version": "v2.0.0"}, headers={"If-None-Match": etag})
+    assert updated.status_code == 200
+    assert updated.json()["delivery"] == "none"
+
+def test_post_negotiate_answers_like_get(client):
+    etag = client.get("/negotiate", params=QUERY).headers["ETag"]
+    response = client.post("/negotiate", json=QUERY, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_updaters_keep_the_validator_across_restarts(client, monkeypatch, tmp_path):
+    cache_path = tmp_path / "negotiation.json"
+    exchanges = []
+
+    def get(url, params=None, headers=None, timeout=None):
+        # Served by the app, answered the way requests would
+        answer = client.get("/negotiate", params=params, headers=headers)
+        exchanges.append((headers, answer.status_code))
+        response = requests.Response()
+        response.status_code = answer.status_code
+        response.headers.update(answer.headers)
+        response._content = answer.content
+        return response
+
+    monkeypatch.setattr(update_common.requests, "get", get)
+    monkeypatch.setattr(update_common, "NEGOTIATION_CACHE_PATH", str(cache_path))
+    monkeypatch.setattr(update_common, "negotiation_payload", lambda deliveries: QUERY)
+
+    first = update_common.negotiate("/negotiate", ["delta"], 5)
+    # The next poll, possibly from a new process, only has what is on disk
+    second = update_common.negotiate("/negotiate", ["delta"], 5)
+
+    etag = json.loads(cache_path.read_text())["etag"]
+    assert exchanges == [({}, 200), ({"If-None-Match": etag}, 304)]
+    assert {**second, "retry_after": first["retry_after"]} == first
@@ -0,0 +1,42 @@
+import pytest
+from fastapi import HTTPException
+from server import parse_range
+
+SIZE = 1000
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes=-100", (900, 999)),  # suffix: the last 100 bytes
+    ("bytes=-5000", (0, 999)),  # suffix longer than the body
+    (" bytes = 0-9", (0, 9)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+@pytest.mark.parametrize("header", [
+    "bytes=1000-",  # starts at the end
+    "bytes=5000-6000",
+    "bytes=500-100",  # end before start
+    "bytes=-0",  # empty suffix
+])
+def test_unsatisfiable_ranges_are_416(header):
+    with pytest.raises(HTTPException) as excinfo:
+        parse_range(header, SIZE)
+    assert excinfo.value.status_code == 416
+    assert excinfo.value.headers["Content-Range"] == f"bytes */{SIZE}"
+
+@pytest.mark.parametrize("header", [
+    "items=0-9",  # other unit
+    "bytes=0-9,20-29",  # multiple ranges aren't supported, the full body is sent
+    "bytes=abc-",
+    "bytes=0-x",
+    "bytes=-x",
+    "bytes=-",
+    "bytes=",
+    "",
+])
+def test_invalid_ranges_are_ignored(header):
+    assert parse_range(header, SIZE) is None
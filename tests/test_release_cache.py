@@ -0,0 +1,111 @@
+import asyncio
+import httpx
+import pytest
+from release_cache import ReleaseCache, UpstreamError
+
+URL = "https://api.github.com/repos/owner/app/releases/latest"
+
+class FakeGitHub:
+    # Answers like the releases API: the current release with an ETag, 304 when it matches
+    def __init__(self, tag="v1.0.0"):
+        self.tag = tag
+        self.requests = []
+        self.status_code = None
+
+    async def get(self, url, headers=None):
+        self.requests.append(dict(headers or {}))
+        await asyncio.sleep(0.01)
+        if self.status_code is not None:
+            return httpx.Response(self.status_code)
+        etag = f'"{self.tag}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json={"tag_name": self.tag}, headers={"ETag": etag})
+
+def test_concurrent_cold_misses_share_one_fetch():
+    github = FakeGitHub()
+    cache = ReleaseCache(URL, github)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get() for _ in range(20)))
+
+    releases = asyncio.run(scenario())
+    assert [release["tag_name"] for release in releases] == ["v1.0.0"] * 20
+    assert len(github.requests) == 1
+    assert cache.stats["misses"] == 20
+
+def test_stale_release_is_served_while_one_refresh_runs():
+    github = FakeGitHub()
+    cache = ReleaseCache(URL, github, ttl=0.05)
+
+    async def scenario():
+        await cache.get()
+        await asyncio.sleep(0.05)
+        github.tag = "v2.0.0"
+        # Stale hits answer right away with what is cached and start a single refresh
+        stale = await asyncio.gather(*(cache.get() for _ in range(5)))
+        await cache._refresh_task
+        return stale, await cache.get()
+
+    stale, fresh = asyncio.run(scenario())
+    assert [release["tag_name"] for release in stale] == ["v1.0.0"] * 5
+    assert fresh["tag_name"] == "v2.0.0"
+    assert len(github.requests) == 2
+
+def test_unchanged_release_is_revalidated_with_its_etag():
+    github = FakeGitHub()
+    cache = ReleaseCache(URL, github, ttl=0)
+
+    async def scenario():
+        first = await cache.get()
+        return first, await cache.refresh()
+
+    first, revalidated = asyncio.run(scenario())
+    assert revalidated is first
+    assert github.requests == [{}, {"If-None-Match": '"v1.0.0"'}]
+    assert cache.stats["not_modified"] == 1
+
+def test_failed_refresh_keeps_serving_the_stale_release():
+    github = FakeGitHub()
+    cache = ReleaseCache(URL, github, ttl=0)
+
+    async def scenario():
+        await cache.get()
+        github.status_code = 502
+        with pytest.raises(UpstreamError):
+            await cache.refresh()
+        return await cache.get()
+
+    assert asyncio.run(scenario())["tag_name"] == "v1.0.0"
+
+def test_workers_share_one_fetch_per_ttl(tmp_path):
+    github = FakeGitHub()
+    shared_path = str(tmp_path / "release.json")
+    first_worker = ReleaseCache(URL, github, ttl=60, shared_path=shared_path)
+    second_worker = ReleaseCache(URL, github, ttl=60, shared_path=shared_path)
+
+    async def scenario():
+        await first_worker.get()
+        return await second_worker.get()
+
+    assert asyncio.run(scenario())["tag_name"] == "v1.0.0"
+    assert len(github.requests) == 1
+    assert second_worker.stats["shared_loads"] == 1
+
+def test_workers_adopt_a_release_another_worker_stored(tmp_path):
+    github = FakeGitHub()
+    shared_path = str(tmp_path / "release.json")
+    first_worker = ReleaseCache(URL, github, shared_path=shared_path)
+    second_worker = ReleaseCache(URL, github, shared_path=shared_path)
+
+    async def scenario():
+        await first_worker.get()
+        await second_worker.get()
+        # A webhook reached the first worker
+        github.tag = "v2.0.0"
+        await first_worker.refresh()
+        assert second_worker.sync_shared()
+        return await second_worker.get()
+
+    assert asyncio.run(scenario())["tag_name"] == "v2.0.0"
+    assert len(github.requests) == 2
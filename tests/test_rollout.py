@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+from admission import AdmissionLimiter
+from rollout import RolloutPolicy
+
+CLIENT_IDS = [f"client-{index}" for index in range(2000)]
+
+def published(hours_ago):
+    return (datetime.now(timezone.utc) - timedelta(hours=hours_ago)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def test_buckets_are_stable_and_spread_evenly():
+    policy = RolloutPolicy()
+    buckets = [policy.bucket(client_id, "v2.0.0") for client_id in CLIENT_IDS]
+    assert buckets == [policy.bucket(client_id, "v2.0.0") for client_id in CLIENT_IDS]
+    assert all(0 <= bucket < 100 for bucket in buckets)
+    assert 0.45 < sum(bucket < 50 for bucket in buckets) / len(buckets) < 0.55
+    # Every release picks its own early clients
+    assert buckets != [policy.bucket(client_id, "v3.0.0") for client_id in CLIENT_IDS]
+
+def test_share_of_eligible_clients_follows_the_ramp():
+    policy = RolloutPolicy(percent=50, ramp_seconds=10 * 3600)
+    for hours_ago, share in [(0, 0), (5, 0.25), (20, 0.5)]:
+        release = {"tag_name": "v2.0.0", "published_at": published(hours_ago)}
+        eligible = sum(policy.is_eligible(client_id, release) for client_id in CLIENT_IDS) / len(CLIENT_IDS)
+        assert abs(eligible - share) < 0.05
+
+def test_clients_without_an_id_always_get_the_release():
+    policy = RolloutPolicy(percent=0)
+    assert policy.is_eligible(None, {"tag_name": "v2.0.0"})
+
+def test_poll_hint_is_jittered_and_short_for_clients_about_to_join():
+    policy = RolloutPolicy(percent=100, ramp_seconds=3600, poll_interval=3600)
+    release = {"tag_name": "v2.0.0", "published_at": published(0)}
+    hints = {policy.poll_hint(None, release) for _ in range(50)}
+    assert len(hints) > 1
+    assert all(2880 <= hint <= 4320 for hint in hints)
+
+    waiting = [client_id for client_id in CLIENT_IDS if not policy.is_eligible(client_id, release)]
+    soon = min(waiting, key=lambda client_id: policy.bucket(client_id, "v2.0.0"))
+    # Its bucket opens within a minute or so of ramping
+    assert policy.poll_hint(soon, release) < 120
+
+def streaming_app():
+    # Streams its body in two parts, the limiter counts the request until the end of it
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"first", "more_body": True})
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.body", "body": b"last"})
+    return app
+
+def test_downloads_over_the_limit_get_503_with_retry_after():
+    limiter = AdmissionLimiter(streaming_app(), path_prefixes=["/download/"], max_concurrent=2, retry_after=30)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=limiter)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            downloads = await asyncio.gather(*(client.get("/download/v2.0.0/linux") for _ in range(5)))
+            # Anything else isn't limited
+            others = await asyncio.gather(*(client.get("/check-version") for _ in range(5)))
+            return downloads, others
+
+    downloads, others = asyncio.run(scenario())
+    assert sorted(response.status_code for response in downloads) == [200, 200, 503, 503, 503]
+    for response in downloads:
+        if response.status_code == 503:
+            assert 30 <= int(response.headers["Retry-After"]) <= 60
+    assert [response.status_code for response in others] == [200] * 5
+    assert limiter.active == 0
@@ -0,0 +1,82 @@
+import hashlib
+import hmac
+import pytest
+from fastapi.testclient import TestClient
+import server
+
+# Digests end up in store paths, anything but 64 hex digits must be turned away
+NOT_DIGESTS = [
+    "..",
+    "....",
+    "..%5C..%5Cwindows",
+    "not-a-digest",
+    "g" * 64,
+    "0" * 63,
+    "0" * 65,
+    "0" * 62 + "..",
+]
+DIGEST = "ab" * 32
+
+@pytest.fixture
+def client():
+    # Without `with`, so the lifespan (prefetching, GitHub) doesn't run
+    return TestClient(server.api)
+
+@pytest.mark.parametrize("base_sha256", NOT_DIGESTS)
+def test_negotiate_rejects_a_base_that_is_not_a_digest(client, base_sha256):
+    response = client.post("/negotiate", json={
+        "os_version": "linux",
+        "current_version": "v1.0.0",
+        "base_sha256": base_sha256,
+        "capabilities": ["delta"],
+    })
+    assert response.status_code == 422
+
+# ".." as a whole path segment is resolved by the client before the request is sent
+@pytest.mark.parametrize("bad", [value for value in NOT_DIGESTS if value != ".."])
+def test_delta_rejects_digests_that_are_not_hex(client, bad):
+    assert client.get(f"/delta/{bad}/{DIGEST}").status_code == 422
+    assert client.get(f"/delta/{DIGEST}/{bad}").status_code == 422
+
+def test_delta_accepts_upper_case_digests(client):
+    # Valid digests get past validation to the (empty) cache
+    assert client.get(f"/delta/{DIGEST.upper()}/{DIGEST}").status_code == 404
+
+@pytest.mark.parametrize("bad", ["../" + DIGEST, "0" * 63])
+def test_stores_refuse_paths_for_non_digests(bad):
+    with pytest.raises(ValueError):
+        server.artifact_store.path_for(bad)
+    with pytest.raises(ValueError):
+        server.delta_cache.path_for(bad, DIGEST)
+    with pytest.raises(ValueError):
+        server.delta_cache.path_for(DIGEST, bad)
+
+def test_delta_bases_are_only_resolved_from_known_releases(monkeypatch):
+    builds = []
+    monkeypatch.setattr(server.delta_cache, "build_async", lambda base, target, resolve_paths: builds.append(base))
+    monkeypatch.setattr(server, "recent_releases", {})
+
+    # A tag nobody has seen as latest is never looked up upstream
+    assert server.find_delta({}, "linux", "../latest", DIGEST, "cd" * 32, 1000) is None
+    assert builds == []
+
+    server.remember_release({"tag_name": "v1.0.0", "assets": []})
+    assert server.find_delta({}, "linux", "v1.0.0", DIGEST, "cd" * 32, 1000) is None
+    assert builds == [DIGEST]
+
+def test_recent_releases_are_bounded(monkeypatch):
+    monkeypatch.setattr(server, "recent_releases", {})
+    for minor in range(server.RECENT_RELEASES + 2):
+        server.remember_release({"tag_name": f"v1.{minor}.0"})
+    server.remember_release({"tag_name": "v1.1.0"})
+    assert len(server.recent_releases) == server.RECENT_RELEASES
+    assert list(server.recent_releases)[-1] == "v1.1.0"
+    assert "v1.0.0" not in server.recent_releases
+
+@pytest.mark.parametrize("body", [b"not json", b"\xff\xfe", b"[]", b'"published"', b"null"])
+def test_webhook_rejects_bodies_that_are_not_json_objects(client, monkeypatch, body):
+    monkeypatch.setattr(server, "GITHUB_WEBHOOK_SECRET", "secret")
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    response = client.post("/webhooks/github", content=body,
+                           headers={"X-GitHub-Event": "release", "X-Hub-Signature-256": signature})
+    assert response.status_code == 400
@@ -0,0 +1,65 @@
+import pytest
+from fastapi.testclient import TestClient
+import server
+import telemetry
+from client import telemetry as client_telemetry
+
+def test_client_and_server_share_buckets():
+    assert client_telemetry.TELEMETRY_BUCKETS_MS == telemetry.TELEMETRY_BUCKETS_MS
+
+def test_recorder_batches_frames_and_timings():
+    recorder = client_telemetry.TelemetryRecorder()
+    for milliseconds in (5, 16, 16, 40):
+        recorder.frame(milliseconds)
+    recorder.observe("download_ms", 1500)
+
+    batch = recorder.take()
+    assert sum(batch["frame_ms"]["counts"]) == 4
+    assert batch["frame_ms"]["sum"] == 77
+    assert batch["download_ms"]["counts"][client_telemetry.TELEMETRY_BUCKETS_MS.index(2500)] == 1
+    assert recorder.take() == {}
+
+    # A failed upload goes out with the next batch
+    recorder.restore(batch)
+    recorder.frame(16)
+    assert sum(recorder.take()["frame_ms"]["counts"]) == 5
+
+def test_ring_keeps_the_latest_frames_when_the_reader_falls_behind():
+    ring = client_telemetry.RingBuffer(4)
+    for value in range(10):
+        ring.append(value)
+    assert ring.drain() == [6, 7, 8, 9]
+    assert ring.drain() == []
+
+def test_store_bounds_the_version_label_set():
+    store = telemetry.TelemetryStore(max_versions=2)
+    counts = [1] + [0] * len(telemetry.TELEMETRY_BUCKETS_MS)
+    for version in ("v1", "v2", "v3", "v1 OR 1=1"):
+        store.ingest(version, "linux", {"frame_ms": (counts, 0.5)})
+    assert sorted(store.summary()) == ["invalid", "other", "v1", "v2"]
+
+@pytest.mark.parametrize("os_version, counts", [("plan9", [1] * 19), ("linux", [1] * 3), ("linux", [-1] + [0] * 18)])
+def test_store_rejects_malformed_batches(os_version, counts):
+    with pytest.raises(ValueError):
+        telemetry.TelemetryStore().ingest("v1", os_version, {"frame_ms": (counts, 1.0)})
+
+def test_reports_are_summarized_per_version_and_os(monkeypatch):
+    monkeypatch.setattr(server, "telemetry", telemetry.TelemetryStore())
+    client = TestClient(server.api)
+    recorder = client_telemetry.TelemetryRecorder()
+    for _ in range(99):
+        recorder.frame(10)
+    recorder.frame(400)
+    histograms = recorder.take()
+    # Metrics the server doesn't know yet are ignored
+    histograms["future_ms"] = histograms["frame_ms"]
+
+    response = client.post("/telemetry", json={"version": "v1.0.0", "os_version": "linux", "histograms": histograms})
+    assert response.status_code == 204
+    assert client.get("/api/telemetry").json() == {
+        "v1.0.0": {"linux": {"frame_ms": {"count": 100, "mean_ms": 13.9, "p50_ms": 16, "p95_ms": 16, "p99_ms": 16}}},
+    }
+
+    response = client.post("/telemetry", json={"version": "v1.0.0", "os_version": "linux",
+                                               "histograms": {"frame_ms": {"counts": [1], "sum": 1}}})
+    assert response.status_code == 422
@@ -0,0 +1,104 @@
+import hashlib
+import io
+import threading
+import pytest
+from client import update_common
+from client.update_common import DownloadPaused, Throttle
+
+class Clock:
+    # Stands in for time.monotonic and time.sleep, sleeping only advances it
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(update_common.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(update_common.time, "sleep", clock.sleep)
+    return clock
+
+def test_rate_is_capped(clock):
+    throttle = Throttle(bytes_per_second=100_000)
+    for _ in range(50):
+        throttle.consume(10_000)
+    assert clock.now == pytest.approx(5.0)
+
+def test_stalled_connection_builds_no_credit(clock):
+    throttle = Throttle(bytes_per_second=100_000)
+    throttle.consume(10_000)
+    clock.now += 30
+    throttle.consume(10_000)
+    # The stall reset the window, the next bytes are paced again instead of bursting
+    throttle.consume(100_000)
+    assert clock.slept > 1
+
+def test_uncapped_throttle_only_checks_for_a_pause():
+    stop = threading.Event()
+    throttle = Throttle(stop_event=stop)
+    assert throttle.block_size == update_common.DOWNLOAD_CHUNK_SIZE
+    throttle.consume(10 ** 9)
+    stop.set()
+    with pytest.raises(DownloadPaused):
+        throttle.consume(1)
+
+def test_pause_interrupts_the_wait():
+    stop = threading.Event()
+    throttle = Throttle(bytes_per_second=1000, stop_event=stop)
+    threading.Timer(0.05, stop.set).start()
+    # Would wait 100 seconds for the rate to catch up
+    with pytest.raises(DownloadPaused):
+        throttle.consume(100_000)
+
+def test_paused_download_resumes_from_its_partial_file(monkeypatch, tmp_path):
+    data = bytes(range(256)) * (3 * update_common.DOWNLOAD_CHUNK_SIZE // 256)
+    sha256 = hashlib.sha256(data).hexdigest()
+    requests_made = []
+
+    class Response:
+        def __init__(self, headers):
+            start = int(headers["Range"][len("bytes="):-1]) if "Range" in headers else 0
+            self.status_code = 206 if start else 200
+            self.raw = io.BytesIO(data[start:])
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+    def get(url, headers=None, **kwargs):
+        requests_made.append(headers)
+        return Response(headers)
+
+    monkeypatch.setattr(update_common, "DOWNLOAD_PATH", str(tmp_path / "update.zip"))
+    monkeypatch.setattr(update_common.requests, "get", get)
+
+    stop = threading.Event()
+    throttle = Throttle(stop_event=stop)
+    consume = throttle.consume
+
+    def consume_then_pause(count):
+        # The app is closed while the first block is written
+        consume(count)
+        stop.set()
+
+    throttle.consume = consume_then_pause
+    with pytest.raises(DownloadPaused):
+        update_common.download_file("http://server/download", sha256, len(data), throttle=throttle)
+    partial_size = (tmp_path / f"update.zip.{sha256[:16]}.part").stat().st_size
+    assert 0 < partial_size < len(data)
+
+    partial_path, digest = update_common.download_file("http://server/download", sha256, len(data))
+    assert digest == sha256
+    assert requests_made[1] == {"Range": f"bytes={partial_size}-", "If-Range": f'"{sha256}"'}
@@ -2,166 +2,308 @@ import os
 import sys
 import requests
 import hashlib
-import base64
-import platform
-import zipfile
+import json
+import tempfile
+import struct
+import zlib
 import shutil
-import stat
-import io
-
-# Base URL for the API server
-API_BASE_URL = "http://localhost:8000"
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from client.chunking import chunk_boundaries, map_file
+from client.extract import install_zip, recover, rollback, select_install, staged_path, swap_in
+from client.update_common import (API_BASE_URL, CURRENT_INSTALL_PATH, DOWNLOAD_PATH, DOWNLOAD_RETRIES,
+                                  DOWNLOAD_TIMEOUT, INSTALL_DIR, UPDATE_DATA_DIR, download_delta_update,
+                                  download_file, get_os_version, is_retryable, negotiate,
+                                  read_base_artifact_checksum, read_base_artifact_version, read_current_version,
+                                  retain_base_artifact, retry_delay, select_digest, validate_update,
+                                  write_base_artifact_version, write_current_version)
 
 # Endpoints
 API_ENDPOINTS = {
-    "check_version": f"{API_BASE_URL}/check-version",
-    "get_update": f"{API_BASE_URL}/get-update"
+    "negotiate": f"{API_BASE_URL}/negotiate"
 }
 
-# Determine base directory for the updater
-if getattr(sys, 'frozen', False):
-    # If running from a frozen executable
-    BASE_DIR = sys._MEIPASS
-else:
-    # If running from a script
-    BASE_DIR = os.path.dirname(__file__)
-
-VERSION_FILE = os.path.join(BASE_DIR, "client/version.txt")
-EXTRACTED_DIR = os.path.join(BASE_DIR, "client/dist")
-
-def get_os_version():
-    system = platform.system()
-    if system == "Linux":
-        return "linux"
-    elif system == "Darwin":
-        return "macos"
-    elif system == "Windows":
-        return "windows"
-    else:
-        raise ValueError("Unsupported OS. Only Linux, macOS, and Windows are supported.")
+EXTRACTED_DIR = INSTALL_DIR
 
-def read_current_version():
-    try:
-        with open(VERSION_FILE, 'r') as file:
-            version = file.read().strip()
-            return version
-    except FileNotFoundError:
-        print("Version file not found.")
-        return "Unknown version"
-
-def write_current_version(version):
-    with open(VERSION_FILE, 'w') as file:
-        file.write(version)
-
-def check_for_updates():
-    os_version = get_os_version()
-    url = f"{API_ENDPOINTS['check_version']}?os_version={os_version}"
-    
-    print(f"Checking for updates for {os_version} ...")
+# Must match MANIFEST_FORMAT in server/manifest.py
+MANIFEST_FORMAT = "anchor-v1"
+
+# Chunk digests of the installed files, reused while a file's size and mtime are unchanged
+CHUNK_INDEX_PATH = os.path.join(UPDATE_DATA_DIR, "chunk_index.json")
+
+# Chunks fetched from the server for an update that hasn't been applied yet
+CHUNK_CACHE_DIR = os.path.join(UPDATE_DATA_DIR, ".chunk-cache")
+CHUNK_FETCH_WORKERS = 8
+
+def negotiate_update():
+    # One request decides whether to update and how: full artifact, delta or chunk manifest
+    print(f"Checking for updates for {get_os_version()} ...")
     try:
-        # Contact the FastAPI server to get the latest version info
-        response = requests.get(url)
-        response.raise_for_status()
-        version_info = response.json()
-
-        current_version = read_current_version()
-        if version_info['version'] != current_version:
-            print("New version available.")
-            return version_info
-        else:
-            print("No updates available.")
-            sys.exit(0)  # Exit with code 0 to indicate no updates
+        return negotiate(API_ENDPOINTS['negotiate'], ["delta", "manifest"], DOWNLOAD_TIMEOUT)
 
     except requests.exceptions.RequestException as e:
         print(f"Failed to check for updates: {e}")
         sys.exit(1)
 
-def get_update_info():
-    os_version = get_os_version()
-    url = f"{API_ENDPOINTS['get_update']}?os_version={os_version}"
-    
-    print(f"Getting update info for {os_version} ...")
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        update_info = response.json()
-        return update_info
+def download_update(update_info):
+    url = urljoin(API_BASE_URL, update_info['download_url'])
+    expected_checksum = update_info['sha256'].lower()
+    algorithm, expected_digest = select_digest(update_info)
+    print(f"Verifying with {algorithm}")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to get update info: {e}")
+    if update_info.get('delta'):
+        try:
+            # The rebuilt artifact must match the full-release digest
+            if validate_update(download_delta_update(update_info, algorithm), expected_digest):
+                print("Checksum validation successful.")
+                return DOWNLOAD_PATH
+            print("Rebuilt artifact failed checksum validation, falling back to full download ...")
+        except (requests.exceptions.RequestException, OSError, ValueError, ImportError, zlib.error, struct.error) as e:
+            print(f"Delta update failed ({e}), falling back to full download ...")
+
+    print(f"Downloading update to {DOWNLOAD_PATH} ...")
+    try:
+        partial_path, computed_digest = download_file(url, expected_checksum, update_info['size'], algorithm)
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+        print(f"Failed to download update: {e}")
+        print("Run the updater again to resume.")
         sys.exit(1)
 
-def validate_update(file_data, expected_checksum):
-    sha256_hash = hashlib.sha256()
-    for byte_block in iter(lambda: file_data.read(4096), b""):
-        sha256_hash.update(byte_block)
-    
-    computed_checksum = sha256_hash.hexdigest()
-    print(f"Expected checksum: {expected_checksum}")
-    print(f"Computed checksum: {computed_checksum}")
-
-    return computed_checksum == expected_checksum
-
-def download_update(download_base64, checksum_base64):
-    print(f"Downloading update ...")
-    file_data = base64.b64decode(download_base64)
-    checksum_data = base64.b64decode(checksum_base64).decode()
-
-    expected_checksum = checksum_data.strip().split()[0]
-    
-    if validate_update(io.BytesIO(file_data), expected_checksum):
+    if validate_update(computed_digest, expected_digest):
         print("Checksum validation successful.")
-        return io.BytesIO(file_data)
+        os.replace(partial_path, DOWNLOAD_PATH)
+        return DOWNLOAD_PATH
     else:
         print("Checksum validation failed.")
+        os.remove(partial_path)
         sys.exit(1)
 
-def extract_zip(file_data):
+def index_installed_chunks():
+    # Map chunk digest -> (relative path, offset, length) for every installed file
+    try:
+        with open(CHUNK_INDEX_PATH, 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        cached = {}
+
+    index = {}
+    chunks = {}
+    for root, _, names in os.walk(EXTRACTED_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                continue
+            relative_path = os.path.relpath(path, EXTRACTED_DIR).replace(os.sep, "/")
+            file_stat = os.stat(path)
+            entry = cached.get(relative_path)
+            if entry is None or entry['size'] != file_stat.st_size or entry['mtime_ns'] != file_stat.st_mtime_ns:
+                with open(path, 'rb') as file:
+                    data = map_file(file)
+                    entry = {
+                        'size': file_stat.st_size,
+                        'mtime_ns': file_stat.st_mtime_ns,
+                        'chunks': [
+                            [hashlib.sha256(data[offset:offset + length]).hexdigest(), offset, length]
+                            for offset, length in chunk_boundaries(data)
+                        ],
+                    }
+            index[relative_path] = entry
+            for sha256, offset, length in entry['chunks']:
+                chunks.setdefault(sha256, (relative_path, offset, length))
+
+    write_chunk_index(index)
+    return chunks
+
+def write_chunk_index(index):
+    with open(CHUNK_INDEX_PATH, 'w') as file:
+        json.dump(index, file)
+
+def get_with_retries(session, url):
+    # Manifests and chunks are admission limited like artifact downloads: wait out a
+    # 503's Retry-After, or a dropped connection, instead of abandoning the chunk update
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            response = session.get(url, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as e:
+            if attempt == DOWNLOAD_RETRIES or not is_retryable(e):
+                raise
+            time.sleep(retry_delay(e, attempt))
+
+def fetch_chunk(session, sha256):
+    path = os.path.join(CHUNK_CACHE_DIR, sha256)
+    if os.path.exists(path):
+        return
+
+    response = get_with_retries(session, urljoin(API_BASE_URL, f"/chunks/{sha256}"))
+    if hashlib.sha256(response.content).hexdigest() != sha256:
+        raise ValueError(f"Chunk {sha256} failed checksum validation")
+
+    with open(path + ".part", 'wb') as file:
+        file.write(response.content)
+    os.replace(path + ".part", path)
+
+def rebuild_from_chunks(manifest, local_chunks, staging_dir):
+    # Write every file of the manifest into the staging directory and return their index entries
+    index = {}
+    handles = {}
+    try:
+        for entry in manifest['files']:
+            path = staged_path(staging_dir, entry['path'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            digest = hashlib.sha256()
+            offset = 0
+            chunks = []
+            with open(path, 'wb') as target:
+                for sha256, length in entry['chunks']:
+                    if sha256 in local_chunks:
+                        relative_path, source_offset, _ = local_chunks[sha256]
+                        if relative_path not in handles:
+                            handles[relative_path] = open(os.path.join(EXTRACTED_DIR, relative_path), 'rb')
+                        source = handles[relative_path]
+                        source.seek(source_offset)
+                        data = source.read(length)
+                    else:
+                        with open(os.path.join(CHUNK_CACHE_DIR, sha256), 'rb') as source:
+                            data = source.read()
+                    target.write(data)
+                    digest.update(data)
+                    chunks.append([sha256, offset, length])
+                    offset += length
+                if os.name == "posix":
+                    os.fchmod(target.fileno(), entry['mode'] or 0o755)
+
+            if digest.hexdigest() != entry['sha256']:
+                raise ValueError(f"Rebuilt {entry['path']} failed checksum validation")
+            file_stat = os.stat(path)
+            index[entry['path']] = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'chunks': chunks}
+
+        for link in manifest['symlinks']:
+            path = staged_path(staging_dir, link['path'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.symlink(link['target'], path)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    return index
+
+def apply_manifest_update(update_info):
+    # Rebuild the new version from chunks already installed plus the missing ones.
+    # Returns False when the caller should fall back to downloading the artifact.
+    if update_info.get('manifest_format') != MANIFEST_FORMAT or not os.path.isdir(EXTRACTED_DIR):
+        return False
+
+    staging_dir = None
+    try:
+        manifest = get_with_retries(requests, urljoin(API_BASE_URL, update_info['manifest_url'])).json()
+
+        local_chunks = index_installed_chunks()
+        missing = {}
+        for entry in manifest['files']:
+            for sha256, length in entry['chunks']:
+                if sha256 not in local_chunks:
+                    missing[sha256] = length
+        total_size = sum(entry['size'] for entry in manifest['files'])
+        print(f"Fetching {len(missing)} chunks ({sum(missing.values())} of {total_size} bytes) ...")
+
+        os.makedirs(CHUNK_CACHE_DIR, exist_ok=True)
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=CHUNK_FETCH_WORKERS) as pool:
+            list(pool.map(lambda sha256: fetch_chunk(session, sha256), missing))
+
+        parent_dir = os.path.dirname(os.path.abspath(EXTRACTED_DIR))
+        staging_dir = os.path.realpath(tempfile.mkdtemp(prefix=".staging-", dir=parent_dir))
+        index = rebuild_from_chunks(manifest, local_chunks, staging_dir)
+        swap_in(staging_dir, EXTRACTED_DIR, update_info['version'])
+        staging_dir = None
+    except (requests.exceptions.RequestException, OSError, ValueError, KeyError) as e:
+        # Fetched chunks stay cached, a retry only downloads what is still missing
+        print(f"Chunk update failed ({e}), falling back to artifact download ...")
+        return False
+    finally:
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    write_chunk_index(index)
+    shutil.rmtree(CHUNK_CACHE_DIR, ignore_errors=True)
+
+    # The retained artifact stays the delta base for the next update. Bases kept before
+    # their version was recorded matched the install this update replaced
+    if read_base_artifact_checksum() is not None and read_base_artifact_version() is None:
+        write_base_artifact_version(read_current_version())
+    return True
+
+def extract_zip(zip_path, version=None):
     print(f"Extracting update to dist directory ({EXTRACTED_DIR}) ...")
     try:
-        # Clear the dist directory before extraction
-        if os.path.isdir(EXTRACTED_DIR):
-            shutil.rmtree(EXTRACTED_DIR)
-        os.makedirs(EXTRACTED_DIR)
-
-        with zipfile.ZipFile(file_data, 'r') as zip_ref:
-            zip_ref.extractall(EXTRACTED_DIR)
-        
+        # Extract into a staging directory and swap it in, the current install is
+        # kept untouched until the new one is complete
+        install_zip(zip_path, EXTRACTED_DIR, version)
         print(f"Update extracted successfully to dist directory ({EXTRACTED_DIR}).")
 
-        # Make extracted files executable based on OS
-        os_version = get_os_version()
-        for root, dirs, files in os.walk(EXTRACTED_DIR):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os_version == "linux" or os_version == "macos":
-                    st = os.stat(file_path)
-                    os.chmod(file_path, st.st_mode | stat.S_IEXEC)
-                elif os_version == "windows":
-                    pass  # Windows handles executability differently
-
     except Exception as e:
         print(f"Error extracting zip file: {e}")
         sys.exit(1)
 
+def select_extracted_dir():
+    # The in-app updater may have installed later versions next to EXTRACTED_DIR, the
+    # version just installed here is the one to start now
+    select_install(CURRENT_INSTALL_PATH, EXTRACTED_DIR)
+
+def rollback_update():
+    try:
+        version = rollback(EXTRACTED_DIR)
+        select_extracted_dir()
+    except OSError as e:
+        print(f"Rollback failed: {e}")
+        sys.exit(1)
+
+    if version:
+        write_current_version(version)
+    print(f"Rolled back to previous version ({version or 'unknown version'}).")
+
 def main():
+    if sys.argv[1:] == ["--rollback"]:
+        rollback_update()
+        return
+
+    # Complete a swap interrupted by a previous run before doing anything else
+    recover(EXTRACTED_DIR)
+
     current_version = read_current_version()
     print(f"Current version: {current_version}")
     try:
-        version_info = check_for_updates()
-        if version_info:
-            update_info = get_update_info()
-            if update_info:
-                file_data = download_update(update_info['download_zip'], update_info['checksum_zip'])
-                extract_zip(file_data)
-                write_current_version(update_info['version'])
-                print("Update has been applied!")
-            else:
-                print("Failed to get update info.")
-                sys.exit(1)
-    except ValueError as e:
+        negotiation = negotiate_update()
+        if not negotiation['update_available']:
+            print("No updates available.")
+            return
+
+        update_info = negotiation['update']
+        print(f"New version available: {update_info['version']} ({negotiation['delivery']} update)")
+        # The server picks the smallest delivery it can offer; the full artifact is
+        # the fallback whenever a chunk rebuild isn't possible
+        if negotiation['delivery'] == "manifest" and apply_manifest_update(update_info):
+            write_current_version(update_info['version'])
+            select_extracted_dir()
+            print("Update has been applied!")
+            return
+        zip_path = download_update(update_info)
+        extract_zip(zip_path, update_info['version'])
+        # The install is swapped in, record its version before anything else can fail
+        write_current_version(update_info['version'])
+        select_extracted_dir()
+        print("Update has been applied!")
+    except (ValueError, OSError) as e:
         print(e)
         sys.exit(1)
 
+    try:
+        retain_base_artifact(zip_path, update_info['sha256'].lower(), update_info['version'])
+    except OSError as e:
+        # Only costs the next update its delta
+        print(f"Could not keep the update as a delta base: {e}")
+
 if __name__ == "__main__":
     main()